@@ -0,0 +1,92 @@
+description = """ a module for handing LVAlert messages to a long-running process over a local (unix domain) socket. lvalert_listen launches a short-lived forwarder for each alert, which passes the message along instead of starting a full process """
+
+#=================================================
+
+import os
+import json
+import socket
+import threading
+import traceback
+import SocketServer
+
+#=================================================
+
+class ConnectError( socket.error ):
+    """
+    raised by send_alert when the server could not be reached, so the alert was certainly not delivered.
+    Any other socket.error from send_alert may come after the server received the alert
+    """
+    pass
+
+def send_alert( path, message, timeout=10.0 ):
+    """
+    sends a single alert message (the raw json string) to the server listening at path.
+    returns the server's reply ("OK" if the alert was accepted).
+    raises ConnectError if we could not connect
+    """
+    sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+    sock.settimeout( timeout )
+    try:
+        try:
+            sock.connect( path )
+        except socket.error as e:
+            raise ConnectError( *e.args )
+        sock.sendall( message )
+        sock.shutdown( socket.SHUT_WR ) ### tell the server we're done sending
+        reply = []
+        while True:
+            data = sock.recv( 4096 )
+            if not data:
+                break
+            reply.append( data )
+    finally:
+        sock.close()
+    return "".join(reply).strip()
+
+class AlertHandler( SocketServer.StreamRequestHandler ):
+    """
+    reads a single alert from the connection and passes the parsed json to the server's callback
+    """
+
+    def handle( self ):
+        message = self.rfile.read()
+        try:
+            alert = json.loads( message )
+        except ValueError:
+            self.wfile.write( "ERROR: could not parse alert\n" )
+            return
+        try:
+            self.server.callback( alert )
+        except Exception as e:
+            traceback.print_exc()
+            self.wfile.write( "ERROR: %s\n"%(e) )
+            return
+        self.wfile.write( "OK\n" )
+
+class AlertServer( SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer ):
+    """
+    listens on a unix domain socket for alerts and hands each one to callback(alert)
+    each connection is handled in its own thread, so callback must be thread safe
+    """
+    daemon_threads = True
+
+    def __init__( self, path, callback ):
+        if os.path.exists( path ): ### left over from a previous server
+            os.remove( path )
+        SocketServer.UnixStreamServer.__init__( self, path, AlertHandler )
+        self.path = path
+        self.callback = callback
+
+    def start( self ):
+        """
+        serve in a background thread
+        """
+        thread = threading.Thread( target=self.serve_forever )
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def server_close( self ):
+        SocketServer.UnixStreamServer.server_close( self )
+        if os.path.exists( self.path ):
+            os.remove( self.path )
@@ -0,0 +1,853 @@
+import re
+import os
+import time
+import Queue
+import urllib
+import logging
+import threading
+import functools
+import traceback
+import collections
+from multiprocessing.pool import ThreadPool
+
+from grinch.approval_utils import timestamp, get_farthresh, get_idqthresh, process_alert, getSignoffs, operatorVerdict, advocateVerdict
+from grinch.approval_utils import checkLabels, parseIdqComment, getJointFapValues
+from grinch.approval_state import EventState, StateStore
+from grinch import seglogic
+from grinch.workflow_helper import home
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+# The default location of the approval_processor config file
+config_path = home + '/opt/etc/approval_processor_config.ini'
+
+# The voevent_type GraceDB records for each kind of VOEvent we send
+voevent_types = {'preliminary':'PR', 'initial':'IN', 'update':'UP', 'retraction':'RE'}
+
+# Look for hardware injections within [event_time+tl, event_time+th]
+def searchInjections(event_time, tl, th):
+	from raven.search import query
+	return query('HardwareInjection', event_time, tl, th)
+
+# Tell the advocates on the phone that an event needs them
+def phoneAdvocates(graceid, advocate_text):
+	return os.system('echo \'{0}\' | mail -s \'Event {1} passed criteria for follow-up.\' lvc-cloud-phone@email2phone.net'.format(advocate_text, graceid))
+
+# Set up logging to the file named in the config. Safe to call more than once.
+def get_logger(config):
+	logger = logging.getLogger('approval_processor')
+	if not logger.handlers:
+		logging_filehandler = logging.FileHandler(config.get('default', 'approval_processor_logfile'))
+		logging_filehandler.setLevel(logging.INFO)
+		logger.addHandler(logging_filehandler)
+	logger.setLevel(logging.INFO)
+	return logger
+
+#--------------------------------------------------------------------------------------
+# Carrying out actions
+#--------------------------------------------------------------------------------------
+
+class ActionExecutor(object):
+	"""
+	carries out a set of actions for an event in stages. The actions in a stage do not depend on each other and run concurrently,
+	and each stage starts only once the one before it has finished.
+	An action that fails is logged and does not stop the others.
+	Actions in a stage with more than one action run on other threads, so they must not touch the event's state. Apply their outcome once run() returns
+	"""
+
+	def __init__(self, logger, workers=4):
+		self.logger = logger
+		self.pool = ThreadPool(workers)
+
+	def run(self, graceid, stages):
+		"""
+		stages is a list of stages, each a list of (description, function) where function takes no arguments.
+		Returns a list of (result, error) for every action in every stage. error is None if the action succeeded; otherwise it is the traceback and result is None
+		"""
+		results = []
+		for stage in stages:
+			if len(stage)==1: # nothing to run it alongside
+				pending = [(description, None, action) for description, action in stage]
+			else:
+				pending = [(description, self.pool.apply_async(action), action) for description, action in stage]
+			for description, result, action in pending:
+				try:
+					if result is None:
+						results.append((action(), None))
+					else:
+						results.append((result.get(), None))
+				except Exception, e:
+					error = traceback.format_exc()
+					self.logger.error('{0} -- {1} -- Failed to {2}: {3}'.format(timestamp(), graceid, description, error))
+					results.append((None, error))
+		return results
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+
+#--------------------------------------------------------------------------------------
+# Processing a single alert
+#--------------------------------------------------------------------------------------
+
+class ApprovalProcessor(object):
+	"""
+	decides what to do with each LVAlert message for an event and does it.
+	The config, the GraceDB client, the logger and the connection to Comet are held between alerts, so a long-running process pays for them only once.
+	Where each event stands is kept in an approval_state.EventState, updated from every alert and every action we take,
+	so decisions do not require downloading the event's log. States are recorded in store (an approval_state.StateStore).
+	With an overflow_stage, the SegDB overflow check of a new event runs in the background and its result comes back to handle_alert
+	as an alert of type 'overflow' (see ApprovalService), so other alerts for the event are processed while we wait for it.
+	Everything that talks to the outside world (GraceDB, Comet, SegDB, the injection search and the advocates' phone) is passed in,
+	so the processor can also be driven against stand-ins (see approval_replay).
+	"""
+
+	def __init__(self, client, config, logger, store=None, sender=None, executor=None, overflow_stage=None,
+		injection_search=searchInjections, phone_advocates=phoneAdvocates, timings=None):
+		self.client = client
+		self.config = config
+		self.logger = logger
+		if store is None:
+			store = StateStore()
+		self.store = store
+		self.sender = sender # a voevent_transport.VOEventSender. None means the one shared by this process
+		if executor is None:
+			executor = ActionExecutor(logger)
+		self.executor = executor
+		self.overflow_stage = overflow_stage # a seglogic.OverflowStage. None means we wait for the overflow check of each new event
+		self.injection_search = injection_search
+		self.phone_advocates = phone_advocates
+		self.timings = timings # anything with record(stage, seconds), e.g. approval_replay.StageTimings
+
+		# Import FAR threshold, iDQ threshold, etc from config file
+		self.ignore_idq = config.get('default', 'ignore_idq')
+		idq_pipelines = config.get('default', 'idq_pipelines')
+		idq_pipelines = idq_pipelines.replace(' ','') # remove any spaces
+		self.idq_pipelines = idq_pipelines.split(',') # a list of iDQ pipelines
+		self.hardware_inj = config.get('default', 'hardware_inj')
+		self.humanscimons = config.get('default', 'humanscimons')
+		self.advocates = config.get('default', 'advocates')
+		self.advocate_text = config.get('default', 'advocate_text')
+
+		# Import list of skymap submitters to ignore
+		self.skymap_ignore_list = config.get('default', 'skymap_ignore_list')
+
+		# Import VOEvent settings
+		self.force_all_internal = config.get('default', 'force_all_internal')
+		self.preliminary_internal = config.get('default', 'preliminary_internal')
+
+	#--------------------------------------------------------------------------------------
+	# Actions. These keep the event's state up to date with what we have done.
+	#--------------------------------------------------------------------------------------
+	# Call function(*args, **kwargs), recording how long it took as stage if we are keeping timings
+	def timed(self, stage, function, *args, **kwargs):
+		if self.timings is None:
+			return function(*args, **kwargs)
+		begin = time.time()
+		try:
+			return function(*args, **kwargs)
+		finally:
+			self.timings.record(stage, time.time()-begin)
+
+	def writeLog(self, state, msg, **kwargs):
+		r = self.timed('log', self.client.writeLog, state.graceid, msg, **kwargs)
+		state.applyLog(msg)
+		return r
+
+	def writeLabel(self, state, label):
+		r = self.timed('label', self.client.writeLabel, state.graceid, label)
+		state.addLabel(label)
+		return r
+
+	# Record a log message in the event's state now, but only queue it in logs to be written to GraceDB by flushLogs
+	def deferLog(self, state, logs, msg, tagname=None):
+		state.applyLog(msg)
+		logs.append((msg, tagname))
+
+	# Write the queued log messages to GraceDB in the order they were queued
+	def flushLogs(self, state, logs):
+		while logs:
+			msg, tagname = logs.pop(0)
+			try:
+				r = self.timed('log', self.client.writeLog, state.graceid, msg, tagname=tagname)
+			except Exception, e:
+				self.logger.error('{0} -- {1} -- Failed to write log message "{2}": {3}'.format(timestamp(), state.graceid, msg, str(e)))
+
+	def sendVOEvent(self, state, voevent_type, skymap_filename=None, skymap_type=None, skymap_image_filename=None, internal=1, deferred_logs=None):
+		voevent = self.timed('VOEvent', process_alert, self.client, self.logger, state.graceid, voevent_type, skymap_filename, skymap_type, skymap_image_filename, internal, sender=self.sender, deferred_logs=deferred_logs)
+		if voevent:
+			state.addVoevent(dict(voevent, voevent_type=voevent.get('voevent_type', voevent_types[voevent_type])))
+		return voevent
+
+	# The event's signoffs ({instrument : status}). The list is downloaded from GraceDB only the first time we need it,
+	# after which it is kept up to date from signoff alerts, so the human scimon and advocate checks share a single download
+	def getSignoffs(self, state):
+		if not state.signoffs_complete:
+			state.setSignoffs(self.timed('signoffs', getSignoffs, self.client, state.graceid))
+		return state.signoffs
+
+	# A common set of tasks related to human signoffs. Returns True if we should carry on.
+	def passesHumanSignoffs(self, state, detectors):
+		graceid = state.graceid
+		signoffResult = operatorVerdict(self.logger, graceid, self.getSignoffs(state), detectors)
+		if signoffResult=='Fail':
+			msg = 'AP: Finished running human signoff checks. Candidate event failed human signoff checks.'
+			r = self.writeLog(state, msg, tagname='em_follow')
+			self.logger.info('{0} -- {1} -- Labeling with DQV.'.format(timestamp(), graceid))
+			r = self.writeLabel(state, 'DQV')
+			return False
+		elif signoffResult=='Pass':
+			msg = 'AP: Finished running human signoff checks. Candidate event passed human signoff checks.'
+			r = self.writeLog(state, msg, tagname='em_follow')
+			return True
+		else:
+			self.logger.info('{0} -- {1} -- No action taken due to scimon status.'.format(timestamp(), graceid))
+			return False
+
+	# A common set of tasks related to the advocate signoff. Returns True if we should carry on.
+	def passesAdvocateSignoff(self, state):
+		graceid = state.graceid
+		signoffResult = advocateVerdict(self.logger, graceid, self.getSignoffs(state))
+		if signoffResult=='Fail':
+			msg = 'AP: Finished running advocate check. Candidate event failed advocate check.'
+			r = self.writeLog(state, msg, tagname='em_follow')
+			self.logger.info('{0} -- {1} -- Labeling with DQV.'.format(timestamp(), graceid))
+			r = self.writeLabel(state, 'DQV')
+			return False
+		elif signoffResult=='Pass':
+			msg = 'AP: Finished running advocate check. Candidate event passed advocate check.'
+			r = self.writeLog(state, msg, tagname='em_follow')
+			return True
+		else:
+			self.logger.info('{0} -- {1} -- No action taken due to advocate status.'.format(timestamp(), graceid))
+			return False
+
+	# Set internal value settings for VOEvents
+	def getInternal(self):
+		if self.force_all_internal == 'yes':
+			return 1
+		else:
+			return 0
+
+	#--------------------------------------------------------------------------------------
+	# Dispatching alerts
+	#--------------------------------------------------------------------------------------
+	def getState(self, streamdata):
+		"""
+		the state of the alert's event, updated with the alert itself. Returns None if we know nothing about the event and cannot reach GraceDB
+		"""
+		graceid = streamdata['uid']
+		state = self.store.get(graceid)
+		if state is None:
+			if streamdata['alert_type'] == 'new': # everything we need is in the alert
+				state = EventState(graceid)
+			else:
+				self.logger.info('{0} -- {1} -- No record of this event. Reading its state from GraceDB.'.format(timestamp(), graceid))
+				try:
+					state = EventState.from_gracedb(self.client, graceid)
+				except Exception, e:
+					self.logger.error('{0} -- {1} -- Connection to GraceDB failed: {2}.'.format(timestamp(), graceid, str(e)))
+					return None
+		state.update(streamdata)
+		return state
+
+	def handle_alert(self, streamdata):
+		"""
+		processes a single LVAlert message (already parsed from json)
+		"""
+		alert_type = streamdata['alert_type']
+		graceid = streamdata['uid']
+		begintime = time.time()
+
+		# XXX If the graceid starts with 'M' for MDCs or 'S' for Simulation, we want to ignore the event.
+		if re.match('M', graceid) or re.match('S', graceid):
+			self.logger.error('{0} -- {1} -- Mock data challenge or simulation. Quitting.'.format(timestamp(), graceid))
+			return
+
+		if alert_type not in ['label', 'new', 'update', 'signoff', 'overflow']:
+			# GraceDB gave us a strange alert type.
+			self.logger.error('{0} -- {1} -- Alert type {2} unrecognized. Quitting'.format(timestamp(), graceid, alert_type))
+			return
+
+		state = self.timed('state', self.getState, streamdata)
+		if state is None:
+			return
+		try:
+			if alert_type == 'label':
+				self.handleLabel(streamdata, state)
+			elif alert_type == 'new':
+				self.handleNew(streamdata, state)
+			elif alert_type == 'update':
+				self.handleUpdate(streamdata, state)
+			elif alert_type == 'signoff':
+				self.handleSignoff(streamdata, state)
+			elif alert_type == 'overflow':
+				self.handleOverflow(streamdata, state)
+		finally:
+			self.store.put(state) # record whatever we managed to do
+
+		self.logger.debug('{0} -- {1} -- Process time: {2} s.'.format(timestamp(), graceid, time.time()-begintime))
+		if self.timings is not None:
+			self.timings.record('{0} alert'.format(alert_type), time.time()-begintime)
+
+	# The FAR, pipeline and search of an event. far is None if the event is missing a FAR
+	def getFar(self, state):
+		event_dict = state.event
+		far = event_dict['far']
+		pipeline = event_dict['pipeline']
+		search = event_dict['search'] or ''
+		return far, pipeline, search
+
+	#--------------------------------------------------------------------------------------
+	# Handle labeling events
+	#--------------------------------------------------------------------------------------
+	def handleLabel(self, streamdata, state):
+		logger = self.logger
+		graceid = state.graceid
+		description = streamdata['description']
+
+		far, pipeline, search = self.getFar(state)
+		if far==None:
+			logger.info('{0} -- {1} -- Event missing FAR. Not processing label.'.format(timestamp(), graceid))
+			return
+		farthresh = get_farthresh(self.config, pipeline, search)
+
+		# First check FAR
+		if far >= farthresh:
+			logger.info('{0} -- {1} -- Ignoring update due to high FAR.'.format(timestamp(), graceid))
+			return
+
+		internal = self.getInternal()
+
+		if description == 'PE_READY':
+			logger.info('{0} -- {1} -- Submitting update VOEvent to GCN.'.format(timestamp(), graceid))
+			self.sendSkymapAlert(state, 'update', internal)
+		elif description == 'EM_READY':
+			logger.info('{0} -- {1} -- Submitting initial VOEvent to GCN.'.format(timestamp(), graceid))
+			self.sendSkymapAlert(state, 'initial', internal)
+		elif (checkLabels(self.hardware_inj, description.split()) > 0):
+			# Check: Have we already sent out alerts on this event?
+			if len(state.voevents):
+				for voevent in state.voevents:
+					if voevent['voevent_type'] == 'RE':
+						# We have already sent a retraction.
+						# Thus, no action is necessary.
+						return
+				# There are existing VOEvents, but we haven't already sent a
+				# retraction, so let's do that.
+				# Check whether to keep internal = 1 or 0 for retraction alert
+				if (self.force_all_internal!='yes') and (pipeline in self.preliminary_internal):
+					if state.latestVoeventType() == 'PR':
+						internal = 1
+					else:
+						internal = 0
+				self.sendVOEvent(state, 'retraction', None, None, None, internal)
+
+	# Send a VOEvent referencing the most recent skymap that was not submitted by someone we ignore
+	def sendSkymapAlert(self, state, voevent_type, internal):
+		for skymap_filename, skymap_type, submitter in reversed(state.skymaps): # reversed pulls the most recent skymap to reference in the VOEvent
+			skymapname = re.findall(r'(\S+).fits', skymap_filename)[0]
+			skymap_type = skymapname + '-' + skymap_type
+			skymap_image_filename = skymapname + '.png'
+			if submitter in self.skymap_ignore_list:
+				pass
+			else:
+				self.sendVOEvent(state, voevent_type, skymap_filename, skymap_type, skymap_image_filename, internal)
+				break
+
+	#--------------------------------------------------------------------------------------
+	# Handle new candidate event
+	#--------------------------------------------------------------------------------------
+	def handleNew(self, streamdata, state):
+		logger = self.logger
+		graceid = state.graceid
+
+		if state.injection is not None:
+			logger.info('{0} -- {1} -- Already processed this new event. Ignoring.'.format(timestamp(), graceid))
+			return
+
+		logger.info('{0} -- {1} -- Got new event.'.format(timestamp(), graceid))
+		# Log messages are recorded in the event's state straight away but only written to GraceDB at the end,
+		# so that nothing waits on them before the VOEvent and the notifications go out
+		logs = []
+		try:
+			self.processNew(streamdata, state, logs)
+		finally:
+			self.flushLogs(state, logs)
+
+	def processNew(self, streamdata, state, logs):
+		g = self.client
+		logger = self.logger
+		graceid = state.graceid
+
+		# Get event information from streamdata
+		event_dict = streamdata['object']
+		far, pipeline, search = self.getFar(state)
+		if far==None:
+			logger.info('{0} -- {1} -- Event missing FAR. Not processing new event.'.format(timestamp(), graceid))
+			self.deferLog(state, logs, 'AP: Candidate event missing FAR.', tagname = 'em_follow')
+			return
+		event_time = float(state.event['gpstime'])
+
+		# Check whether there's a Hardware Injection found +/-2 seconds of this event gpstime
+		th = 2
+		tl = -th
+		Injections = self.timed('injection search', self.injection_search, event_time, tl, th)
+		if len(Injections) > 0:
+			logger.info('{0} -- {1} -- Labeling with INJ.'.format(timestamp(), graceid))
+			r = self.writeLabel(state, 'INJ')
+			if self.hardware_inj=='no':
+				logger.info('{0} -- {1} -- Ignoring new event because we found a hardware injection +/- {2} seconds of event gpstime.'.format(timestamp(), graceid, th))
+				self.deferLog(state, logs, 'AP: Ignoring new event because we found a hardware injection +/- {0} seconds of event gpstime.'.format(th), tagname = 'em_follow')
+				return
+			else:
+				logger.info('{0} -- {1} -- Found hardware injection +/- {2} seconds of event gpstime but treating as real event in config.'.format(timestamp(), graceid, th))
+				self.deferLog(state, logs, 'AP: Found hardware injection +/- {0} seconds of event gpstime but treating as real event in config.'.format(th), tagname = 'em_follow')
+		else:
+			logger.info('{0} -- {1} -- No hardware injection found near event gpstime +/- {2} seconds.'.format(timestamp(), graceid, th))
+			self.deferLog(state, logs, 'AP: No hardware injection found near event gpstime +/- {0} seconds.'.format(th), tagname = 'em_follow')
+
+		# Calculate the FAR threshold for this event
+		farthresh = get_farthresh(self.config, pipeline, search)
+
+		# If FAR is above threshold, or if event is labeled INJ or DQV, do not create alert
+		# Also log message saying why no alert was created
+		if far >= farthresh:
+			logger.info('{0} -- {1} -- Rejected due to large FAR. {2} >= {3}'.format(timestamp(), graceid, far, farthresh))
+			self.deferLog(state, logs, 'AP: Candidate event rejected due to large FAR. {0} >= {1}'.format(far, farthresh), tagname = 'em_follow')
+			return
+		state.far = 'Pass'
+		if checkLabels(self.hardware_inj, state.labels) > 0:
+			logger.info('{0} -- {1} -- Ignoring new event due to INJ or DQV.'.format(timestamp(), graceid))
+			self.deferLog(state, logs, 'AP: Candidate event rejected due to INJ or DQV label.', tagname = 'em_follow')
+			return
+
+		if self.overflow_stage is None:
+			self.overflowChecked(state, self.timed('overflow check', self.overflowCheck, graceid, event_time), logs)
+		else:
+			# The overflow check waits for data after the event, so we carry on with other alerts in the meantime
+			logger.info('{0} -- {1} -- Scheduled SegDB overflow check.'.format(timestamp(), graceid))
+			state.overflow = 'Pending'
+			self.overflow_stage.schedule(event_time, g, graceid)
+
+	#--------------------------------------------------------------------------------------
+	# Handle the result of a SegDB overflow check run in the background
+	#--------------------------------------------------------------------------------------
+	def handleOverflow(self, streamdata, state):
+		logger = self.logger
+		graceid = state.graceid
+
+		if state.overflow != 'Pending':
+			logger.info('{0} -- {1} -- Not waiting for a SegDB overflow check. Ignoring.'.format(timestamp(), graceid))
+			return
+		failed = streamdata['object']['failed']
+		if failed:
+			logger.error('{0} -- {1} -- SegDB overflow check failed to query {2}. Not processing new event.'.format(timestamp(), graceid, ', '.join(failed)))
+			state.overflow = None
+			return
+
+		logs = []
+		try:
+			self.overflowChecked(state, streamdata['object']['overflow'], logs)
+		finally:
+			self.flushLogs(state, logs)
+
+	# Carry on with a new event once the SegDB overflow check has finished
+	def overflowChecked(self, state, overflow_dict, logs):
+		g = self.client
+		logger = self.logger
+		graceid = state.graceid
+		far, pipeline, search = self.getFar(state)
+
+		if overflow_dict and min(overflow_dict.values()) > 1:
+			self.deferLog(state, logs, 'AP: Candidate event failed SegDB overflow check.', tagname = 'em_follow')
+			r = self.writeLabel(state, 'DQV')
+			return
+		else:
+			self.deferLog(state, logs, 'AP: Candidate event passed SegDB overflow check.', tagname = 'em_follow')
+
+		# The event may have been labeled while the check was running
+		if checkLabels(self.hardware_inj, state.labels) > 0:
+			logger.info('{0} -- {1} -- Ignoring new event due to INJ or DQV.'.format(timestamp(), graceid))
+			self.deferLog(state, logs, 'AP: Candidate event rejected due to INJ or DQV label.', tagname = 'em_follow')
+			return
+
+		# Set internal value settings for VOEvents
+		if self.force_all_internal == 'yes':
+			internal = 1
+		else:
+			if pipeline in self.preliminary_internal:
+				internal = 1
+			else:
+				internal = 0
+
+		# The preliminary VOEvent goes out first. Then we notify the human scimons and the advocates all at once
+		detectors = str(state.event['instruments']).split(',')
+		# The notifications run on the executor's threads, so they only talk to GraceDB and the labels are added to the state here afterwards
+		labels = ['{0}OPS'.format(detector) for detector in detectors] + ['ADVREQ']
+		notifications = []
+		for label in labels:
+			logger.info('{0} -- {1} -- Labeling with {2}.'.format(timestamp(), graceid, label))
+			notifications.append(('label with {0}'.format(label), functools.partial(self.timed, 'label', g.writeLabel, graceid, label)))
+		notifications.append(('phone the advocates', functools.partial(self.timed, 'phone advocates', self.phone_advocates, graceid, self.advocate_text)))
+		results = self.executor.run(graceid, [
+			[('send the preliminary VOEvent', functools.partial(self.sendVOEvent, state, 'preliminary', None, None, None, internal, deferred_logs=logs))],
+			notifications,
+		])
+		for label, (result, error) in zip(labels, results[1:]):
+			if error is None:
+				state.addLabel(label)
+
+		# A skymap that arrived while the overflow check was running was not acted on, since there was no preliminary VOEvent yet
+		skymaps = [skymap for skymap in state.skymaps if skymap[2] not in self.skymap_ignore_list]
+		if skymaps and state.latestVoeventType()=='PR' and 'EM_READY' not in state.labels:
+			if state.event['group'] in self.ignore_idq or state.idq=='Pass':
+				if (self.humanscimons!='yes' or self.passesHumanSignoffs(state, detectors)) and (self.advocates!='yes' or self.passesAdvocateSignoff(state)):
+					logger.info('{0} -- {1} -- Labeling with EM_READY.'.format(timestamp(), graceid))
+					r = self.writeLabel(state, 'EM_READY')
+
+		# Expose event to LV-EM
+		url_perm_base = g.service_url + urllib.quote('events/{0}/perms/gw-astronomy:LV-EM:Observers/'.format(graceid))
+		for perm in ['view', 'change']:
+			url = url_perm_base + perm
+#			r = g.put(url)
+
+	# Restart the overflow checks we were waiting for when we last stopped
+	def resumeOverflowChecks(self):
+		for state in self.store.find(lambda state: state.overflow == 'Pending'):
+			self.logger.info('{0} -- {1} -- Resuming SegDB overflow check.'.format(timestamp(), state.graceid))
+			self.overflow_stage.schedule(float(state.event['gpstime']), self.client, state.graceid)
+
+	# Query SegDB for the overflow flags listed in the config and return {flag: active fraction}
+	def overflowCheck(self, graceid, event_time):
+		return seglogic.overflowCheck(self.config, event_time, self.client, graceid)
+
+	#--------------------------------------------------------------------------------------
+	# Handle uploaded files
+	#--------------------------------------------------------------------------------------
+	def handleUpdate(self, streamdata, state):
+		g = self.client
+		logger = self.logger
+		graceid = state.graceid
+		filename = streamdata['file']
+
+		# VOEvents and log messages have already been recorded in the event's state
+		if 'voevent_type' in streamdata['object']:
+			return
+
+		far, pipeline, search = self.getFar(state)
+		if far==None:
+			logger.info('{0} -- {1} -- Event missing FAR. Not processing update.'.format(timestamp(), graceid))
+			return
+		group = state.event['group']
+		detectors = str(state.event['instruments']).split(',')
+		farthresh = get_farthresh(self.config, pipeline, search)
+
+		# First check FAR and labels
+		if (far >= farthresh or (checkLabels(self.hardware_inj, state.labels) > 0)):
+			logger.info('{0} -- {1} -- Ignoring update due to INJ, DQV, or high FAR.'.format(timestamp(), graceid))
+			return
+
+		# Determine the value of use_idq depending on the event group
+		if group in self.ignore_idq:
+			use_idq = 'no'
+		else:
+			use_idq = 'yes'
+			idqthresh = get_idqthresh(self.config, pipeline, search)
+
+		# Check whether the file in question is a skymap
+		# We assume that any file with the .fits or .fits.gz extension *and* the 'sky_loc' tag will be a skymap
+		# The tag names should also contain provenance information for the skymap, which could be useful here
+
+		#XXX Right now, 'sky_loc' tag does not appear under tag_names section of the alert that tips off lvalert_listen.
+		#XXX Eventually change this to-- if (filename.endswith('.fits.gz') or filename.endswith('.fits')) and 'sky_loc' in tag_names:
+		if (filename.endswith('.fits.gz') or filename.endswith('.fits')):
+			# First, get the submitter name
+			skymap_filename = filename
+			skymap_type = group + search
+			display_name = streamdata['object']['issuer']['display_name']
+
+			# Check tag has lvem
+			tag_names = streamdata['object']['tag_names']
+			if 'lvem' not in tag_names:
+				return
+
+			msg = 'AP: Last skymap submitted with lvem tag was {0} type {1} by {2}.'.format(skymap_filename, skymap_type, display_name)
+			r = self.writeLog(state, msg.replace('  ',' '))
+
+			if display_name in self.skymap_ignore_list:
+				return
+
+			# If new skymaps are loaded, check if the event has passed iDQ checks and label the event as either 'EM_READY' or 'PE_READY'
+			#'EM_READY' is the label set if there have been no previous skymaps
+			# 'PE_READY' is the label set if we've already sent out an Initial Localization VOEvent
+
+			logger.info('{0} -- {1} -- Got skymap {2}.'.format(timestamp(), graceid, filename))
+
+			latest_voevent_type = state.latestVoeventType()
+			if latest_voevent_type == 'UP':
+				skymapname = re.findall(r'(\S+).fits', skymap_filename)[0]
+				skymap_image_filename = skymapname + '.png'
+				self.sendVOEvent(state, 'update', skymap_filename, skymap_type, skymap_image_filename, self.getInternal())
+			elif latest_voevent_type == 'IN':
+				# Set label 'PE_READY' since the initial_localization alert was already created and/or sent out
+				# It must already be labeled EM_READY
+				logger.info('{0} -- {1} -- Labeling with PE_READY.'.format(timestamp(), graceid))
+				r = self.writeLabel(state, 'PE_READY')
+			elif latest_voevent_type == 'PR':
+				# XXX Note: this assumes that there has been at least a Preliminary VOEvent.
+				# We want to apply the EM_READY label as long as the event passes iDQ and
+				# human scimon checks (if necessary)
+				if use_idq=='yes':
+					if not state.idq=='Pass':
+						logger.info('{0} -- {1} -- No action taken on skymap due to iDQ status'.format(timestamp(), graceid))
+						return
+
+				if self.humanscimons=='yes':
+					if not self.passesHumanSignoffs(state, detectors):
+						return
+
+				if self.advocates=='yes':
+					if not self.passesAdvocateSignoff(state):
+						return
+
+				# If we're still here, we are ready to apply the EM_READY label
+				logger.info('{0} -- {1} -- Labeling with EM_READY.'.format(timestamp(), graceid))
+				r = self.writeLabel(state, 'EM_READY')
+
+		# iDQ minimum glitch-FAP information now loaded with a json file
+		#if filename.endswith('.json'):
+		else:
+			comment = streamdata['object'].get('comment', '')
+			if not re.match('minimum glitch-FAP', comment):
+				return
+			elif use_idq=='yes':
+				idq_pipelines = self.idq_pipelines
+				# The value in this alert has already been added to the event's state
+				idqinfo = parseIdqComment(comment)
+				if idqinfo:
+					logger.info('{0} -- {1} -- Got the min_fap for {2} is {3}.'.format(timestamp(), graceid, idqinfo[0], idqinfo[1]))
+				idqvalues = state.idqvalues
+				if (len(idqvalues) < (len(idq_pipelines)*len(detectors))):
+					# We may have missed some alerts (or never had them if we rebuilt the state from GraceDB), so catch up from the log once
+					for message in g.logs(graceid).json()['log']:
+						state.applyLog(message['comment'])
+				joint_FAP_values = getJointFapValues(idqvalues, idq_pipelines)
+
+				if (len(idqvalues) < (len(idq_pipelines)*len(detectors))):
+					logger.info('{0} -- {1} -- Have not gotten all the minfap values yet.'.format(timestamp(), graceid))
+					if (min(idqvalues.values() and joint_FAP_values.values()) < idqthresh):
+						r = self.writeLog(state, 'AP: Finished running iDQ checks. Candidate event rejected because incomplete joint min-FAP value already less than iDQ threshold. {0} < {1}'.format(min(idqvalues.values() and joint_FAP_values.values()), idqthresh), tagname = 'em_follow')
+						logger.info('{0} -- {1} -- iDQ check failed. Labeling with DQV.'.format(timestamp(), graceid))
+						r = self.writeLabel(state, 'DQV')
+						return
+
+				elif (len(idqvalues) > (len(idq_pipelines)*len(detectors))):
+					logger.info('{0} -- {1} -- Too many minfap values in idqvalues dictionary.'.format(timestamp(), graceid))
+				else:
+					logger.info('{0} -- {1} -- Ready to run idq_checks.'.format(timestamp(), graceid))
+					# First make sure that we haven't already run the checks -- we don't want to over-send alerts
+					if state.idq is not None:
+						return
+
+					# Now that iDQ checks are finished, we want to know whether the event passed the iDQ checks or not.
+					# If they don't pass the checks, we set the label 'DQV'
+					# If they do pass the checks, we write a log message saying that they did
+					# 'glitch-FAP' is the probability that the classifier thinks there was a glitch and *there was not a glitch*
+					# 'glitch-FAP' -> 0 means high confidence there is a glitch
+					# 'glitch-FAP' -> 1 means low confidence there is a glitch
+					# What we want is something like the minimum of the products of FAPS from different sites computed for each classifier
+					# Calculate the joint_FAP values for all the iDQ pipelines
+					for idq_pipeline in idq_pipelines:
+						joint_FAP = 1
+						for detector in detectors:
+							detectorstring = '{0}.{1}'.format(idq_pipeline, detector)
+							joint_FAP = joint_FAP*idqvalues[detectorstring]
+						joint_FAP_values[idq_pipeline] = joint_FAP
+						logger.info('{0} -- {1} -- Got joint_FAP = {2} for iDQ pipeline {3}.'.format(timestamp(), graceid, joint_FAP, idq_pipeline))
+
+					if min(joint_FAP_values.values()) > idqthresh:
+						logger.info('{0} -- {1} -- Passed iDQ check.'.format(timestamp(), graceid))
+						r = self.writeLog(state, 'AP: Finished running iDQ checks. Candidate event passed iDQ checks. {0} > {1}'.format(min(joint_FAP_values.values()), idqthresh), tagname='em_follow')
+
+						if self.humanscimons=='yes':
+							if not self.passesHumanSignoffs(state, detectors):
+								return
+
+						if self.advocates=='yes':
+							if not self.passesAdvocateSignoff(state):
+								return
+
+						# If there is a skymap, set label 'EM_READY'
+						if state.skymaps:
+							logger.info('{0} -- {1} -- Labeling with EM_READY.'.format(timestamp(), graceid))
+							r = self.writeLabel(state, 'EM_READY')
+					else:
+						r = self.writeLog(state, 'AP: Finished running iDQ checks. Candidate event rejected due to low iDQ FAP value. {0} < {1}'.format(min(joint_FAP_values.values()), idqthresh), tagname = 'em_follow')
+						logger.info('{0} -- {1} -- iDQ check failed. Labeling with DQV.'.format(timestamp(), graceid))
+						r = self.writeLabel(state, 'DQV')
+
+	#--------------------------------------------------------------------------------------
+	# Handle signoffs
+	#--------------------------------------------------------------------------------------
+	def handleSignoff(self, streamdata, state):
+		logger = self.logger
+		graceid = state.graceid
+
+		far, pipeline, search = self.getFar(state)
+		if far==None:
+			logger.info('{0} -- {1} -- Event missing FAR. Not processing signoff.'.format(timestamp(), graceid))
+			return
+		group = state.event['group']
+		farthresh = get_farthresh(self.config, pipeline, search)
+
+		# First check FAR and labels
+		if (far >= farthresh or (checkLabels(self.hardware_inj, state.labels) > 0)):
+			logger.info('{0} -- {1} -- Ignoring update due to INJ, DQV, or high FAR.'.format(timestamp(), graceid))
+			return
+
+		# Determine the value of use_idq depending on the event group
+		if group in self.ignore_idq:
+			use_idq = 'no'
+		else:
+			use_idq = 'yes'
+
+		signoff_object = streamdata['object']
+		signoff_type = signoff_object['signoff_type']
+		# Get the status, 'OK' means 'okay' and 'NO' means 'not okay'
+		status = signoff_object['status']
+		# Since we need to check the response from all detector sites, get the list of detectors for event
+		detectors = str(state.event['instruments']).split(',')
+
+		if signoff_type=='OP':
+			if self.humanscimons=='yes':
+				if not self.passesHumanSignoffs(state, detectors):
+					return
+				if self.advocates=='yes':
+					if not self.passesAdvocateSignoff(state):
+						return
+			else:
+				if status=='NO':
+					msg = 'AP: Candidate event failed human signoff checks.'
+					r = self.writeLog(state, msg, tagname='em_follow')
+					logger.info('{0} -- {1} -- Labeling with DQV.'.format(timestamp(), graceid))
+					r = self.writeLabel(state, 'DQV')
+					return
+				elif status=='OK':
+					if self.advocates=='yes':
+						if not self.passesAdvocateSignoff(state):
+							return
+
+		if signoff_type=='ADV':
+			if self.advocates=='yes':
+				if not self.passesAdvocateSignoff(state):
+					return
+				if self.humanscimons=='yes':
+					if not self.passesHumanSignoffs(state, detectors):
+						return
+			else:
+				if status=='NO':
+					msg = 'AP: Candidate event failed advocate check.'
+					r = self.writeLog(state, msg, tagname='em_follow')
+					logger.info('{0} -- {1} -- Labeling with DQV.'.format(timestamp(), graceid))
+					r = self.writeLabel(state, 'DQV')
+					return
+				elif status=='OK':
+					msg = 'AP: Candidate event passed advocate check.'
+					r = self.writeLog(state, msg, tagname='em_follow')
+					if self.humanscimons=='yes':
+						if not self.passesHumanSignoffs(state, detectors):
+							return
+
+		# We need a skymap (and to have passed iDQ checks if we use them) before the EM_READY label is set
+		if state.skymaps and (use_idq!='yes' or state.idq=='Pass'):
+			logger.info('{0} -- {1} -- Labeling with EM_READY.'.format(timestamp(), graceid))
+			r = self.writeLabel(state, 'EM_READY')
+
+#--------------------------------------------------------------------------------------
+# Processing alerts in a long-running service
+#--------------------------------------------------------------------------------------
+
+class ApprovalService(object):
+	"""
+	hands alerts to an ApprovalProcessor on a pool of worker threads.
+	Alerts for different events are processed concurrently, while alerts for the same event are processed one at a time in the order they arrived.
+	submit() returns immediately, so it can be used as the callback of an alert_socket.AlertServer.
+	If the processor has an overflow_stage, the result of each overflow check is submitted as an alert of type 'overflow' for its event
+	"""
+
+	def __init__(self, processor, workers=4):
+		self.processor = processor
+		self.workers = workers
+		self.pending = {} # graceid -> deque of alerts waiting for that event
+		self.ready = Queue.Queue() # graceids with alerts waiting and no worker processing them
+		self.lock = threading.Lock()
+		self.threads = []
+
+	def idle(self):
+		"""
+		True if every alert submitted so far has been processed
+		"""
+		self.lock.acquire()
+		try:
+			return not self.pending
+		finally:
+			self.lock.release()
+
+	def submit(self, alert):
+		graceid = alert['uid']
+		self.lock.acquire()
+		try:
+			if self.pending.has_key(graceid): # a worker already owns this event and will get to this alert
+				self.pending[graceid].append(alert)
+			else:
+				self.pending[graceid] = collections.deque([alert])
+				self.ready.put(graceid)
+		finally:
+			self.lock.release()
+
+	def overflowFinished(self, graceid, overflow_dict, failed):
+		self.submit({'uid':graceid, 'alert_type':'overflow', 'object':{'overflow':overflow_dict, 'failed':failed}})
+
+	def start(self):
+		for i in xrange(self.workers):
+			thread = threading.Thread(target=self._work)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+		if self.processor.overflow_stage is not None:
+			self.processor.overflow_stage.start(self.overflowFinished)
+			self.processor.resumeOverflowChecks()
+
+	def stop(self):
+		"""
+		waits for the alerts already received to be processed. Overflow checks still waiting on their deadline are resumed when we next start
+		"""
+		if self.processor.overflow_stage is not None:
+			self.processor.overflow_stage.stop()
+		for thread in self.threads:
+			self.ready.put(None)
+		for thread in self.threads:
+			thread.join()
+		self.threads = []
+
+	def _work(self):
+		while True:
+			graceid = self.ready.get()
+			if graceid is None:
+				return
+			while True:
+				self.lock.acquire()
+				try:
+					if not self.pending[graceid]:
+						self.pending.pop(graceid)
+						break
+					alert = self.pending[graceid].popleft()
+				finally:
+					self.lock.release()
+				try:
+					self.processor.handle_alert(alert)
+				except Exception, e:
+					self.processor.logger.error('{0} -- {1} -- Failed to process {2} alert: {3}'.format(timestamp(), graceid, alert['alert_type'], traceback.format_exc()))
@@ -0,0 +1,292 @@
+import json
+import time
+import logging
+import threading
+
+from grinch import quantiles
+from grinch.approval_processor import ApprovalProcessor, ApprovalService, voevent_types
+from grinch.approval_state import StateStore
+from grinch.seglogic import OverflowStage
+from grinch.voevent_transport import Delivery
+
+#--------------------------------------------------------------------------------------
+# Stand-ins for the outside world
+#--------------------------------------------------------------------------------------
+
+class Response(object):
+	"""
+	what the GraceDB client returns from a request
+	"""
+
+	def __init__(self, data):
+		self.data = data
+
+	def json(self):
+		return self.data
+
+class LocalGraceDb(object):
+	"""
+	an in-memory stand-in for the GraceDB client, holding only what approval_processor uses.
+	It learns about events from the alerts we replay (see record) and keeps a log of every action taken on it.
+	Every request takes latency seconds, to mimic the round trip to the real GraceDB.
+	If echo is given, each log message, label and VOEvent we are asked to write is passed to echo as the LVAlert GraceDB would send about it
+	"""
+
+	service_url = 'https://localhost/api/'
+	templates = {'signoff-list-template': 'https://localhost/api/events/{graceid}/signoff/'}
+
+	def __init__(self, latency=0.0, echo=None):
+		self.latency = latency
+		self.echo = echo
+		self.begin = time.time()
+
+		self.events_dict = {} # graceid -> the event, as in a 'new' alert
+		self.logs_dict = {} # graceid -> [{'comment', 'tag_names'}]
+		self.labels_dict = {} # graceid -> [label]
+		self.voevents_dict = {} # graceid -> [{'N', 'voevent_type', 'text'}]
+		self.signoffs_dict = {} # graceid -> [{'instrument', 'status', 'signoff_type'}]
+		self.actions = [] # (seconds since we started, graceid, action, detail)
+		self.lock = threading.Lock()
+
+	def request(self):
+		if self.latency:
+			time.sleep(self.latency)
+
+	def act(self, graceid, action, detail):
+		self.actions.append((time.time()-self.begin, graceid, action, detail))
+
+	def record(self, alert):
+		"""
+		updates what we hold with an alert that GraceDB sent about itself
+		"""
+		graceid = alert['uid']
+		obj = alert.get('object', {})
+		self.lock.acquire()
+		try:
+			if alert['alert_type'] == 'new':
+				self.events_dict[graceid] = obj
+			elif alert['alert_type'] == 'label':
+				self.labels_dict.setdefault(graceid, []).append(alert['description'])
+			elif alert['alert_type'] == 'signoff':
+				self.signoffs_dict.setdefault(graceid, []).append(obj)
+			elif alert['alert_type'] == 'update':
+				if 'voevent_type' in obj:
+					self.voevents_dict.setdefault(graceid, []).append(obj)
+				elif 'comment' in obj:
+					self.logs_dict.setdefault(graceid, []).append(obj)
+		finally:
+			self.lock.release()
+
+	def echoAlert(self, alert):
+		if self.echo is not None:
+			self.echo(alert)
+
+	#--------------------------------------------------------------------------------------
+	# The parts of the GraceDB client we use
+	#--------------------------------------------------------------------------------------
+	def events(self, graceid):
+		self.request()
+		self.lock.acquire()
+		try:
+			event = dict(self.events_dict[graceid])
+			event['labels'] = dict((label, '') for label in self.labels_dict.get(graceid, []))
+		finally:
+			self.lock.release()
+		return iter([event])
+
+	def logs(self, graceid):
+		self.request()
+		self.lock.acquire()
+		try:
+			return Response({'log': list(self.logs_dict.get(graceid, []))})
+		finally:
+			self.lock.release()
+
+	def voevents(self, graceid):
+		self.request()
+		self.lock.acquire()
+		try:
+			return Response({'voevents': list(self.voevents_dict.get(graceid, []))})
+		finally:
+			self.lock.release()
+
+	def get(self, url):
+		self.request()
+		graceid = url.rstrip('/').split('/')[-2]
+		self.lock.acquire()
+		try:
+			return Response({'signoff': list(self.signoffs_dict.get(graceid, []))})
+		finally:
+			self.lock.release()
+
+	def writeLog(self, graceid, message, filename=None, filecontents=None, tagname=None):
+		self.request()
+		obj = {'comment': message, 'tag_names': tagname or []}
+		self.lock.acquire()
+		try:
+			self.logs_dict.setdefault(graceid, []).append(obj)
+			self.act(graceid, 'log', message)
+		finally:
+			self.lock.release()
+		self.echoAlert({'uid': graceid, 'alert_type': 'update', 'description': message, 'file': '', 'object': obj})
+		return Response({})
+
+	def writeLabel(self, graceid, label):
+		self.request()
+		self.lock.acquire()
+		try:
+			self.labels_dict.setdefault(graceid, []).append(label)
+			self.act(graceid, 'label', label)
+		finally:
+			self.lock.release()
+		self.echoAlert({'uid': graceid, 'alert_type': 'label', 'description': label, 'file': '', 'object': {}})
+		return Response({})
+
+	def createVOEvent(self, graceid, voevent_type, **kwargs):
+		self.request()
+		self.lock.acquire()
+		try:
+			voevents = self.voevents_dict.setdefault(graceid, [])
+			obj = {'N': len(voevents)+1, 'voevent_type': voevent_types[voevent_type], 'text': '<voe:VOEvent ivorn="ivo://gwnet/LVC#{0}-{1}-{2}"/>'.format(graceid, len(voevents)+1, voevent_types[voevent_type])}
+			voevents.append(obj)
+			self.act(graceid, 'VOEvent', obj['voevent_type'])
+		finally:
+			self.lock.release()
+		self.echoAlert({'uid': graceid, 'alert_type': 'update', 'description': '', 'file': '', 'object': {'N': obj['N'], 'voevent_type': obj['voevent_type']}})
+		return Response(obj)
+
+class LocalSender(object):
+	"""
+	a stand-in for voevent_transport.VOEventSender. Every VOEvent is acknowledged after latency seconds
+	"""
+
+	def __init__(self, latency=0.0):
+		self.latency = latency
+
+	def sendAndWait(self, voevent, timeout=60.0):
+		if self.latency:
+			time.sleep(self.latency)
+		delivery = Delivery(voevent)
+		delivery.finish(True)
+		return delivery
+
+	def stop(self):
+		pass
+
+# Stand-in for seglogic.runQuery. Every flag was inactive and the query took latency seconds
+def localQuery(latency=0.0):
+	def runQuery(query, segdb_url, output_dir):
+		if latency:
+			time.sleep(latency)
+		return query['flag'], 0.0, '{0} defined : {1:.3f}/{1}={2:.3f}%, active : 0.000/{1}=0.000%'.format(query['flag'], query['dur'], 100.0)
+	return runQuery
+
+#--------------------------------------------------------------------------------------
+# Measuring
+#--------------------------------------------------------------------------------------
+
+class StageTimings(object):
+	"""
+	how long each stage of processing took, for ApprovalProcessor(timings=...). Thread safe
+	"""
+
+	def __init__(self):
+		self.durations = {} # stage -> [seconds]
+		self.lock = threading.Lock()
+
+	def record(self, stage, seconds):
+		self.lock.acquire()
+		try:
+			self.durations.setdefault(stage, []).append(seconds)
+		finally:
+			self.lock.release()
+
+	def summary(self):
+		"""
+		{stage: {'count', 'mean', 'p50', 'p95', 'max'}} in seconds
+		"""
+		self.lock.acquire()
+		try:
+			durations = dict((stage, list(values)) for stage, values in self.durations.items())
+		finally:
+			self.lock.release()
+		summary = {}
+		for stage, values in durations.items():
+			p50, p95 = quantiles.quantile(values, [0.5, 0.95])
+			summary[stage] = {'count':len(values), 'mean':sum(values)/len(values), 'p50':p50, 'p95':p95, 'max':max(values)}
+		return summary
+
+#--------------------------------------------------------------------------------------
+# Replaying alerts
+#--------------------------------------------------------------------------------------
+
+# Read recorded LVAlert messages, either one JSON message per line or a single JSON list of them
+def loadAlerts(filename):
+	text = open(filename).read()
+	if text.lstrip().startswith('['):
+		alerts = json.loads(text)
+	else:
+		alerts = [json.loads(line) for line in text.splitlines() if line.strip()]
+	return [json.loads(alert) if isinstance(alert, basestring) else alert for alert in alerts]
+
+def replay(alerts, config, workers=4, rate=0, gracedb_latency=0.0, segdb_latency=0.0, comet_latency=0.0, echo=True, logger=None):
+	"""
+	feeds alerts through an ApprovalService against stand-ins for GraceDB, Comet, SegDB, the injection search and the advocates' phone,
+	then waits for everything they set off to finish. Alerts are submitted at rate per second (0 means as fast as we can).
+	SegDB overflow checks run in the background as in approval_processor_daemon, except that their deadlines are taken to have passed already.
+	With echo, the alerts GraceDB would send about our own actions (labels, log messages, VOEvents) are fed back in.
+	Returns a dictionary with
+		alerts : the number of alerts processed, including echoes
+		seconds : how long it took
+		stages : StageTimings.summary()
+		preliminary : {graceid: seconds from its new alert to its preliminary VOEvent}
+		actions : the actions taken on GraceDB as (seconds since we started, graceid, action, detail)
+	"""
+	if logger is None:
+		logger = logging.getLogger('approval_processor.replay')
+		if not logger.handlers:
+			logger.addHandler(logging.NullHandler())
+		logger.propagate = False
+
+	submitted = [0]
+	new_times = {}
+
+	client = LocalGraceDb(latency=gracedb_latency)
+	timings = StageTimings()
+	overflow_stage = OverflowStage(config, logger=logger, gps_now=lambda: float('inf'), run_query=localQuery(segdb_latency))
+	processor = ApprovalProcessor(client, config, logger, store=StateStore(), sender=LocalSender(comet_latency), overflow_stage=overflow_stage,
+		injection_search=lambda event_time, tl, th: [], phone_advocates=lambda graceid, advocate_text: 0, timings=timings)
+	service = ApprovalService(processor, workers=workers)
+
+	def submit(alert):
+		submitted[0] += 1
+		service.submit(alert)
+	if echo:
+		client.echo = submit
+
+	begin = time.time()
+	client.begin = begin
+	service.start()
+	try:
+		for i, alert in enumerate(alerts):
+			if rate:
+				wait = begin + float(i)/rate - time.time()
+				if wait > 0:
+					time.sleep(wait)
+			client.record(alert)
+			if alert['alert_type'] == 'new':
+				new_times.setdefault(alert['uid'], time.time()-begin)
+			submit(alert)
+		while not (service.idle() and not overflow_stage.pending()):
+			time.sleep(0.01)
+		seconds = time.time() - begin
+	finally:
+		service.stop()
+		processor.executor.close()
+
+	preliminary = {}
+	for t, graceid, action, detail in client.actions:
+		if action == 'VOEvent' and detail == 'PR' and graceid in new_times and graceid not in preliminary:
+			preliminary[graceid] = t - new_times[graceid]
+
+	return {'alerts':submitted[0], 'seconds':seconds, 'stages':timings.summary(), 'preliminary':preliminary, 'actions':list(client.actions)}
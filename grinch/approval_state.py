@@ -0,0 +1,231 @@
+import re
+import json
+import time
+import sqlite3
+import threading
+
+from grinch.approval_utils import parseIdqComment
+
+#--------------------------------------------------------------------------------------
+# What approval_processor knows about a single event
+#--------------------------------------------------------------------------------------
+
+# The event attributes we keep from GraceDB
+event_keys = ['far', 'pipeline', 'search', 'group', 'instruments', 'gpstime']
+
+class EventState(object):
+	"""
+	everything approval_processor needs to decide what to do with an event.
+	It is built once (from the 'new' alert, or from GraceDB if we missed that) and then updated from each alert
+	and each action we take, so we never have to re-read the full log to find out where an event stands.
+		event : the event attributes listed in event_keys
+		labels : every label applied to the event
+		injection : whether we found a hardware injection near the event (None until we have looked)
+		far : 'Pass' or 'Fail' once we have checked the FAR of a new event
+		overflow : 'Pending' while the SegDB overflow check runs in the background, then 'Pass' or 'Fail'
+		idq : 'Pass' or 'Fail' once we have finished running iDQ checks
+		idqvalues : {pipeline.ifo : minimum glitch-FAP}
+		signoffs : {instrument : status} where the advocate signoff has instrument ''
+		signoffs_complete : whether signoffs holds every signoff. We download the list once, the first time we need it, and follow signoff alerts after that
+		skymaps : [filename, skymap_type, submitter] for every skymap with the lvem tag, oldest first
+		voevents : {'N', 'voevent_type'} for every VOEvent created, oldest first
+	"""
+
+	def __init__(self, graceid):
+		self.graceid = graceid
+		self.event = None
+		self.labels = []
+		self.injection = None
+		self.far = None
+		self.overflow = None
+		self.idq = None
+		self.idqvalues = {}
+		self.signoffs = {}
+		self.signoffs_complete = False
+		self.skymaps = []
+		self.voevents = []
+
+	def to_dict(self):
+		return dict(self.__dict__)
+
+	@classmethod
+	def from_dict(cls, d):
+		state = cls(d['graceid'])
+		state.__dict__.update(d)
+		return state
+
+	#--------------------------------------------------------------------------------------
+	# Incremental updates
+	#--------------------------------------------------------------------------------------
+
+	def setEvent(self, event_dict):
+		self.event = dict((key, event_dict.get(key, '')) for key in event_keys)
+		for label in event_dict.get('labels', {}).keys():
+			self.addLabel(label)
+
+	def addLabel(self, label):
+		if label not in self.labels:
+			self.labels.append(label)
+
+	def addVoevent(self, voevent):
+		N = voevent.get('N', None)
+		if N is not None:
+			for known in self.voevents:
+				if known['N'] == N: # we already know about this one
+					return
+		self.voevents.append({'N':N, 'voevent_type':voevent['voevent_type']})
+
+	def setSignoffs(self, signoffs):
+		"""
+		fills in signoffs from the full list downloaded from GraceDB. Signoffs we were alerted about take precedence, as the list may lag behind them
+		"""
+		signoffs = dict(signoffs)
+		signoffs.update(self.signoffs)
+		self.signoffs = signoffs
+		self.signoffs_complete = True
+
+	def latestVoeventType(self):
+		if self.voevents:
+			return self.voevents[-1]['voevent_type']
+		return None
+
+	def applyLog(self, comment):
+		"""
+		updates the state from a log message, either one we wrote or one we were alerted about
+		"""
+		if 'Last skymap submitted with lvem tag was' in comment:
+			skymapinfo = re.findall(r'Last skymap submitted with lvem tag was (.*) type (.*) by (.*).', comment)
+			if skymapinfo:
+				skymap = list(skymapinfo[0])
+				if skymap not in self.skymaps:
+					self.skymaps.append(skymap)
+		elif re.match('minimum glitch-FAP', comment):
+			idqinfo = parseIdqComment(comment)
+			if idqinfo:
+				self.idqvalues[idqinfo[0]] = idqinfo[1]
+		elif 'Finished running iDQ checks.' in comment:
+			if 'Candidate event passed iDQ checks' in comment:
+				self.idq = 'Pass'
+			else:
+				self.idq = 'Fail'
+		elif 'No hardware injection found near event gpstime' in comment:
+			self.injection = False
+		elif 'found a hardware injection' in comment or 'Found hardware injection' in comment:
+			self.injection = True
+		elif 'Candidate event rejected due to large FAR' in comment:
+			self.far = 'Fail'
+		elif 'SegDB overflow check.' in comment: # we only query SegDB for events that pass the FAR check
+			self.far = 'Pass'
+			if 'Candidate event passed SegDB overflow check.' in comment:
+				self.overflow = 'Pass'
+			else:
+				self.overflow = 'Fail'
+
+	def update(self, streamdata):
+		"""
+		updates the state from an LVAlert message
+		"""
+		alert_type = streamdata['alert_type']
+		obj = streamdata.get('object', {})
+		if alert_type == 'new':
+			self.setEvent(obj)
+		elif alert_type == 'label':
+			self.addLabel(streamdata['description'])
+		elif alert_type == 'update':
+			if 'voevent_type' in obj:
+				self.addVoevent(obj)
+			elif 'comment' in obj:
+				self.applyLog(obj['comment'])
+		elif alert_type == 'signoff':
+			self.signoffs[obj['instrument']] = obj['status']
+
+	@classmethod
+	def from_gracedb(cls, client, graceid):
+		"""
+		rebuilds the state of an event we have no record of from GraceDB. This downloads the event, its log and its VOEvents once
+		"""
+		state = cls(graceid)
+		state.setEvent(client.events(graceid).next())
+		for message in client.logs(graceid).json()['log']:
+			state.applyLog(message['comment'])
+		for voevent in client.voevents(graceid).json()['voevents']:
+			state.addVoevent(voevent)
+		return state
+
+#--------------------------------------------------------------------------------------
+# Keeping the state on disk
+#--------------------------------------------------------------------------------------
+
+class StateStore(object):
+	"""
+	an SQLite record of EventState for every event, so a restarted approval_processor carries on where it left off.
+	States are also cached in memory. path=':memory:' keeps nothing on disk.
+	All methods are thread safe.
+	"""
+
+	def __init__(self, path=':memory:'):
+		self.path = path
+		self.lock = threading.Lock()
+		self.cache = {}
+		self.conn = sqlite3.connect(path, check_same_thread=False)
+		self.conn.execute('CREATE TABLE IF NOT EXISTS events (graceid TEXT PRIMARY KEY, state TEXT, updated REAL)')
+		self.conn.commit()
+
+	def get(self, graceid):
+		"""
+		the EventState for this event, or None if we have never recorded one
+		"""
+		self.lock.acquire()
+		try:
+			if self.cache.has_key(graceid):
+				return self.cache[graceid]
+			row = self.conn.execute('SELECT state FROM events WHERE graceid=?', (graceid,)).fetchone()
+			if row is None:
+				return None
+			state = EventState.from_dict(json.loads(row[0]))
+			self.cache[graceid] = state
+			return state
+		finally:
+			self.lock.release()
+
+	def put(self, state):
+		self.lock.acquire()
+		try:
+			self.cache[state.graceid] = state
+			self.conn.execute('INSERT OR REPLACE INTO events (graceid, state, updated) VALUES (?, ?, ?)', (state.graceid, json.dumps(state.to_dict()), time.time()))
+			self.conn.commit()
+		finally:
+			self.lock.release()
+
+	def find(self, test):
+		"""
+		every recorded EventState for which test(state) is True. This reads every state, so is meant for when we start up
+		"""
+		self.lock.acquire()
+		try:
+			graceids = [graceid for (graceid,) in self.conn.execute('SELECT graceid FROM events').fetchall()]
+		finally:
+			self.lock.release()
+		states = [self.get(graceid) for graceid in graceids]
+		return [state for state in states if state is not None and test(state)]
+
+	def prune(self, age):
+		"""
+		forgets every event that has not been updated within age seconds
+		"""
+		cutoff = time.time() - age
+		self.lock.acquire()
+		try:
+			for (graceid,) in self.conn.execute('SELECT graceid FROM events WHERE updated<?', (cutoff,)).fetchall():
+				self.cache.pop(graceid, None)
+			self.conn.execute('DELETE FROM events WHERE updated<?', (cutoff,))
+			self.conn.commit()
+		finally:
+			self.lock.release()
+
+	def close(self):
+		self.lock.acquire()
+		try:
+			self.conn.close()
+		finally:
+			self.lock.release()
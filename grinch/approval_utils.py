@@ -1,14 +1,16 @@
-import subprocess
 import re
 import operator
 import functools
-import os
-import random
 import time
 import datetime
+import threading
 
-ts = time.time()
-st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+from grinch.voevent_transport import VOEventSender
+
+# A timestamp for log messages.
+# Long-running processes must call this for every message rather than fixing it at import.
+def timestamp():
+	return datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
 
 #--------------------------------------------------------------------------------------
 # Utilities
@@ -30,116 +32,121 @@ def get_idqthresh(config, pipeline, search):
 	except:
 		return config.getfloat('default', 'default_idqthresh')
 
+# The connection to our Comet broker, shared by every call to process_alert in this process
+voevent_sender = None
+voevent_sender_lock = threading.Lock()
+
+def getVOEventSender(logger=None, host='localhost', port=5340):
+	global voevent_sender
+	voevent_sender_lock.acquire()
+	try:
+		if voevent_sender is None:
+			voevent_sender = VOEventSender(host=host, port=port, logger=logger)
+		return voevent_sender
+	finally:
+		voevent_sender_lock.release()
+
 # Define a function for pulling down and sending out the correct VOEvent depending on label type
+# The VOEvent is handed to Comet from memory over a persistent VTP connection (sender, by default the one returned by getVOEventSender)
+# If deferred_logs is a list, the messages for the event log are appended to it as (message, tagname) rather than written to GraceDB
+# Returns the VOEvent created in GraceDB (a dictionary) or None if we could not create one
 def process_alert(client, logger, graceid, voevent_type, skymap_filename=None, 
-	skymap_type=None, skymap_image_filename=None, internal=1):
-	logger.info("{0} -- {1} -- Processing {2} VOEvent.".format(st, graceid, voevent_type))
+	skymap_type=None, skymap_image_filename=None, internal=1, sender=None, deferred_logs=None):
+	logger.info("{0} -- {1} -- Processing {2} VOEvent.".format(timestamp(), graceid, voevent_type))
 
 	# Create the VOEvent.
 	voevent = None
+	voevent_dict = None
 	try:
 		r = client.createVOEvent(graceid, voevent_type, skymap_filename=skymap_filename, 
 			skymap_type=skymap_type, skymap_image_filename=skymap_image_filename, internal=internal)
-		voevent = r.json()['text']
+		voevent_dict = r.json()
+		voevent = voevent_dict['text']
 	except Exception, e:
-		logger.info("{0} -- {1} -- Caught HTTPError: {2}".format(st, graceid, str(e)))
-	number = str(random.random())
-	if voevent:
-		tmpfile = open('/tmp/voevent_{0}_{1}.tmp'.format(graceid, number),"w")
-		tmpfile.write(voevent)
-		tmpfile.close()
-		# Send it out with comet!
-		cmd = 'comet-sendvo -p 5340 -f /tmp/voevent_{0}_{1}.tmp'.format(graceid, number)
-		proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-		output, error = proc.communicate(voevent)
-		logger.debug('{0} -- {1} -- output = {2}.'.format(st, graceid, output))
-		logger.debug('{0} -- {1} -- error = {2}.'.format(st, graceid, error))
-
-	if proc.returncode == 0:
+		logger.info("{0} -- {1} -- Caught HTTPError: {2}".format(timestamp(), graceid, str(e)))
+	if not voevent:
+		return voevent_dict
+
+	# Send it out with comet!
+	if sender is None:
+		sender = getVOEventSender(logger)
+	delivery = sender.sendAndWait(voevent)
+
+	if delivery.acknowledged:
 		message = '{0} VOEvent sent to GCN for testing purposes.'.format(voevent_type)
-		r = client.writeLog(graceid, 'AP: Successfully sent VOEvent of type {0}.'.format(voevent_type), tagname='em_follow')
+		log_message = 'AP: Successfully sent VOEvent of type {0}.'.format(voevent_type)
+	else:
+		message = 'Error sending {0} VOEvent! {1}.'.format(voevent_type, delivery.error)
+		log_message = 'AP: Could not send VOEvent of type {0}.'.format(voevent_type)
+	if deferred_logs is None:
+		r = client.writeLog(graceid, log_message, tagname='em_follow')
 	else:
-		message = 'Error sending {0} VOEvent! {1}.'.format(voevent_type, error)
-		r = client.writeLog(graceid, 'AP: Could not send VOEvent of type {0}.'.format(voevent_type), tagname='em_follow')
-	logger.debug('{0} -- {1} -- message = {2}.'.format(st, graceid, message))
-	os.remove('/tmp/voevent_{0}_{1}.tmp'.format(graceid, number))
+		deferred_logs.append((log_message, 'em_follow'))
+	logger.debug('{0} -- {1} -- message = {2}.'.format(timestamp(), graceid, message))
+	return voevent_dict
 
-# Define a function that checks for the human scimon signoffs
-def checkSignoffs(client, logger, graceid, detectors):
-#	log_dicts = client.logs(graceid).json()['log']
-#	for message in log_dicts:
-#		if 'Finished running human signoff checks.' in message['comment']:
-#			passorfail = re.findall(r'Candidate event (.*)ed human signoff checks.', message['comment'])
-#			if passorfail[0]=='pass':
-#				return 'Pass'
-#			elif passorfail[0]=='fail':
-#				return 'Fail'
-#		else:
-#			pass 
-	# Construct the URL for the operator signoff list
+# Pull down the signoff list of an event as {instrument : status}, where the advocate signoff has instrument ''
+def getSignoffs(client, graceid):
+	# Construct the URL for the signoff list
 	url = client.templates['signoff-list-template'].format(graceid=graceid)
-	# Pull down the operator signoff list
-	signoff_list = client.get(url).json()['signoff']
-	# Use the list to construct the signoff results dictionary
+	signoffs = {}
+	for signoff in client.get(url).json()['signoff']:
+		signoffs[signoff['instrument']] = signoff['status']
+	return signoffs
+
+# Define a function that decides the human scimon check from the signoffs ({instrument : status})
+# Returns 'Pass', 'Fail' or 'Unknown'
+def operatorVerdict(logger, graceid, signoffs, detectors):
+	# Use the signoffs to construct the signoff results dictionary
 	signoffdict = {}
-	for signoff in signoff_list:
-		if signoff['instrument']!='':
-			signoffdict[signoff['instrument']] = 'Pass' if signoff['status']=='OK' else 'Fail'
-		else:
-			pass
+	for instrument, status in signoffs.items():
+		if instrument!='':
+			signoffdict[instrument] = 'Pass' if status=='OK' else 'Fail'
 	# Now use the signoffdict to do the check
 	if (len(signoffdict) < len(detectors)):
 		if ('Fail' in signoffdict.values()):
 			return 'Fail'
 		else:
-			logger.info('{0} -- {1} -- Have not gotten all the human signoffs yet but not yet DQV.'.format(st, graceid))
+			logger.info('{0} -- {1} -- Have not gotten all the human signoffs yet but not yet DQV.'.format(timestamp(), graceid))
 			return 'Unknown'
 	elif (len(signoffdict) > len(detectors)):
-		logger.info('{0} -- {1} -- Too many human signoffs in the signoff dictionary.'.format(st, graceid))
+		logger.info('{0} -- {1} -- Too many human signoffs in the signoff dictionary.'.format(timestamp(), graceid))
 		return 'Unknown'
 	else:
-		logger.info('{0} -- {1} -- Ready to run human signoff check.'.format(st, graceid))
+		logger.info('{0} -- {1} -- Ready to run human signoff check.'.format(timestamp(), graceid))
 		if ('Fail' in signoffdict.values()):
 			return 'Fail'
 		else:
 			return 'Pass'
 
-# Define a function that checks for the advocate signoff
-def checkAdvocateSignoff(client, logger, graceid):
-#	log_dicts = client.logs(graceid).json()['log']
-#	for message in log_dicts:
-#		if 'Finished running advocate check.' in message['comment']:
-#			passorfail = re.findall(r'Candidate event (.*)ed advocate check.', message['comment'])
-#			if passorfail[0]=='pass':
-#				return 'Pass'
-#			elif passorfail[0]=='fail':
-#				return 'Fail'
-#		else:
-#			pass 
-	# Construct the URL for the signoff list
-	url = client.templates['signoff-list-template'].format(graceid=graceid)
-	# Pull down the operator signoff list
-	signoff_list = client.get(url).json()['signoff']
-	# Use the list to construct the signoff results dictionary
-	signoffdict = {}
-	for signoff in signoff_list:
-		if signoff['instrument']=='':
-			signoffdict[signoff['instrument']] = 'Pass' if signoff['status']=='OK' else 'Fail'
-		else:
-			pass
-	# Now use the signoffdict to do the check
-	if (len(signoffdict) > 1):
-		logger.info('{0} -- {1} -- More than one advocate signoff in the signoff dictionary.'.format(st, graceid))
-		return 'Unknown'
-	elif (len(signoffdict) < 1):
-		logger.info('{0} -- {1} -- No advocate signoff in the signoff dictionary.'.format(st, graceid))
+# Define a function that decides the advocate check from the signoffs ({instrument : status})
+# Returns 'Pass', 'Fail' or 'Unknown'
+def advocateVerdict(logger, graceid, signoffs):
+	if not signoffs.has_key(''):
+		logger.info('{0} -- {1} -- No advocate signoff in the signoff dictionary.'.format(timestamp(), graceid))
 		return 'Unknown'
 	else:
-		logger.info('{0} -- {1} -- Ready to run advocate signoff check.'.format(st, graceid))
-		if ('Fail' in signoffdict.values()):
-			return 'Fail'
-		else:
+		logger.info('{0} -- {1} -- Ready to run advocate signoff check.'.format(timestamp(), graceid))
+		if signoffs['']=='OK':
 			return 'Pass'
+		else:
+			return 'Fail'
+
+# Decide both the human scimon and the advocate checks from the signoffs. Returns (scimon result, advocate result)
+def evaluateSignoffs(logger, graceid, signoffs, detectors):
+	return operatorVerdict(logger, graceid, signoffs, detectors), advocateVerdict(logger, graceid, signoffs)
+
+# Define a function that runs both signoff checks with a single download of the signoff list
+def checkAllSignoffs(client, logger, graceid, detectors):
+	return evaluateSignoffs(logger, graceid, getSignoffs(client, graceid), detectors)
+
+# Define a function that checks for the human scimon signoffs
+def checkSignoffs(client, logger, graceid, detectors):
+	return operatorVerdict(logger, graceid, getSignoffs(client, graceid), detectors)
+
+# Define a function that checks for the advocate signoff
+def checkAdvocateSignoff(client, logger, graceid):
+	return advocateVerdict(logger, graceid, getSignoffs(client, graceid))
 
 # Define a function that disqualifies an event for being and INJ or DQV. 
 # This function depends on the value of hardware_inj in the config file
@@ -164,41 +171,37 @@ def checkIdqStatus(client, graceid):
 			return 'Fail'
 	return 'Unknown'
 
-def getIdqAndJointFapValues(idq_pipelines, client, logger, graceid):
-	idqvalues = {}
+# Parse a 'minimum glitch-FAP' log message into ('pipeline.detector', min_fap). Returns None for any other message.
+def parseIdqComment(comment):
+	if not re.match('minimum glitch-FAP', comment):
+		return None
+	idqinfo = re.findall('minimum glitch-FAP for (.*) at (.*) with', comment)
+	min_fap = re.findall('is (.*)', comment)
+	if not (idqinfo and min_fap):
+		return None
+	pipeline = idqinfo[0][0]
+	detector = idqinfo[0][1]
+	return '{0}.{1}'.format(pipeline, detector), float(min_fap[0])
+
+# The joint min-FAP for each iDQ pipeline: the product of the min-FAP values we have so far from each detector.
+# idqvalues is a dictionary {'pipeline.detector': min_fap}
+def getJointFapValues(idqvalues, idq_pipelines):
 	joint_FAP_values = {}
 	for pipeline in idq_pipelines:
-		pipeline_values = []
-		log_dicts = client.logs(graceid).json()['log']
-		commentslist = open('/tmp/idqmessages_{0}.tmp'.format(graceid), 'w')
-		for message in log_dicts:
-			if re.match('minimum glitch-FAP', message['comment']):
-				commentslist.write(message['comment'])
-				commentslist.write('\n')
-		commentslist.close()
-
-		# Now we get the min-FAP values and sort according to which idq_pipeline
-		commentslist = open('/tmp/idqmessages_{0}.tmp'.format(graceid))
-		for line in commentslist:
-			idqinfo = re.findall('minimum glitch-FAP for (.*) at (.*) with', line)
-			pipeline = idqinfo[0][0]
-			detector = idqinfo[0][1]
-			min_fap = re.findall('is (.*)\n', line)
-			min_fap = float(min_fap[0])
-			detectorstring = '{0}.{1}'.format(pipeline, detector)
-			idqvalues[detectorstring] = min_fap
-			logger.info('{0} -- {2} -- Got the min_fap for {1} using {3} is {4}.'.format(st, detector, graceid, pipeline, min_fap))
-		commentslist.close()
-
-		# Now, even if you did not get all the minfap values for a specific pipeline, 
-	    # calculate the joint min-FAP thus far for each pipeline 
-		for key in idqvalues.keys(): 
-			if pipeline in key:
-				pipeline_values.append(idqvalues[key])
+		pipeline_values = [min_fap for key, min_fap in idqvalues.items() if key.split('.')[0]==pipeline]
 		joint_FAP_values[pipeline] = functools.reduce(operator.mul, pipeline_values, 1)
+	return joint_FAP_values
 
-		return idqvalues, joint_FAP_values
-	os.remove('/tmp/idqmessages_{0}.tmp'.format(graceid))
+# Read every min-FAP value from the event log (a single query) and compute the joint min-FAP values thus far
+def getIdqAndJointFapValues(idq_pipelines, client, logger, graceid):
+	idqvalues = {}
+	for message in client.logs(graceid).json()['log']:
+		idqinfo = parseIdqComment(message['comment'])
+		if idqinfo:
+			detectorstring, min_fap = idqinfo
+			idqvalues[detectorstring] = min_fap
+			logger.info('{0} -- {1} -- Got the min_fap for {2} is {3}.'.format(timestamp(), graceid, detectorstring, min_fap))
+	return idqvalues, getJointFapValues(idqvalues, idq_pipelines)
 
 def flag2filename( flag, start, dur, output_dir='.' ):
 	return '{0}/{1}-{2}-{3}.xml.gz'.format(output_dir, flag.replace(':','_'), start, dur)
@@ -0,0 +1,240 @@
+description = """ a module for converting between GPS time, UTC (seconds since the unix epoch) and the date strings used by GraceDB without calling out to lalapps_tconvert. Conversions between GPS and UTC use a table of leap seconds and accept either scalars or numpy arrays. Date strings are always parsed and formatted with an explicit time zone """
+
+#=================================================
+
+import re
+import time
+import calendar
+import datetime
+import _strptime ### datetime.strptime imports this lazily, which is not thread safe the first time
+
+import numpy as np
+
+#=================================================
+# leap seconds
+#=================================================
+
+GPS_EPOCH = 315964800 ### unix time of the GPS epoch (1980-01-06 00:00:00 UTC)
+
+### dates (UTC) at which a leap second was inserted. GPS-UTC increases by one at each of these
+### this table must be updated when the IERS announces a new leap second (see Bulletin C)
+leap_second_dates = [
+    (1981, 7, 1),
+    (1982, 7, 1),
+    (1983, 7, 1),
+    (1985, 7, 1),
+    (1988, 1, 1),
+    (1990, 1, 1),
+    (1991, 1, 1),
+    (1992, 7, 1),
+    (1993, 7, 1),
+    (1994, 7, 1),
+    (1996, 1, 1),
+    (1997, 7, 1),
+    (1999, 1, 1),
+    (2006, 1, 1),
+    (2009, 1, 1),
+    (2012, 7, 1),
+    (2015, 7, 1),
+    (2017, 1, 1),
+]
+
+leap_unix = np.array( [calendar.timegm( (yr, mon, day, 0, 0, 0) ) for yr, mon, day in leap_second_dates], dtype=float ) ### unix time of each leap second
+leap_gps = leap_unix - GPS_EPOCH + np.arange(1, len(leap_unix)+1) ### gps time of each leap second
+
+def _result( x, scalar ):
+    if scalar:
+        return float(x)
+    return x
+
+def leap_seconds( unix ):
+    """
+    GPS-UTC at unix time(s)
+    """
+    return np.searchsorted( leap_unix, unix, side='right' )
+
+def utc_to_gps( unix ):
+    """
+    converts seconds since the unix epoch (UTC) into GPS seconds
+    """
+    scalar = np.isscalar( unix )
+    unix = np.asarray( unix, dtype=float )
+    return _result( unix - GPS_EPOCH + leap_seconds( unix ), scalar )
+
+def gps_to_utc( gps ):
+    """
+    converts GPS seconds into seconds since the unix epoch (UTC)
+    """
+    scalar = np.isscalar( gps )
+    gps = np.asarray( gps, dtype=float )
+    return _result( gps + GPS_EPOCH - np.searchsorted( leap_gps, gps, side='right' ), scalar )
+
+def gps_now():
+    """
+    the current GPS time
+    """
+    return utc_to_gps( time.time() )
+
+#=================================================
+# time zones
+#=================================================
+
+ZERO = datetime.timedelta( 0 )
+HOUR = datetime.timedelta( hours=1 )
+
+class FixedOffset( datetime.tzinfo ):
+    """
+    a time zone with a constant offset from UTC (in hours)
+    """
+
+    def __init__( self, hours, name ):
+        self.offset = datetime.timedelta( hours=hours )
+        self.name = name
+
+    def utcoffset( self, dt ):
+        return self.offset
+
+    def tzname( self, dt ):
+        return self.name
+
+    def dst( self, dt ):
+        return ZERO
+
+def _nth_sunday( year, month, n ):
+    """
+    the nth Sunday of month (n=-1 means the last Sunday)
+    """
+    if n > 0:
+        day = datetime.datetime( year, month, 1 )
+        day += datetime.timedelta( days=(6-day.weekday())%7 )
+        return day + datetime.timedelta( weeks=n-1 )
+    else:
+        day = datetime.datetime( year+(month==12), month%12+1, 1 ) - datetime.timedelta( days=1 )
+        return day - datetime.timedelta( days=(day.weekday()+1)%7 )
+
+class USTimeZone( datetime.tzinfo ):
+    """
+    a US time zone that observes daylight saving time.
+    Since 2007 DST runs from 2am on the second Sunday in March until 2am on the first Sunday in November.
+    Before that, from 2am on the first Sunday in April until 2am on the last Sunday in October
+    """
+
+    def __init__( self, hours, stdname, dstname ):
+        self.stdoffset = datetime.timedelta( hours=hours )
+        self.stdname = stdname
+        self.dstname = dstname
+
+    def _dst_range( self, year ):
+        if year >= 2007:
+            start = _nth_sunday( year, 3, 2 )
+            end = _nth_sunday( year, 11, 1 )
+        else:
+            start = _nth_sunday( year, 4, 1 )
+            end = _nth_sunday( year, 10, -1 )
+        return start + 2*HOUR, end + 2*HOUR
+
+    def dst( self, dt ):
+        start, end = self._dst_range( dt.year )
+        dt = dt.replace( tzinfo=None )
+        if start <= dt < end - HOUR: ### the repeated hour in November is treated as standard time
+            return HOUR
+        return ZERO
+
+    def utcoffset( self, dt ):
+        return self.stdoffset + self.dst( dt )
+
+    def tzname( self, dt ):
+        if self.dst( dt ):
+            return self.dstname
+        return self.stdname
+
+    def fromutc( self, dt ):
+        start, end = self._dst_range( dt.year )
+        local = dt.replace( tzinfo=None ) + self.stdoffset
+        if start <= local < end - HOUR:
+            local += HOUR
+        return local.replace( tzinfo=self )
+
+UTC = FixedOffset( 0, "UTC" )
+CENTRAL = USTimeZone( -6, "CST", "CDT" ) ### America/Chicago, where GraceDB is hosted
+
+### time zones we recognize by name
+timezones = {
+    'UTC'             : UTC,
+    'GMT'             : UTC,
+    'Z'               : UTC,
+    'CST'             : FixedOffset( -6, "CST" ),
+    'CDT'             : FixedOffset( -5, "CDT" ),
+    'America/Chicago' : CENTRAL,
+}
+
+GRACEDB_TIMEZONE = CENTRAL ### GraceDB interprets times in queries (e.g. "created: ...") in this time zone
+
+#=================================================
+# date strings
+#=================================================
+
+_offset_re = re.compile( r"([+-])(\d\d):?(\d\d)$" )
+
+def to_unix( datestring, tz=UTC ):
+    """
+    parses a date string into seconds since the unix epoch.
+    Accepts "YYYY-MM-DD HH:MM:SS" and "YYYY-MM-DDTHH:MM:SS" (optionally with fractional seconds).
+    If the string ends with a time zone name (e.g. "UTC") or an offset (e.g. "+00:00"), that takes precedence over tz
+    """
+    datestring = datestring.strip()
+
+    match = _offset_re.search( datestring )
+    if match: ### explicit offset from UTC
+        sign, hh, mm = match.groups()
+        hours = (int(hh) + int(mm)/60.0) * (1 if sign == "+" else -1)
+        tz = FixedOffset( hours, match.group(0) )
+        datestring = datestring[:match.start()].strip() ### " +HH:MM", as GraceDB writes them, leaves a space behind
+    else:
+        fields = datestring.split()
+        if len(fields) > 1 and timezones.has_key( fields[-1] ):
+            tz = timezones[fields[-1]]
+            datestring = " ".join( fields[:-1] )
+        elif datestring.endswith( "Z" ):
+            tz = UTC
+            datestring = datestring[:-1]
+
+    if isinstance( tz, str ):
+        tz = timezones[tz]
+
+    datestring = datestring.replace( "T", " " )
+    if "." in datestring:
+        datestring, frac = datestring.split( "." )
+        frac = float( "0.%s"%frac )
+    else:
+        frac = 0.0
+    dt = datetime.datetime.strptime( datestring, "%Y-%m-%d %H:%M:%S" )
+    dt = dt - tz.utcoffset( dt )
+    return calendar.timegm( dt.timetuple() ) + frac
+
+def from_unix( unix, tz=UTC, fmt="%Y-%m-%d %H:%M:%S" ):
+    """
+    formats seconds since the unix epoch as a date string in the time zone tz
+    """
+    if isinstance( tz, str ):
+        tz = timezones[tz]
+    dt = datetime.datetime.utcfromtimestamp( unix ).replace( tzinfo=UTC )
+    return dt.astimezone( tz ).strftime( fmt )
+
+def to_gps( datestring, tz=UTC ):
+    """
+    parses a date string into GPS seconds
+    """
+    return utc_to_gps( to_unix( datestring, tz=tz ) )
+
+def from_gps( gps, tz=UTC, fmt="%Y-%m-%d %H:%M:%S" ):
+    """
+    formats GPS seconds as a date string in the time zone tz
+    """
+    return from_unix( gps_to_utc( gps ), tz=tz, fmt=fmt )
+
+def gracedb_query_time( unix ):
+    """
+    formats seconds since the unix epoch for use in GraceDB queries (e.g. "created: start .. stop")
+    """
+    return from_unix( unix, tz=GRACEDB_TIMEZONE )
@@ -0,0 +1,126 @@
+description = """ a module for recording the latencies measured by event_supervisor_latency in a compact, columnar format. Each batch of results is appended as a new part (a directory holding one .npy file per column) so months of data can be memory-mapped and aggregated without loading everything at once. The log messages behind each latency are stored separately and referenced by byte offset """
+
+#=================================================
+
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+#=================================================
+
+### the columns recorded for every (event, check) pair
+columns = ['gdb_id', 'event_type', 'check', 'created', 'latency', 'action_required', 'log_offset']
+
+LOGS = "logs.json" ### one JSON list of log messages per line, referenced by log_offset
+
+class LatencyStore( object ):
+    """
+    an append-only store with one row per (event, check).
+        gdb_id, event_type, check : fixed-width strings
+        created : the creation time of the event (seconds since the unix epoch)
+        latency : seconds from creation until the check was satisfied (infty if it never was)
+        action_required : bool
+        log_offset : byte offset of this row's log messages within the part's logs file, -1 if none were recorded
+
+    Parts are written to a temporary directory and renamed into place, so an interrupted run never leaves a partial part behind.
+    Temporary directories left by such a run are removed when the store is opened.
+    """
+
+    def __init__( self, path ):
+        self.path = path
+        if not os.path.exists( path ):
+            os.makedirs( path )
+        for name in os.listdir( path ): ### staging directories of runs that died before renaming them
+            if name.startswith( "tmp-" ):
+                shutil.rmtree( os.path.join( path, name ), ignore_errors=True )
+
+    def parts( self ):
+        """
+        the directories holding each part, in the order they were written
+        """
+        return [os.path.join( self.path, name ) for name in sorted(os.listdir( self.path )) if name.startswith( "part-" )]
+
+    def append( self, rows ):
+        """
+        writes rows of (gdb_id, event_type, check, created, latency, action_required, logs) as a new part.
+        logs may be None
+        """
+        if not rows:
+            return None
+
+        parts = self.parts()
+        if parts:
+            n = int(os.path.basename( parts[-1] ).split("-")[1]) + 1
+        else:
+            n = 0
+        name = os.path.join( self.path, "part-%06d"%(n) )
+        tmpname = tempfile.mkdtemp( prefix="tmp-%06d-"%(n), dir=self.path ) ### a fresh name, even if a stale one is still around
+
+        offsets = []
+        file_obj = open(os.path.join( tmpname, LOGS ), "w")
+        for row in rows:
+            logs = row[6]
+            if logs is None:
+                offsets.append( -1 )
+            else:
+                offsets.append( file_obj.tell() )
+                file_obj.write( json.dumps( logs )+"\n" )
+        file_obj.close()
+
+        gdb_id, event_type, check, created, latency, action_required = zip( *[row[:6] for row in rows] )
+        data = {
+            'gdb_id'          : np.array( gdb_id, dtype=str ),
+            'event_type'      : np.array( event_type, dtype=str ),
+            'check'           : np.array( check, dtype=str ),
+            'created'         : np.array( created, dtype=float ),
+            'latency'         : np.array( latency, dtype=float ),
+            'action_required' : np.array( action_required, dtype=bool ),
+            'log_offset'      : np.array( offsets, dtype=np.int64 ),
+        }
+        for column in columns:
+            np.save( os.path.join( tmpname, "%s.npy"%(column) ), data[column] )
+
+        os.rename( tmpname, name )
+        return name
+
+    def iterparts( self, names=columns ):
+        """
+        yields (part, {column:array}) for every part. Arrays are memory-mapped rather than read into memory
+        """
+        for part in self.parts():
+            yield part, dict( (column, np.load( os.path.join( part, "%s.npy"%(column) ), mmap_mode='r' )) for column in names )
+
+    def load( self, names=columns ):
+        """
+        returns {column:array} concatenated over all parts
+        """
+        data = dict( (column, []) for column in names )
+        for part, arrays in self.iterparts( names ):
+            for column in names:
+                data[column].append( arrays[column] )
+        return dict( (column, np.concatenate( data[column] ) if data[column] else np.array([])) for column in names )
+
+    def gdb_ids( self ):
+        """
+        the set of events with at least one recorded row
+        """
+        known = set()
+        for part, arrays in self.iterparts( ['gdb_id'] ):
+            known.update( arrays['gdb_id'] )
+        return known
+
+    def logs( self, part, log_offset ):
+        """
+        the log messages referenced by log_offset within part, or None
+        """
+        if log_offset < 0:
+            return None
+        file_obj = open(os.path.join( part, LOGS ), "r")
+        try:
+            file_obj.seek( log_offset )
+            return json.loads( file_obj.readline() )
+        finally:
+            file_obj.close()
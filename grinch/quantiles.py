@@ -0,0 +1,225 @@
+description = """ a module for summarizing latency distributions with numpy. We provide exact quantiles for samples held in memory and a mergeable sketch (a t-digest) so summaries from many runs and many checks can be combined without reloading the raw samples """
+
+#=================================================
+
+import json
+
+import numpy as np
+
+#=================================================
+# exact quantiles
+#=================================================
+
+def quantile( a, q, presorted=False ):
+    """
+    the q-th quantiles of a, linearly interpolating between order statistics (the same convention as numpy.percentile).
+    q may be a scalar or an array
+    """
+    a = np.asarray( a, dtype=float )
+    if not presorted:
+        a = np.sort( a )
+    if not len(a):
+        raise ValueError("cannot compute quantiles of an empty sample")
+    q = np.asarray( q, dtype=float )
+    position = (len(a)-1)*q
+    lower = np.floor( position ).astype(int)
+    upper = np.ceil( position ).astype(int)
+    return a[lower] + (a[upper]-a[lower])*(position-lower)
+
+def define_bins( a, nbins, nsigma=5.0, clip=3.0 ):
+    """
+    histogram bin edges for a, ignoring outliers.
+    While anything lies more than nsigma standard deviations above the mean, we discard everything more than clip standard deviations above it.
+    If that would discard half of the sample we give up and use everything
+    """
+    a = np.asarray( a, dtype=float )
+    n = len(a)
+    kept = a
+    m = kept.mean()
+    s = kept.std()
+    while (2*len(kept) > n) and np.any( kept > m+nsigma*s ):
+        kept = kept[kept < m+clip*s]
+        m = kept.mean()
+        s = kept.std()
+    if 2*len(kept) <= n:
+        kept = a
+    return np.linspace( kept.min()-1, kept.max()+1, max(nbins, 1)+1 )
+
+#=================================================
+# mergeable sketches
+#=================================================
+
+class LatencySketch( object ):
+    """
+    a t-digest : the distribution is summarized by weighted centroids which are small near the tails and larger near the median, so extreme quantiles stay accurate.
+    Sketches can be merged and saved (to_dict/from_dict), so summaries of many runs can be combined.
+
+    Values are buffered and kept exactly until we hold more than buffer_size of them, so small samples give exact quantiles.
+    Infinite values (checks that were never satisfied) are counted separately and nan is ignored.
+    """
+
+    def __init__( self, delta=200, buffer_size=None ):
+        self.delta = delta ### compression. We keep O(delta) centroids
+        if buffer_size is None:
+            buffer_size = 5*delta
+        self.buffer_size = buffer_size
+
+        self.means = np.array([], dtype=float)
+        self.weights = np.array([], dtype=float)
+        self.buffer = []
+        self.nbuffer = 0
+        self.n_infinite = 0
+        self.min = np.infty
+        self.max = -np.infty
+
+    def add( self, values ):
+        """
+        adds a scalar or an array of values
+        """
+        values = np.atleast_1d( np.asarray( values, dtype=float ) )
+        values = values[values == values] ### drop nan
+        finite = np.isfinite( values )
+        self.n_infinite += len(values) - finite.sum()
+        values = values[finite]
+        if not len(values):
+            return
+        self.min = min( self.min, values.min() )
+        self.max = max( self.max, values.max() )
+        self.buffer.append( values )
+        self.nbuffer += len(values)
+        if self.nbuffer + len(self.means) > self.buffer_size:
+            self.compress()
+
+    def merge( self, other ):
+        """
+        adds everything summarized by other to this sketch
+        """
+        other._flush()
+        self._flush()
+        self.n_infinite += other.n_infinite
+        if not len(other.means):
+            return
+        self.min = min( self.min, other.min )
+        self.max = max( self.max, other.max )
+        self._merge( np.concatenate( (self.means, other.means) ), np.concatenate( (self.weights, other.weights) ) )
+        if len(self.means) > self.buffer_size:
+            self.compress()
+
+    def _flush( self ):
+        """
+        moves buffered values into the (unweighted) centroids without compressing
+        """
+        if self.buffer:
+            self._merge( np.concatenate( [self.means]+self.buffer ), np.concatenate( [self.weights]+[np.ones_like(b) for b in self.buffer] ) )
+            self.buffer = []
+            self.nbuffer = 0
+
+    def _merge( self, means, weights ):
+        order = np.argsort( means, kind='mergesort' )
+        self.means = means[order]
+        self.weights = weights[order]
+
+    def compress( self ):
+        """
+        merges neighboring centroids so that each covers at most one unit of the scale function k(q) = delta/(2 pi) * arcsin(2q-1)
+        """
+        self._flush()
+        if not len(self.means):
+            return
+        cumulative = np.cumsum( self.weights )
+        total = cumulative[-1]
+        q = (cumulative - 0.5*self.weights)/total ### the quantile at the center of each centroid
+        k = np.floor( self.delta/(2*np.pi) * np.arcsin( 2*q-1 ) )
+        groups = np.concatenate( ([0], np.cumsum( k[1:] != k[:-1] )) ) ### k is non-decreasing, so each group is contiguous
+        weights = np.bincount( groups, weights=self.weights )
+        self.means = np.bincount( groups, weights=self.weights*self.means ) / weights
+        self.weights = weights
+
+    def count( self ):
+        """
+        the number of finite values summarized
+        """
+        self._flush()
+        return int(self.weights.sum())
+
+    def quantile( self, q ):
+        """
+        the q-th quantiles of the finite values, interpolating between centroids. Exact when no centroid has been merged
+        """
+        self._flush()
+        if np.any( self.weights > 1 ): ### raw values mixed with merged centroids interpolate poorly
+            self.compress()
+        if not len(self.means):
+            raise ValueError("cannot compute quantiles of an empty sketch")
+        q = np.asarray( q, dtype=float )
+        total = self.weights.sum()
+        centers = np.cumsum( self.weights ) - 0.5*self.weights - 0.5 ### the (0-based) rank at the center of each centroid
+        ranks = [centers]
+        values = [self.means]
+        if centers[0] > 0: ### pin the ends of the distribution to the extreme values we saw
+            ranks.insert( 0, [0.0] )
+            values.insert( 0, [self.min] )
+        if centers[-1] < total-1:
+            ranks.append( [total-1] )
+            values.append( [self.max] )
+        return np.interp( (total-1)*q, np.concatenate( ranks ), np.concatenate( values ) )
+
+    def to_dict( self ):
+        self._flush()
+        return {'delta':self.delta, 'buffer_size':self.buffer_size, 'means':list(self.means), 'weights':list(self.weights), 'n_infinite':int(self.n_infinite), 'min':self.min, 'max':self.max}
+
+    @classmethod
+    def from_dict( cls, d ):
+        sketch = cls( delta=d['delta'], buffer_size=d['buffer_size'] )
+        sketch.means = np.array( d['means'], dtype=float )
+        sketch.weights = np.array( d['weights'], dtype=float )
+        sketch.n_infinite = d['n_infinite']
+        sketch.min = d['min']
+        sketch.max = d['max']
+        return sketch
+
+#=================================================
+# collections of sketches
+#=================================================
+
+def dump( sketches, filename ):
+    """
+    writes a dictionary of (event_type, check) -> LatencySketch to filename as JSON
+    """
+    file_obj = open(filename, "w")
+    json.dump( [{'event_type':event_type, 'check':check, 'sketch':sketch.to_dict()} for (event_type, check), sketch in sketches.items()], file_obj )
+    file_obj.close()
+
+def load( filename, sketches=None ):
+    """
+    reads sketches written by dump, merging them into sketches if supplied
+    """
+    if sketches is None:
+        sketches = {}
+    file_obj = open(filename, "r")
+    for entry in json.load( file_obj ):
+        key = (str(entry['event_type']), str(entry['check']))
+        sketch = LatencySketch.from_dict( entry['sketch'] )
+        if sketches.has_key( key ):
+            sketches[key].merge( sketch )
+        else:
+            sketches[key] = sketch
+    file_obj.close()
+    return sketches
+
+def combine( sketches, by='check' ):
+    """
+    merges a dictionary of (event_type, check) -> LatencySketch over every event_type (by="check") or every check (by="event_type")
+    """
+    if by == "check":
+        ind = 1
+    elif by == "event_type":
+        ind = 0
+    else:
+        raise ValueError("by=%s not understood"%(by))
+    combined = {}
+    for key, sketch in sketches.items():
+        if not combined.has_key( key[ind] ):
+            combined[key[ind]] = LatencySketch( delta=sketch.delta, buffer_size=sketch.buffer_size )
+        combined[key[ind]].merge( sketch )
+    return combined
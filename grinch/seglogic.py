@@ -0,0 +1,294 @@
+import os
+import time
+import heapq
+import functools
+import itertools
+import threading
+import traceback
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+from grinch import gpstime
+from grinch.approval_utils import flag2filename, segDBcmd, timestamp
+
+#--------------------------------------------------------------------------------------
+# Planning SegDB queries for the overflow flags
+#--------------------------------------------------------------------------------------
+
+# Read where we write segment files, which segDB we're using and how many queries may run at once
+def getSettings(config):
+	if config.has_option('general', 'output-dir'):
+		output_dir = config.get('general', 'output-dir')
+		if not os.path.exists(output_dir):
+			os.makedirs( output_dir )
+	else:
+		output_dir = '.'
+
+	if config.has_option('general', 'segdb-url'):
+		segdb_url = config.get('general', 'segdb-url')
+	else:
+		segdb_url = 'https://segments.ligo.org'
+
+	if config.has_option('general', 'max-queries'):
+		max_queries = config.getint('general', 'max-queries')
+	else:
+		max_queries = 4
+
+	return segdb_url, output_dir, max_queries
+
+def planQueries(config, event_time):
+	"""
+	the query for each flag in config, grouped into batches of flags that can be launched at the same time.
+	Returns a list of (deadline, [query, ...]) sorted by deadline (the GPS time after which the batch can be launched).
+	Each query is a dictionary with keys flag, start, end, dur, dmt and tags
+	"""
+	batches = {}
+	for flag in config.get( 'general', 'flags' ).split():
+		start = int(event_time-config.getfloat(flag, 'look_left'))
+		end = event_time+config.getfloat(flag, 'look_right')
+		if end%1:
+			end = int(end) + 1
+		else:
+			end = int(end)
+		deadline = end + config.getfloat(flag, 'wait') # wait until we're past the end time
+
+		if config.has_option(flag, 'dmt'):
+			dmt = config.get(flag, 'dmt')
+		else:
+			dmt = None
+
+		query = {'flag':flag, 'start':start, 'end':end, 'dur':end-start, 'dmt':dmt, 'tags':config.get(flag, 'tags').split()}
+		batches.setdefault(deadline, []).append(query)
+	return sorted(batches.items())
+
+#--------------------------------------------------------------------------------------
+# Running queries
+#--------------------------------------------------------------------------------------
+
+# Compute how much of [start, end) the flag was defined and active from the output of ligolw_segment_query_dqsegdb
+def readSegments(outfilename):
+	from glue.ligolw import ligolw
+	from glue.ligolw import table
+	from glue.ligolw import lsctables
+	from glue.ligolw import utils as ligolw_utils
+
+	xmldoc = ligolw_utils.load_filename(outfilename, contenthandler=lsctables.use_in(ligolw.LIGOLWContentHandler))
+
+	sdef = table.get_table(xmldoc, lsctables.SegmentDefTable.tableName)
+	ssum = table.get_table(xmldoc, lsctables.SegmentSumTable.tableName)
+	seg = table.get_table(xmldoc, lsctables.SegmentTable.tableName)
+
+	# get segdef_id
+	segdef_id = next(a.segment_def_id for a in sdef if a.name=='RESULT')
+
+	# get list of defined times
+	defd = 0.0
+	for a in ssum:
+		if a.segment_def_id==segdef_id:
+			defd += a.end_time + 1e-9*a.end_time_ns - a.start_time + 1e-9*a.start_time_ns
+
+	# get list of active segments
+	actv = 0.0
+	for a in seg:
+		if a.segment_def_id==segdef_id:
+			actv += a.end_time + 1e-9*a.end_time_ns - a.start_time + 1e-9*a.start_time_ns
+
+	return defd, actv
+
+def runQuery(query, segdb_url, output_dir):
+	"""
+	runs a single query and returns (flag, active fraction, message for GraceDB)
+	"""
+	flag = query['flag']
+	start = query['start']
+	end = query['end']
+	dur = query['dur']
+
+	# set environment for this query. Queries run concurrently, so we must not touch os.environ
+	env = dict(os.environ)
+	if query['dmt']:
+		env['ONLINEDQ'] = query['dmt']
+
+	outfilename = flag2filename( flag, start, dur, output_dir)
+	cmd = segDBcmd( segdb_url, flag, start, end, outfilename, dmt=bool(query['dmt']) )
+	subprocess.Popen( cmd.split(), env=env ).wait()
+
+	defd, actv = readSegments(outfilename)
+	message = '{0}'.format(flag)
+	message += ' defined : {0:.3f}/{1}={2:.3f}{3}'.format(defd, dur, defd/dur * 100, '%')
+	message += ', active : {0:.3f}/{1}={2:.3f}{3}'.format(actv, dur, actv/dur * 100, '%')
+	return flag, actv/dur, message
+
+# Run a query (with run_query, by default runQuery) and upload the result to GraceDB as soon as it is done
+def runAndReport(query, segdb_url, output_dir, client, graceid, run_query=None):
+	if run_query is None:
+		run_query = runQuery
+	flag, fraction, message = run_query(query, segdb_url, output_dir)
+	client.writeLog( graceid, message, tagname=query['tags'] )
+	return flag, fraction
+
+def overflowCheck(config, event_time, client, graceid, gps_now=gpstime.gps_now):
+	"""
+	queries SegDB for every flag listed in config and uploads the results to GraceDB. Returns {flag: active fraction}.
+	Each batch of flags is launched as soon as its deadline passes, without waiting for earlier batches to finish,
+	and at most max-queries (from config) queries run at once.
+
+	ligolw_segment_query_dqsegdb combines every flag in a query into a single RESULT, so flags that share a window
+	are batched onto the same timer but still get a query each
+	"""
+	segdb_url, output_dir, max_queries = getSettings(config)
+	pool = ThreadPool(max_queries)
+	try:
+		results = []
+		for deadline, batch in planQueries(config, event_time):
+			wait = deadline - gps_now()
+			if wait > 0:
+				time.sleep( wait )
+			results.append( pool.map_async(functools.partial(runAndReport, segdb_url=segdb_url, output_dir=output_dir, client=client, graceid=graceid), batch) )
+
+		overflow_dict = {}
+		for result in results:
+			overflow_dict.update( result.get() )
+		return overflow_dict
+	finally:
+		pool.close()
+		pool.join()
+
+#--------------------------------------------------------------------------------------
+# Running overflow checks in the background
+#--------------------------------------------------------------------------------------
+
+class OverflowStage(object):
+	"""
+	runs overflow checks without holding up the caller. schedule() returns straight away and a timer thread launches each batch
+	of queries once its deadline passes, on a pool of at most max-queries (from config) threads shared by every event.
+	Once every flag for an event is in, callback(graceid, overflow_dict, failed) is called with {flag: active fraction}
+	and the list of flags we could not query.
+	run_query stands in for runQuery, e.g. to replay alerts without SegDB
+	"""
+
+	def __init__(self, config, logger=None, gps_now=gpstime.gps_now, run_query=None):
+		self.config = config
+		self.segdb_url, self.output_dir, self.max_queries = getSettings(config)
+		self.logger = logger
+		self.gps_now = gps_now
+		self.run_query = run_query
+
+		self.callback = None
+		self.timers = [] # heap of (deadline, order, graceid, client, batch)
+		self.order = itertools.count() # keeps batches with the same deadline in the order they were scheduled
+		self.checks = {} # graceid -> {'remaining', 'overflow_dict', 'failed'}
+		self.condition = threading.Condition()
+		self.running = False
+		self.thread = None
+		self.pool = None
+
+	def start(self, callback):
+		self.condition.acquire()
+		try:
+			if self.thread is None:
+				self.callback = callback
+				self.pool = ThreadPool(self.max_queries)
+				self.running = True
+				self.thread = threading.Thread(target=self._timer)
+				self.thread.daemon = True
+				self.thread.start()
+		finally:
+			self.condition.release()
+
+	def schedule(self, event_time, client, graceid):
+		"""
+		starts the overflow check for an event. Returns False if one is already running for it
+		"""
+		plan = planQueries(self.config, event_time)
+		self.condition.acquire()
+		try:
+			if self.checks.has_key(graceid):
+				return False
+			self.checks[graceid] = {'remaining':sum(len(batch) for deadline, batch in plan), 'overflow_dict':{}, 'failed':[]}
+			for deadline, batch in plan:
+				heapq.heappush(self.timers, (deadline, self.order.next(), graceid, client, batch))
+			self.condition.notify()
+		finally:
+			self.condition.release()
+		if not plan: # no flags to check
+			self._finish(graceid)
+		return True
+
+	def pending(self):
+		"""
+		the events whose overflow checks have not finished
+		"""
+		self.condition.acquire()
+		try:
+			return self.checks.keys()
+		finally:
+			self.condition.release()
+
+	def stop(self):
+		"""
+		waits for the queries already launched. Checks still waiting on their deadline are abandoned
+		"""
+		self.condition.acquire()
+		try:
+			self.running = False
+			self.condition.notify()
+		finally:
+			self.condition.release()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+			self.pool.close()
+			self.pool.join()
+
+	def _timer(self):
+		self.condition.acquire()
+		try:
+			while self.running:
+				if not self.timers:
+					self.condition.wait()
+					continue
+				wait = self.timers[0][0] - self.gps_now()
+				if wait > 0:
+					self.condition.wait( wait )
+					continue
+				deadline, order, graceid, client, batch = heapq.heappop(self.timers)
+				for query in batch:
+					self.pool.apply_async(self._run, (query, client, graceid))
+		finally:
+			self.condition.release()
+
+	def _run(self, query, client, graceid):
+		try:
+			flag, fraction = runAndReport(query, self.segdb_url, self.output_dir, client, graceid, run_query=self.run_query)
+			result = {flag:fraction}
+		except Exception, e:
+			if self.logger is not None:
+				self.logger.error('{0} -- {1} -- Failed to query SegDB for {2}: {3}'.format(timestamp(), graceid, query['flag'], traceback.format_exc()))
+			result = None
+
+		self.condition.acquire()
+		try:
+			check = self.checks[graceid]
+			if result is None:
+				check['failed'].append(query['flag'])
+			else:
+				check['overflow_dict'].update(result)
+			check['remaining'] -= 1
+			done = check['remaining'] == 0
+		finally:
+			self.condition.release()
+		if done:
+			self._finish(graceid)
+
+	def _finish(self, graceid):
+		# The check stays pending until the callback returns, so nobody sees it finished before its result has been handed on
+		check = self.checks[graceid]
+		try:
+			self.callback(graceid, check['overflow_dict'], check['failed'])
+		finally:
+			self.condition.acquire()
+			try:
+				self.checks.pop(graceid)
+			finally:
+				self.condition.release()
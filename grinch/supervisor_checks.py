@@ -2,10 +2,20 @@ description = """ a module for performing checks of GraceDB triggered processes.
 
 #=================================================
 
+import re
 import sys
 import time
+import bisect
+import inspect
+import itertools
+import threading
+import traceback
 import numpy as np
 
+from multiprocessing.pool import ThreadPool
+
+import gpstime
+
 #=================================================
 # utilities
 #=================================================
@@ -16,21 +26,6 @@ def report( string ):
 def errReport( string ):
     print >> sys.stderr, "%s GMT :  %s"%(time.asctime(time.gmtime()), string)
 
-def datestring_converter( datestring ):
-    """
-    converts a lalapps_tconvert return string into the correct form for GraceDB queries
-    """
-    monthD = dict( zip("Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(), range(1,13)) )
-    wkday, month, day, timestamp, timezone, yr = datestring.split()
-    return "%s-%s-%s %s"%(yr, __fix_int(monthD[month]), __fix_int(day), timestamp) ### leave off timezone
-#    return "%s-%s-%s %s %s"%(yr, __fix_int(monthD[month]), __fix_int(day), timestamp, timezone)
-
-def __fix_int( num ):
-    if num < 10:
-        return "0%d"%num
-    else:
-        return "%s"%num
-
 def log_for_filename( filename, logs, verbose=False ):
     """
     finds the log associated with a given filename
@@ -121,6 +116,615 @@ def isINJ( gracedb, gdb_id, verbose=False ):
             report( "\tevent not labeled \"INJ\"" )
     return truth
 
+#=================================================
+# caching of GraceDB queries
+#=================================================
+
+class CachedResponse( object ):
+    """
+    a minimal stand-in for the response objects returned by GraceDb
+    only supports .json(), which is all the checks use
+    """
+    def __init__( self, data ):
+        self.data = data
+
+    def json( self ):
+        return self.data
+
+class EventSnapshot( object ):
+    """
+    a snapshot of a single GraceDB event (event dictionary, logs, files and labels) shared by all checks.
+    This mimics the parts of the GraceDb interface used by the checks, so it can be passed in place of the connection to any check function.
+    Each piece of information is retrieved at most once per ttl seconds. Once ttl expires, the next query refreshes the snapshot.
+    Queries for other events and everything else (writeLog, events, service_url, ...) are passed through to the underlying connection.
+
+    Log messages are kept for the lifetime of the snapshot and updated incrementally using their sequence number (N).
+    If there is no log message N=last_N+1, nothing new has been posted and we skip downloading the full list.
+    That shortcut cannot see tags added later to messages we already hold (which file_has_tag, tags_match and the lvem checks depend on),
+    so the full list is still downloaded at least once every full_ttl seconds and after refresh(). Between those, tags may be up to full_ttl seconds stale.
+    Messages added by the most recent update are available as new_logs and are added to index, which checks use to look up the messages they care about.
+
+    If supplied, event_index (an EventTimeIndex of recent events) lets local_rates count neighbors without querying GraceDB.
+    """
+
+    def __init__( self, gdb, gdb_id, ttl=10.0, full_ttl=60.0, event_index=None, verbose=False ):
+        self.gdb = gdb
+        self.gdb_id = gdb_id
+        self.ttl = ttl
+        self.full_ttl = full_ttl
+        self.full_expires = -np.infty ### time after which we must download the full list of logs again
+        self.verbose = verbose
+
+        self.event_index = event_index ### an EventTimeIndex shared by all events, used by local_rates
+
+        self.expires = -np.infty ### time at which the cached data becomes stale
+        self.cache = {}
+        self.lock = threading.RLock()
+
+        self.log_list = [] ### every log message seen so far, ordered by N
+        self.last_N = 0 ### the largest log sequence number seen so far
+        self.new_logs = [] ### log messages that first appeared in the most recent update
+        self.index = LogIndex() ### only new_logs are scanned when they arrive
+
+    def __getattr__( self, name ):
+        ### only called for attributes we do not define ourselves
+        return getattr( self.gdb, name )
+
+    def refresh( self ):
+        """
+        forget everything so the next query goes back to GraceDB
+        log messages we have already seen are retained, but the full list is downloaded again to pick up any new tags
+        """
+        self.lock.acquire()
+        try:
+            self.cache = {}
+            self.expires = -np.infty
+            self.full_expires = -np.infty
+        finally:
+            self.lock.release()
+
+    def _get( self, name, query ):
+        self.lock.acquire() ### checks running concurrently wait for the first query rather than repeating it
+        try:
+            now = time.time()
+            if now >= self.expires: ### everything is stale
+                self.cache = {}
+                self.expires = now + self.ttl
+            if not self.cache.has_key( name ):
+                if self.verbose:
+                    report( "%s : snapshot retrieving %s"%(self.gdb_id, name) )
+                self.cache[name] = query()
+            return CachedResponse( self.cache[name] )
+        finally:
+            self.lock.release()
+
+    def event( self, gdb_id ):
+        if gdb_id != self.gdb_id:
+            return self.gdb.event( gdb_id )
+        return self._get( 'event', lambda: self.gdb.event( gdb_id ).json() )
+
+    def logs( self, gdb_id, *args, **kwargs ):
+        if (gdb_id != self.gdb_id) or args or kwargs: ### only the full list of logs is cached
+            return self.gdb.logs( gdb_id, *args, **kwargs )
+        return self._get( 'logs', self.update_logs )
+
+    def update_logs( self ):
+        """
+        brings log_list up to date, only processing log messages with N > last_N
+        returns a dictionary with the same structure as GraceDb.logs().json()
+        """
+        if self.last_N and (time.time() < self.full_expires):
+            try:
+                self.gdb.logs( self.gdb_id, self.last_N+1 ) ### a single, small query
+            except Exception as e:
+                if getattr(e, 'status', None) == 404: ### no such message, so nothing new
+                    if self.verbose:
+                        report( "%s : snapshot found no log messages after N=%d"%(self.gdb_id, self.last_N) )
+                    self.new_logs = []
+                    return {'log':self.log_list}
+                ### any other problem, fall back to the full list
+
+        logs = self.gdb.logs( self.gdb_id ).json()['log']
+        self.full_expires = time.time() + self.full_ttl
+
+        ### merge into what we already know. Known messages are updated in place so we pick up any new tags
+        ### without invalidating the references held by the index
+        known = dict( (log['N'], log) for log in self.log_list )
+        new_logs = []
+        for log in logs:
+            if known.has_key( log['N'] ):
+                known[log['N']].update( log )
+            else:
+                new_logs.append( log )
+        if self.verbose:
+            report( "%s : snapshot found %d new log messages after N=%d"%(self.gdb_id, len(new_logs), self.last_N) )
+        self.new_logs = sorted( new_logs, key=lambda log: log['N'] )
+        self.log_list = sorted( self.log_list + self.new_logs, key=lambda log: log['N'] )
+        if self.new_logs:
+            self.last_N = max( self.last_N, self.new_logs[-1]['N'] )
+        self.index.add( self.new_logs )
+
+        return {'log':self.log_list}
+
+    def load_logs( self, logs ):
+        """
+        starts from log messages downloaded earlier (e.g. recorded in a ScheduleStore before a restart), so only later messages are downloaded
+        """
+        self.lock.acquire()
+        try:
+            known = set( log['N'] for log in self.log_list )
+            logs = [log for log in logs if log['N'] not in known]
+            self.log_list = sorted( self.log_list + logs, key=lambda log: log['N'] )
+            if self.log_list:
+                self.last_N = max( self.last_N, self.log_list[-1]['N'] )
+            self.index.add( logs )
+            self.cache.pop( 'logs', None )
+            self.full_expires = time.time() + self.full_ttl ### trust what we loaded until the next full download is due
+        finally:
+            self.lock.release()
+
+    def add_log( self, log ):
+        """
+        adds a log message delivered by some other means (e.g. an lvalert) without querying GraceDB.
+        If it is not the next message in sequence we cannot be sure we have not missed something, so the next query for logs goes back to GraceDB instead
+        """
+        self.lock.acquire()
+        try:
+            if not log.has_key( 'N' ): ### not something we can place in sequence
+                self.cache.pop( 'logs', None )
+
+            elif log['N'] == self.last_N+1:
+                if self.verbose:
+                    report( "%s : snapshot adding log message N=%d"%(self.gdb_id, log['N']) )
+                self.log_list = self.log_list + [log]
+                self.new_logs = [log]
+                self.last_N = log['N']
+                self.index.add( self.new_logs )
+                if self.cache.has_key( 'logs' ):
+                    self.cache['logs'] = {'log':self.log_list}
+
+            elif log['N'] > self.last_N:
+                self.cache.pop( 'logs', None )
+
+            else: ### we already know about this one, but it may carry new tags
+                for known in self.log_list:
+                    if known['N'] == log['N']:
+                        known.update( log )
+                        break
+
+            if log.get('filename'): ### a new file was uploaded
+                self.cache.pop( 'files', None )
+        finally:
+            self.lock.release()
+
+    def files( self, gdb_id, *args, **kwargs ):
+        if (gdb_id != self.gdb_id) or args or kwargs: ### only the list of files is cached, not their contents
+            return self.gdb.files( gdb_id, *args, **kwargs )
+        return self._get( 'files', lambda: self.gdb.files( gdb_id ).json() )
+
+    def labels( self, gdb_id, *args, **kwargs ):
+        if (gdb_id != self.gdb_id) or args or kwargs:
+            return self.gdb.labels( gdb_id, *args, **kwargs )
+        return self._get( 'labels', lambda: self.gdb.labels( gdb_id ).json() )
+
+#=================================================
+# indexing of log messages
+#=================================================
+
+### the substrings each check looks for within log comments
+### a LogIndex scans every log message for all of these at once, so checks simply look up the messages they need
+### patterns that are not listed here (e.g. segment_summary's "<flag> defined") are added to an index the first time they are requested
+log_patterns = {
+    'cwb_eventcreation'         : ["cWB parameter estimation"],
+    'olib_eventcreation'        : ["Preliminary results: "],
+    'gstlal_eventcreation'      : ["strain spectral densities", "Coinc Table Created"],
+    'gstlalspiir_eventcreation' : ["strain spectral densities", "Coinc Table Created"],
+    'mbta_eventcreation'        : ["Coinc Table Created", "PSDs"],
+    'idq_start'                 : ["Started searching for iDQ information"],
+    'idq_finish'                : ["Finished searching for iDQ information"],
+    'idq_timeseries'            : ["FAILED: iDQ glitch-rank timeseries for", "minimum glitch-FAP"],
+    'idq_tables'                : ["FAILED: iDQ glitch tables for"],
+    'idq_performance'           : ["FAILED: iDQ local performance for"],
+    'lib_start'                 : ["LIB Parameter estimation started."],
+    'lib_finish'                : ["LIB Parameter estimation finished."],
+    'bayeswave_start'           : ["BayesWaveBurst launched"],
+    'bayeswave_finish'          : ["BWB Follow-up results"],
+    'bayestar_start'            : ["INFO:BAYESTAR:starting sky localization"],
+    'bayestar_finish'           : ["INFO:BAYESTAR:sky localization complete"],
+    'lalinference_start'        : ["LALInference online parameter estimation started"],
+    'lalinference_finish'       : ["LALInference online parameter estimation finished"],
+    'externaltriggers_search'   : ["Coincidence search complete"],
+    'unblindinjections_search'  : ["No unblind injections in window"],
+    'approval_processor_far'    : ["Candidate event has low enough FAR", "Candidate event rejected due to large FAR", "Ignoring new event because we found a hardware injection"],
+}
+
+def registered_patterns():
+    """
+    the set of all patterns listed in log_patterns
+    """
+    patterns = set()
+    for p in log_patterns.values():
+        patterns.update( p )
+    return patterns
+
+class LogIndex( object ):
+    """
+    maps each pattern to the log messages whose comments contain it, in the order the messages were added.
+    All patterns are compiled into a single regular expression, so each message is scanned exactly once when it is added no matter how many checks care about it.
+    """
+
+    def __init__( self, patterns=None ):
+        self.logs = [] ### every message added so far
+        self.index = {} ### pattern -> list of messages
+        self.regex = None
+        self.implied = {} ### pattern -> shorter patterns that are prefixes of it (the regex only reports the longest match at each position)
+        self.lock = threading.RLock()
+
+        if patterns is None:
+            patterns = registered_patterns()
+        self.add_patterns( patterns )
+
+    def add_patterns( self, patterns ):
+        """
+        start indexing new patterns. Messages we have already seen are searched only for the new patterns
+        """
+        self.lock.acquire()
+        try:
+            new = [p for p in set(patterns) if not self.index.has_key( p )]
+            if not new:
+                return
+
+            for p in new:
+                self.index[p] = [log for log in self.logs if p in log['comment']]
+
+            patterns = sorted( self.index.keys(), key=len, reverse=True ) ### longest first so overlapping matches are all recovered via self.implied
+            self.regex = re.compile( "(?=(%s))"%("|".join([re.escape(p) for p in patterns])) ) ### lookahead reports a match at every position
+            self.implied = dict( (p, [q for q in patterns if (q != p) and p.startswith( q )]) for p in patterns )
+        finally:
+            self.lock.release()
+
+    def add( self, logs ):
+        """
+        index new log messages
+        """
+        self.lock.acquire()
+        try:
+            for log in logs:
+                self.logs.append( log )
+                for p in self.match( log['comment'] ):
+                    self.index[p].append( log )
+        finally:
+            self.lock.release()
+
+    def match( self, comment ):
+        """
+        the set of indexed patterns contained in comment
+        """
+        self.lock.acquire()
+        try:
+            found = set()
+            if self.regex is not None:
+                for match in self.regex.finditer( comment ):
+                    p = match.group(1)
+                    found.add( p )
+                    found.update( self.implied[p] )
+            return found
+        finally:
+            self.lock.release()
+
+    def get( self, pattern ):
+        """
+        the messages containing pattern
+        """
+        self.lock.acquire()
+        try:
+            if not self.index.has_key( pattern ):
+                self.add_patterns( [pattern] )
+            return list( self.index[pattern] )
+        finally:
+            self.lock.release()
+
+### checks that look at the files attached to an event, and so may be affected by any log message that uploads a file
+file_checks = set( ["idq_timeseries", "idq_tables", "idq_performance",
+                    "cwb_skymap", "lib_skymap", "bayestar_skymap", "bayeswave_skymap", "lalinference_skymap",
+                    "plot_skymaps", "json_skymaps", "skymap_summary", "segment_summary"] )
+
+def affected_checks( log, index ):
+    """
+    the names of the check functions whose result may change because of this log message
+    """
+    patterns = index.match( log.get('comment', '') )
+    names = set( [name for name, p in log_patterns.items() if patterns.intersection( p )] )
+    if log.get('filename'):
+        names.update( file_checks )
+    return names
+
+def log_index( gdb, gdb_id, logs=None ):
+    """
+    the LogIndex for this event.
+    If gdb is an EventSnapshot for this event, we reuse the index it maintains incrementally.
+    Otherwise we index logs (retrieving them if they are not supplied)
+    """
+    if isinstance( gdb, EventSnapshot ) and (gdb.gdb_id == gdb_id):
+        gdb.logs( gdb_id ) ### brings the snapshot's index up to date
+        return gdb.index
+    if logs is None:
+        logs = gdb.logs( gdb_id ).json()['log']
+    index = LogIndex()
+    index.add( logs )
+    return index
+
+#=================================================
+# in-memory index of recent events
+#=================================================
+
+def full_event_type( gdb_entry ):
+    """
+    the event type as used by local_rates (not forced to lower case)
+    """
+    if gdb_entry.has_key('search'):
+        return "%s_%s_%s"%(gdb_entry['group'], gdb_entry['pipeline'], gdb_entry['search'])
+    else:
+        return "%s_%s"%(gdb_entry['group'], gdb_entry['pipeline'])
+
+def created_to_unix( created ):
+    """
+    converts a GraceDB creation time string into seconds since the unix epoch
+    """
+    return gpstime.to_unix( created )
+
+class EventTimeIndex( object ):
+    """
+    a sliding, time-sorted index of recently created events, fed by the stream of "new" lvalerts.
+    Events are kept sorted by gpstime ("event_time") and by creation time ("creation_time", seconds since the unix epoch) so local_rates can count neighbors with bisect instead of querying GraceDB.
+
+    We only know about events created since start and forget events more than span seconds old.
+    We are only fed the lvalert nodes we subscribe to, so we only vouch for the event types we have seen a "new" alert for,
+    and for all event types together only if all_types says we are fed every node (including those we do not supervise).
+    Windows we cannot vouch for (covers() returns False) must still be queried from GraceDB.
+    """
+
+    def __init__( self, span=3600.0, start=None, all_types=False ):
+        self.span = span
+        if start is None:
+            start = time.time()
+        self.start = start ### unix time since which we have seen every new event
+        self.all_types = all_types
+
+        self.times = {'event_time':[], 'creation_time':[]} ### sorted times
+        self.entries = {'event_time':[], 'creation_time':[]} ### (gdb_id, event_type) in the same order as times
+        self.known = set()
+        self.event_types = set() ### every event type we have been fed. These are never forgotten
+        self.lock = threading.Lock()
+
+    def add( self, gdb_entry ):
+        """
+        adds a single event (a GraceDB event dictionary)
+        """
+        gdb_id = gdb_entry['graceid']
+        entry = (gdb_id, full_event_type( gdb_entry ))
+        self.lock.acquire()
+        try:
+            if gdb_id in self.known:
+                return
+            self.known.add( gdb_id )
+            self.event_types.add( entry[1] )
+            for timestamp, t in [('event_time', float(gdb_entry['gpstime'])), ('creation_time', created_to_unix( gdb_entry['created'] ))]:
+                ind = bisect.bisect_right( self.times[timestamp], t )
+                self.times[timestamp].insert( ind, t )
+                self.entries[timestamp].insert( ind, entry )
+            self._prune( time.time() )
+        finally:
+            self.lock.release()
+
+    def _prune( self, now ):
+        cutoff = now - self.span
+        if cutoff <= self.start:
+            return
+        self.start = cutoff
+        for timestamp, t in [('event_time', gpstime.utc_to_gps( cutoff )), ('creation_time', cutoff)]:
+            ind = bisect.bisect_left( self.times[timestamp], t )
+            self.times[timestamp] = self.times[timestamp][ind:]
+            self.entries[timestamp] = self.entries[timestamp][ind:]
+        self.known = set( [gdb_id for gdb_id, _ in self.entries['event_time']] )
+
+    def covers( self, timestamp, start, event_type=None ):
+        """
+        whether we have seen every event of event_type (of every type if event_type is None) with timestamp >= start
+        an event's gpstime is never later than its creation, so every event with gpstime after we started listening was created after we started listening
+        """
+        if event_type is None:
+            if not self.all_types:
+                return False
+        elif event_type not in self.event_types:
+            return False
+        if timestamp == "creation_time":
+            return start >= self.start
+        elif timestamp == "event_time":
+            return start >= gpstime.utc_to_gps( self.start )
+        else:
+            raise ValueError("timestamp=%s not understood"%timestamp)
+
+    def neighbors( self, timestamp, start, stop ):
+        """
+        the (gdb_id, event_type) of every event with start <= timestamp <= stop
+        """
+        self.lock.acquire()
+        try:
+            times = self.times[timestamp]
+            return self.entries[timestamp][bisect.bisect_left( times, start ):bisect.bisect_right( times, stop )]
+        finally:
+            self.lock.release()
+
+#=================================================
+# checking many events at once
+#=================================================
+
+def latency_from_logs( logs, to, tz=gpstime.GRACEDB_TIMEZONE ):
+    """
+    the latency (seconds) of a check relative to "to" (seconds since the unix epoch) based on the log messages it returned.
+    All logs are required for the check to complete, so the latency is the maximum over this set. Without any logs the latency is infinite.
+    log creation times without an explicit time zone are interpreted in tz
+    """
+    if not logs:
+        return np.infty
+    return max( gpstime.to_unix( log['created'], tz=tz ) for log in logs ) - to
+
+class CheckTable( object ):
+    """
+    the result of check_events : one row per event and one column per check.
+    action_required and failed are boolean arrays and latency (seconds since the event was created) is a float array, all with shape (len(gdb_ids), len(checks)).
+    latency is nan if the check does not report its logs or could not be performed. errors maps (row, column) -> traceback for everything that failed
+    and logs maps (row, column) -> the log messages reported by each check that returns them
+    """
+
+    def __init__( self, gdb_ids, checks ):
+        self.gdb_ids = list(gdb_ids)
+        self.checks = list(checks)
+        shape = (len(self.gdb_ids), len(self.checks))
+        self.action_required = np.zeros( shape, dtype=bool )
+        self.failed = np.zeros( shape, dtype=bool )
+        self.latency = np.empty( shape, dtype=float )
+        self.latency[:] = np.nan
+        self.errors = {}
+        self.logs = {}
+
+    def set( self, row, column, action_required, latency=np.nan, logs=None ):
+        self.action_required[row, column] = action_required
+        self.latency[row, column] = latency
+        if logs is not None:
+            self.logs[(row, column)] = logs
+
+    def fail( self, row, column, error ):
+        self.failed[row, column] = True
+        self.errors[(row, column)] = error
+
+    def row( self, gdb_id ):
+        """
+        a dictionary mapping check -> (action_required, latency) for this event. Failed checks map to (None, nan)
+        """
+        i = self.gdb_ids.index( gdb_id )
+        return dict( (check, (None if self.failed[i, j] else bool(self.action_required[i, j]), self.latency[i, j])) for j, check in enumerate(self.checks) )
+
+    def column( self, check ):
+        """
+        a dictionary mapping gdb_id -> (action_required, latency) for this check. Failed checks map to (None, nan)
+        """
+        j = self.checks.index( check )
+        return dict( (gdb_id, (None if self.failed[i, j] else bool(self.action_required[i, j]), self.latency[i, j])) for i, gdb_id in enumerate(self.gdb_ids) )
+
+    def __str__( self ):
+        width = max( [len(gdb_id) for gdb_id in self.gdb_ids] + [len("graceid")] )
+        lines = [" ".join( ["%-*s"%(width, "graceid")] + ["%s"%check for check in self.checks] )]
+        for i, gdb_id in enumerate(self.gdb_ids):
+            fields = ["%-*s"%(width, gdb_id)]
+            for j, check in enumerate(self.checks):
+                if self.failed[i, j]:
+                    field = "FAILED"
+                elif np.isnan(self.latency[i, j]):
+                    field = "%s"%bool(self.action_required[i, j])
+                else:
+                    field = "%s(%.0fs)"%(bool(self.action_required[i, j]), self.latency[i, j])
+                fields.append( "%-*s"%(len(check), field) )
+            lines.append( " ".join( fields ) )
+        return "\n".join( lines )
+
+
+def _prefetch( snapshot ):
+    """
+    retrieves everything the checks will ask about this event
+    """
+    gdb_id = snapshot.gdb_id
+    try:
+        snapshot.event( gdb_id )
+        snapshot.logs( gdb_id )
+        snapshot.files( gdb_id )
+        snapshot.labels( gdb_id )
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+def _evaluate( snapshot, foo, kwargs, tz ):
+    """
+    evaluates a single check against a snapshot, returning (action_required, latency, logs, error)
+    """
+    gdb_id = snapshot.gdb_id
+    try:
+        result = foo( snapshot, gdb_id, **kwargs )
+        if kwargs.get('returnLogs', False):
+            action_required, logs = result
+            latency = latency_from_logs( logs, created_to_unix( snapshot.event( gdb_id ).json()['created'] ), tz=tz )
+        else:
+            action_required = result
+            latency = np.nan
+            logs = None
+    except Exception:
+        return None, np.nan, None, traceback.format_exc()
+    return action_required, latency, logs, None
+
+def check_events( gdb, gdb_ids, checks, workers=8, event_index=None, tz=gpstime.GRACEDB_TIMEZONE, verbose=False ):
+    """
+    evaluates every check in checks for every event in gdb_ids, returning a CheckTable.
+
+    checks is a list of names of check functions defined in this module (e.g. "idq_start"), (name, kwargs) pairs or (name, function, kwargs) triples (e.g. from a schedule).
+    The event, logs, files and labels of each event are retrieved once, with at most workers queries in flight, and every check is then evaluated against that shared snapshot.
+    Checks that accept returnLogs are asked for their logs so we can report latencies (log creation times without an explicit time zone are interpreted in tz).
+    """
+    names = []
+    foos = []
+    for check in checks:
+        if isinstance( check, str ):
+            name, foo, kwargs = check, globals().get( check ), {}
+        elif len(check) == 2:
+            name, kwargs = check
+            foo = globals().get( name )
+        else:
+            name, foo, kwargs = check
+        if not callable( foo ):
+            raise ValueError( "check=%s not understood"%(name) )
+        names.append( name )
+        kwargs = dict( kwargs )
+        args = inspect.getargspec( foo ).args
+        if 'returnLogs' in args:
+            kwargs['returnLogs'] = True
+        if 'verbose' in args:
+            kwargs.setdefault( 'verbose', verbose )
+        foos.append( (foo, kwargs) )
+
+    table = CheckTable( gdb_ids, names )
+    snapshots = [EventSnapshot( gdb, gdb_id, ttl=np.infty, event_index=event_index ) for gdb_id in table.gdb_ids]
+
+    pool = ThreadPool( workers )
+    try:
+        if verbose:
+            report( "retrieving %d events with %d workers"%(len(snapshots), workers) )
+        errors = pool.map( _prefetch, snapshots )
+
+        asyncs = []
+        for i, (snapshot, error) in enumerate(zip(snapshots, errors)):
+            if error is not None:
+                if verbose:
+                    report( "%s : could not retrieve event"%(snapshot.gdb_id) )
+                for j in xrange(len(foos)):
+                    table.fail( i, j, error )
+                continue
+            for j, (foo, kwargs) in enumerate(foos):
+                asyncs.append( (i, j, pool.apply_async( _evaluate, (snapshot, foo, kwargs, tz) )) )
+
+        if verbose:
+            report( "evaluating %d checks"%(len(asyncs)) )
+        for i, j, a in asyncs:
+            action_required, latency, logs, error = a.get()
+            if error is None:
+                table.set( i, j, action_required, latency, logs=logs )
+            else:
+                table.fail( i, j, error )
+    finally:
+        pool.close()
+        pool.join()
+
+    return table
+
 #=================================================
 # set up schedule of checks
 #=================================================
@@ -131,6 +735,43 @@ def get_dt( string ):
     """
     return [float(l) for l in string.split()]
 
+### checks whose result can change from "no action required" back to "action required"
+### e.g. tags that stop matching or FAILED statements posted after the check first passed.
+### These are evaluated at every scheduled dt even when satisfied checks are final
+may_regress = set( ["notify", "far", "local_rates at event_time", "local_rates at creation_time",
+                    "idq_timeseries", "idq_tables", "idq_performance",
+                    "cwb_skymap", "lib_skymap", "bayestar_skymap", "bayeswave_skymap", "lalinference_skymap",
+                    "plot_skymaps", "json_skymaps", "skymap_summary"] )
+
+class Schedule( list ):
+    """
+    the schedule of checks for a single event : (dt, function, kwargs, email, description) tuples ordered by dt.
+    A check is only ever scheduled once at a given dt, even if the config (or merging of several lists of dt) repeats it.
+
+    Checks that share a dt are grouped into ticks when the schedule is built. ticks is a list of (dt, [indices into the schedule]) pairs
+    so everything due at the same time can be evaluated together against one snapshot of the event with a single wake-up.
+    """
+
+    def __init__( self, schedule=[] ):
+        unique = []
+        seen = set()
+        for item in schedule:
+            key = (item[0], item[-1]) ### (dt, description)
+            if key not in seen:
+                seen.add( key )
+                unique.append( item )
+        unique.sort(key=lambda l:l[0]) ### order according to dt, smallest to largest
+
+        list.__init__( self, unique )
+        self.ticks = [(dt, [ind for ind, item in group]) for dt, group in itertools.groupby( enumerate(self), key=lambda l: l[1][0] )]
+
+    def later( self, ind ):
+        """
+        the indices of every later evaluation of the check at ind
+        """
+        description = self[ind][-1]
+        return [i for i in xrange(ind+1, len(self)) if self[i][-1] == description]
+
 def config_to_schedule( config, event_type, verbose=False, freq=None, returnLogs=False ):
     """
     determines the schedule of checks that should be performed for this event
@@ -138,6 +779,8 @@ def config_to_schedule( config, event_type, verbose=False, freq=None, returnLogs
 
     returnLogs is added to kwargs where appropriate and checks are skipped if that option doesn't make sense for them
         should really only be used when measuring latencies
+
+    returns a Schedule, which also groups checks due at the same time into ticks
     """
 
     ### extract lists of checks
@@ -587,10 +1230,8 @@ def config_to_schedule( config, event_type, verbose=False, freq=None, returnLogs
 
 
 
-    ### order according to dt, smallest to largest
-    schedule.sort(key=lambda l:l[0])
-
-    return schedule
+    ### order according to dt, drop duplicates and group into ticks
+    return Schedule( schedule )
 
 #=================================================
 # methods that don't check things, just notify humans
@@ -663,6 +1304,9 @@ def local_rates( gdb, gdb_id, verbose=False, window=5.0, rate_thr=5.0, event_typ
 
     time_stamp = "event_time" -> use the gps time associated with an event
     time_stamp = "creation_time" -> use the time associated with the event creation
+
+    if gdb carries an EventTimeIndex (gdb.event_index) that covers the window for every event type, neighbors are counted from that instead of querying GraceDB.
+    If it only covers this event type, we still query GraceDB for the total unless the index already holds enough events of this type to require action
     """
     if verbose:
         report( "%s : local_rates"%(gdb_id) )
@@ -673,17 +1317,12 @@ def local_rates( gdb, gdb_id, verbose=False, window=5.0, rate_thr=5.0, event_typ
     gdb_entry = gdb.event( gdb_id ).json()
 
     ### get event type
-    group = gdb_entry['group']
-    pipeline = gdb_entry['pipeline']
-    if gdb_entry.has_key('search'):
-        search = gdb_entry['search']
-        event_type = "%s_%s_%s"%(group, pipeline, search)
-    else:
-        search = None
-        event_type = "%s_%s"%(group, pipeline)
+    event_type = full_event_type( gdb_entry )
     if verbose:
         report( "\t\tevent_type : %s"%(event_type) )
 
+    event_index = getattr( gdb, 'event_index', None )
+
     ### get event time
     if verbose:
         report( "\t\ttimestamp : %s"%(timestamp) )
@@ -691,50 +1330,58 @@ def local_rates( gdb, gdb_id, verbose=False, window=5.0, rate_thr=5.0, event_typ
         event_time = float(gdb_entry['gpstime'])
         if verbose:
             report( "\t\tgpstime : %.6f"%(event_time) )
-        ### query for neighbors in (t-window, t+window), excluding this event
-        if verbose:
-            report( "\tretrieving neighbors within [%.6f-%.6f, %.6f+%6f]"%(event_time, window, event_time, window) )
-        gdb_entries = [ entry for entry in gdb.events( "%d .. %d"%(np.floor(event_time-window), np.ceil(event_time+window)) ) if entry['graceid'] != gdb_id ]
+        start = np.floor(event_time-window)
+        stop = np.ceil(event_time+window)
+        winstart = "%.6f-%.6f"%(event_time, window)
+        winstop = "%.6f+%.6f"%(event_time, window)
 
-    elif timestamp=="creation_time":
-        import subprocess as sp
+        query = "%d .. %d"%(start, stop)
+        querywindow = "[%s, %s]"%(winstart, winstop)
 
-        event_time = float(sp.Popen(["lalapps_tconvert", gdb_entry['created']], stdout=sp.PIPE).communicate()[0])
+    elif timestamp=="creation_time":
+        event_time = created_to_unix( gdb_entry['created'] )
         if verbose:
             report( "\t\tcreated : %s -> %.6f"%(gdb_entry['created'], event_time) )
-        ### query for neighbors in (t-window, t+window), excluding this event
-#        winstart = datestring_converter( sp.Popen(["lalapps_tconvert", "%d"%np.floor(event_time-window)], stdout=sp.PIPE).communicate()[0].strip() )
-#        winstop  = datestring_converter( sp.Popen(["lalapps_tconvert", "%d"%np.ceil(event_time+window)], stdout=sp.PIPE).communicate()[0].strip() )
-#        if verbose:
-#            report( "\tretrieving neighbors within [%s, %s]"%(winstart, winstop) )
-
-        #===========================================================================================
-        #
-        report( "WARNING: you are using a hack to correct for peculiarities in querying GraceDB with creation time. We convert GMT -> CST by hand by subtracting 5 hours from the gps time and then converting using lalapps_tconvert. This gives us a time in UTC which we pretend is in CST for the query (string formatted through datestring_converter()" )
-        winstart = datestring_converter( sp.Popen(["lalapps_tconvert", "%d"%np.floor(event_time-window - 5*3600 )], stdout=sp.PIPE).communicate()[0].strip() )
-        winstop   = datestring_converter( sp.Popen(["lalapps_tconvert", "%d"%np.ceil(event_time+window - 5*3600 )], stdout=sp.PIPE).communicate()[0].strip() )
-        if verbose:
-            report( "\tretrieving neighbors within [%s CST, %s CST]"%(winstart, winstop) )
-        #
-        #===========================================================================================
-
-        gdb_entries = [ entry for entry in gdb.events( "created: %s .. %s"%(winstart, winstop) ) if entry['graceid'] != gdb_id ]
-        
+        start = np.floor(event_time-window)
+        stop = np.ceil(event_time+window)
+        winstart = gpstime.from_unix( start, fmt="%Y-%m-%d %H:%M:%S UTC" )
+        winstop = gpstime.from_unix( stop, fmt="%Y-%m-%d %H:%M:%S UTC" )
+
+        ### GraceDB interprets creation times in queries in its own local time zone
+        querystart = gpstime.gracedb_query_time( start )
+        querystop = gpstime.gracedb_query_time( stop )
+        query = "created: %s .. %s"%(querystart, querystop)
+        querywindow = "[%s, %s] (GraceDB local time)"%(querystart, querystop)
+
     else:
         raise ValueError("timestamp=%s not understood"%timestamp)
 
-    ### count numbers of events
+    ### find neighbors, excluding this event
+    ### the index holds every event of the types it has been fed, but only holds every event of every type if it is fed all lvalert nodes
+    count_thr = 2*window*rate_thr
+    indexed = None
+    if (event_index is not None) and event_index.covers( timestamp, start, event_type=event_type ):
+        if verbose:
+            report( "\tcounting indexed neighbors within [%s, %s]"%(winstart, winstop) )
+        indexed = [e_type for graceid, e_type in event_index.neighbors( timestamp, start, stop ) if graceid != gdb_id]
+
+    if (indexed is not None) and event_index.covers( timestamp, start ):
+        neighbor_types = indexed
+    elif (indexed is not None) and (1 + indexed.count( event_type ) > count_thr):
+        ### enough events of this type to require action, so we do not need the total
+        neighbor_types = indexed
+    else:
+        ### query for neighbors in (t-window, t+window)
+        if verbose:
+            report( "\tretrieving neighbors within %s"%(querywindow) )
+        neighbor_types = [ full_event_type( entry ) for entry in gdb.events( query ) if entry['graceid'] != gdb_id ]
+
     if verbose:
         report( "\tcounting events:" )
     nevents = 1
     nevents_type = 1
-    for entry in gdb_entries:
+    for e_type in neighbor_types:
         nevents += 1
-        if entry.has_key('search'):
-            e_type = "%s_%s_%s"%(entry['group'], entry['pipeline'], entry['search'])
-        else:
-            e_type = "%s_%s"%(entry['group'], entry['pipeline'])
-
         nevents_type += (e_type == event_type) ### increment if true
 
     if verbose:
@@ -742,7 +1389,6 @@ def local_rates( gdb, gdb_id, verbose=False, window=5.0, rate_thr=5.0, event_typ
         report( "\t\t%d total"%(nevents) )
 
     ### check rates
-    count_thr = 2*window*rate_thr
     if (nevents_type) > count_thr:
         if verbose:
             if timestamp=="event_time":
@@ -784,19 +1430,12 @@ def cwb_eventcreation( gdb, gdb_id, verbose=False, returnLogs=False ):
     if verbose:
         report( "%s : cwb_eventcreation"%(gdb_id) )
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    pe = False
-    Logs = []
-    for log in logs:
-        comment = log['comment']
-        if "cWB parameter estimation" in comment:
-            pe = True
-            Logs.append( log )
-        if (pe):
-            break
+    Logs = index.get( "cWB parameter estimation" )[:1]
+    pe = len(Logs) > 0
 
     if verbose:
         report( "\taction required : %s"%( not (pe)) )
@@ -815,19 +1454,12 @@ def olib_eventcreation( gdb, gdb_id, verbose=False, returnLogs=False ):
     if verbose:
         report( "%s : olib_eventcreation"%(gdb_id) )
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    prelim = False
-    Logs = []
-    for log in logs:
-        comment = log['comment']
-        if "Preliminary results: " in comment:
-            prelim = True
-            Logs.append( log )
-        if prelim:
-            break
+    Logs = index.get( "Preliminary results: " )[:1]
+    prelim = len(Logs) > 0
 
     if verbose:
         report( "\taction required : %s"%(not (prelim)) )
@@ -846,24 +1478,15 @@ def gstlal_eventcreation( gdb, gdb_id, verbose=False, returnLogs=False ):
     if verbose:
         report( "%s : gstlal_eventcreation"%(gdb_id) )
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    psd = False
-    coinc = False
-    Logs = []
-    for log in logs:
-        comment = log['comment']
-        if "strain spectral densities" in comment:
-            psd = True
-            Logs.append( log )
-        elif "Coinc Table Created" in comment:
-            coinc = True
-            Logs.append( log )
-
-        if psd and coinc:
-            break
+    psd_logs = index.get( "strain spectral densities" )[:1]
+    coinc_logs = [log for log in index.get( "Coinc Table Created" ) if log not in psd_logs][:1] ### a single message only counts once
+    psd = len(psd_logs) > 0
+    coinc = len(coinc_logs) > 0
+    Logs = sorted( psd_logs + coinc_logs, key=lambda log: log['N'] )
 
     if verbose:
         report( "\taction required : %s"% (not (psd and coinc)) )
@@ -882,24 +1505,15 @@ def gstlalspiir_eventcreation( gdb, gdb_id, verbose=False, returnLogs=False ):
     if verbose:
         report( "%s : gstlal-spiir_eventcreation"%(gdb_id) )
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    psd = False
-    coinc = False
-    Logs = []
-    for log in logs:
-        comment = log['comment']
-        if "strain spectral densities" in comment:
-            psd = True
-            Logs.append( log )
-        elif "Coinc Table Created" in comment:
-            coinc = True
-            Logs.append( log )
-
-        if psd and coinc:
-            break
+    psd_logs = index.get( "strain spectral densities" )[:1]
+    coinc_logs = [log for log in index.get( "Coinc Table Created" ) if log not in psd_logs][:1] ### a single message only counts once
+    psd = len(psd_logs) > 0
+    coinc = len(coinc_logs) > 0
+    Logs = sorted( psd_logs + coinc_logs, key=lambda log: log['N'] )
 
     if verbose:
         report( "\taction required : %s"% (not (psd and coinc)) )
@@ -917,23 +1531,15 @@ def mbta_eventcreation( gdb, gdb_id, verbose=False, returnLogs=False ):
     if verbose:
         report( "%s : mbta_eventcreation"%(gdb_id) )
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    psd = False
-    coinc = False
-    Logs = []
-    for log in logs:
-        comment = log['comment']
-        if "Coinc Table Created" in comment:
-            coinc = True
-            Logs.append( log )
-        if "PSDs" in comment:
-            psd = True
-            Logs.append( log )
-        if (psd and coinc):
-            break
+    coinc_logs = index.get( "Coinc Table Created" )[:1]
+    psd_logs = index.get( "PSDs" )[:1]
+    coinc = len(coinc_logs) > 0
+    psd = len(psd_logs) > 0
+    Logs = sorted( coinc_logs + psd_logs, key=lambda log: log['N'] )
 
     if verbose:
         report( "\taction required : %s"%( not (psd and coinc)) )
@@ -954,19 +1560,18 @@ def idq_start( gdb, gdb_id, ifos=['H','L'], verbose=False, returnLogs=False ):
     if verbose:
         report( "%s : idq_start"%(gdb_id) )
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log'] ### retrieve the log messages attached to this event
+    index = log_index( gdb, gdb_id ) ### index the log messages attached to this event
 
     if verbose:
         report( "\tparsing log" )
     result = [1]*len(ifos)
     Logs = []
-    for log in logs:
+    for log in index.get( "Started searching for iDQ information" ):
         comment = log['comment']
-        if ("Started searching for iDQ information" in comment):
-            for ind, ifo in enumerate(ifos):
-                if result[ind] and (ifo in comment):
-                    result[ind] = 0
-                    Logs.append( log )
+        for ind, ifo in enumerate(ifos):
+            if result[ind] and (ifo in comment):
+                result[ind] = 0
+                Logs.append( log )
     
     if verbose:
         action_required = False
@@ -990,19 +1595,18 @@ def idq_finish( gdb, gdb_id, ifos=['H','L'], verbose=False, returnLogs=False ):
     if verbose:
         report( "%s : idq_finish"%(gdb_id) )
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
     result = [1]*len(ifos)
     Logs = []
-    for log in logs:
+    for log in index.get( "Finished searching for iDQ information" ):
         comment = log['comment']
-        if ("Finished searching for iDQ information" in comment):
-            for ind, ifo in enumerate(ifos):
-                if result[ind] and (ifo in comment):
-                    result[ind] = 0
-                    Logs.append( log )
+        for ind, ifo in enumerate(ifos):
+            if result[ind] and (ifo in comment):
+                result[ind] = 0
+                Logs.append( log )
 
     if verbose:
         action_required = False
@@ -1033,6 +1637,7 @@ def idq_timeseries( gdb, gdb_id, ifos=['H', 'L'], verbose=False, returnLogs=Fals
     if verbose:
         report( "\tretrieving log messages" )
     logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id, logs=logs )
 
     if verbose:
         report( "\tchecking filenames" )
@@ -1056,13 +1661,12 @@ def idq_timeseries( gdb, gdb_id, ifos=['H', 'L'], verbose=False, returnLogs=Fals
     if verbose:
         report( "\tparsing log" )
     log_result = [0]*len(ifos)
-    for log in logs:
+    for log in index.get( "FAILED: iDQ glitch-rank timeseries for" ):
         comment = log['comment']
-        if ("FAILED: iDQ glitch-rank timeseries for" in comment):
-            for ind, ifo in enumerate(ifos):
-                if (1 - log_result[ind]) and (ifo in comment):
-                    log_result[ind] = 1
-                    Logs.append( log )
+        for ind, ifo in enumerate(ifos):
+            if (1 - log_result[ind]) and (ifo in comment):
+                log_result[ind] = 1
+                Logs.append( log )
                    
     if verbose:
         for r, ifo in zip(log_result, ifos):
@@ -1073,13 +1677,12 @@ def idq_timeseries( gdb, gdb_id, ifos=['H', 'L'], verbose=False, returnLogs=Fals
 
     if minfap_statement:
         fap_result = [1]*len(ifos)
-        for log in logs:
+        for log in index.get( "minimum glitch-FAP" ):
             comment = log['comment']
-            if ("minimum glitch-FAP" in comment):
-                for ind, ifo in enumerate(ifos):
-                    if fap_result[ind] and (ifo in comment):
-                        fap_result[ind] = 0
-                        Logs.append( log )
+            for ind, ifo in enumerate(ifos):
+                if fap_result[ind] and (ifo in comment):
+                    fap_result[ind] = 0
+                    Logs.append( log )
 
         if verbose:
             for r, ifo in zip(fap_result, ifos):
@@ -1134,6 +1737,7 @@ def idq_tables( gdb, gdb_id, ifos=['H', 'L'], verbose=False, returnLogs=False ):
     if verbose:
         report( "\tretrieving log messages" )
     logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id, logs=logs )
 
     if verbose:
         report( "\tchecking filenames" )
@@ -1157,13 +1761,12 @@ def idq_tables( gdb, gdb_id, ifos=['H', 'L'], verbose=False, returnLogs=False ):
     if verbose:
         report( "\tparsing log" )
     log_result = [0]*len(ifos)
-    for log in logs:
+    for log in index.get( "FAILED: iDQ glitch tables for" ):
         comment = log['comment']
-        if ("FAILED: iDQ glitch tables for" in comment):
-            for ind, ifo in enumerate(ifos):
-                if (1 - log_result[ind]) and (ifo in comment):
-                    log_result[ind] = 1
-                    Logs.append( log )
+        for ind, ifo in enumerate(ifos):
+            if (1 - log_result[ind]) and (ifo in comment):
+                log_result[ind] = 1
+                Logs.append( log )
 
     if verbose:
         for r, ifo in zip(log_result, ifos):
@@ -1195,6 +1798,7 @@ def idq_performance( gdb, gdb_id, ifos=['H', 'L'], verbose=False, returnLogs=Fal
     if verbose:
         report( "\tretrieving log messages" )
     logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id, logs=logs )
 
     if verbose:
         report( "\tchecking filenames" )
@@ -1262,13 +1866,12 @@ def idq_performance( gdb, gdb_id, ifos=['H', 'L'], verbose=False, returnLogs=Fal
                 report( "\tcalibStats.json found for ifo : %s"%ifo )
 
     log_result = [0]*len(ifos)
-    for log in logs:
+    for log in index.get( "FAILED: iDQ local performance for" ):
         comment = log['comment']
-        if ("FAILED: iDQ local performance for" in comment):
-            for ind, ifo in enumerate(ifos):
-                if (1 - log_result[ind]) and (ifo in comment):
-                    log_result[ind] = 1
-                    Logs.append( log )
+        for ind, ifo in enumerate(ifos):
+            if (1 - log_result[ind]) and (ifo in comment):
+                log_result[ind] = 1
+                Logs.append( log )
 
     if verbose:
         for r, ifo in zip(log_result, ifos):
@@ -1363,19 +1966,17 @@ def lib_start( gdb, gdb_id, far=None, verbose=False, returnLogs=False ):
 
     if verbose:
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    for log in logs:
-        comment = log['comment']
-        if "LIB Parameter estimation started." in comment:
-            if verbose:
-                report( "\taction required : False" )
-            if returnLogs:
-                return False, [log]
-            else:
-                return False 
+    for log in index.get( "LIB Parameter estimation started." ):
+        if verbose:
+            report( "\taction required : False" )
+        if returnLogs:
+            return False, [log]
+        else:
+            return False 
 
     if verbose:
         report( "\taction required : True" )
@@ -1404,19 +2005,17 @@ def lib_finish( gdb, gdb_id, far=None, verbose=False, returnLogs=False ):
 
     if verbose:
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    for log in logs:
-        comment = log['comment']
-        if "LIB Parameter estimation finished." in comment:
-            if verbose:
-                report( "\taction required : False" )
-            if returnLogs:
-                return False, [log]
-            else:
-                return False
+    for log in index.get( "LIB Parameter estimation finished." ):
+        if verbose:
+            report( "\taction required : False" )
+        if returnLogs:
+            return False, [log]
+        else:
+            return False
     if verbose:
         report( "\taction required : True" )
     if returnLogs:
@@ -1508,19 +2107,17 @@ def bayeswave_start( gdb, gdb_id, far=None, verbose=False, returnLogs=False ):
 
     if verbose:
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    for log in logs:
-        comment = log['comment']
-        if "BayesWaveBurst launched" in comment:
-            if verbose:
-                report( "\taction required : False" )
-            if returnLogs:
-                return False, [log]
-            else:
-                return False
+    for log in index.get( "BayesWaveBurst launched" ):
+        if verbose:
+            report( "\taction required : False" )
+        if returnLogs:
+            return False, [log]
+        else:
+            return False
     if verbose:
         report( "\taction required : True" )
     if returnLogs:
@@ -1548,19 +2145,17 @@ def bayeswave_finish( gdb, gdb_id, far=None, verbose=False, returnLogs=False ):
 
     if verbose:
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    for log in logs:
-        comment = log['comment']
-        if "BWB Follow-up results" in comment:
-            if verbose:
-                report( "\taction required : False" )
-            if returnLogs:
-                return False, [log]
-            else:
-                return False
+    for log in index.get( "BWB Follow-up results" ):
+        if verbose:
+            report( "\taction required : False" )
+        if returnLogs:
+            return False, [log]
+        else:
+            return False
     if verbose:
         report( "\taction required : True" )
     if returnLogs:
@@ -1654,19 +2249,17 @@ def bayestar_start( gdb, gdb_id, far=None, verbose=False, returnLogs=False ):
 
     if verbose:
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    for log in logs:
-        comment = log['comment']
-        if "INFO:BAYESTAR:starting sky localization" in comment:
-            if verbose:
-                report( "\taction required : False" )
-            if returnLogs:
-                return False, [log]
-            else:
-                return False
+    for log in index.get( "INFO:BAYESTAR:starting sky localization" ):
+        if verbose:
+            report( "\taction required : False" )
+        if returnLogs:
+            return False, [log]
+        else:
+            return False
     if verbose:
         report( "\taction required : True" )
     if returnLogs:
@@ -1694,19 +2287,17 @@ def bayestar_finish( gdb, gdb_id, far=None, verbose=False, returnLogs=False ):
 
     if verbose:
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    for log in logs:
-        comment = log['comment']
-        if "INFO:BAYESTAR:sky localization complete" in comment:
-            if verbose:
-                report( "\taction required : False" )
-            if returnLogs:
-                return False, [log]
-            else:
-                return False
+    for log in index.get( "INFO:BAYESTAR:sky localization complete" ):
+        if verbose:
+            report( "\taction required : False" )
+        if returnLogs:
+            return False, [log]
+        else:
+            return False
     if verbose:
         report( "\taction required : True" )
     if returnLogs:
@@ -1798,19 +2389,17 @@ def lalinference_start( gdb, gdb_id, far=None, verbose=False, returnLogs=False )
 
     if verbose:
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    for log in logs:
-        comment = log['comment']
-        if "LALInference online parameter estimation started" in comment:
-            if verbose:
-                report( "\taction required : False" )
-            if returnLogs:
-                return False, [log]
-            else:
-                return False
+    for log in index.get( "LALInference online parameter estimation started" ):
+        if verbose:
+            report( "\taction required : False" )
+        if returnLogs:
+            return False, [log]
+        else:
+            return False
     if verbose:
         report( "\taction required : True" )
     if returnLogs:
@@ -1838,19 +2427,17 @@ def lalinference_finish( gdb, gdb_id, far=None, verbose=False, returnLogs=False
 
     if verbose:
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    for log in logs:
-        comment = log['comment']
-        if "LALInference online parameter estimation finished" in comment:
-            if verbose:
-                report( "\taction required : False" )
-            if returnLogs:
-                return False, [log]
-            else:
-                return False
+    for log in index.get( "LALInference online parameter estimation finished" ):
+        if verbose:
+            report( "\taction required : False" )
+        if returnLogs:
+            return False, [log]
+        else:
+            return False
     if verbose:
         report( "\taction required : True" )
     if returnLogs:
@@ -1930,19 +2517,17 @@ def externaltriggers_search( gdb, gdb_id, verbose=False, returnLogs=False ):
     if verbose:
         report( "%s : externaltriggers_search"%(gdb_id) )
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    for log in logs:
-        comment = log['comment']
-        if "Coincidence search complete" in comment:
-            if verbose:
-                report( "\taction required : False" )
-            if returnLogs:
-                return False, [log]
-            else:
-                return False
+    for log in index.get( "Coincidence search complete" ):
+        if verbose:
+            report( "\taction required : False" )
+        if returnLogs:
+            return False, [log]
+        else:
+            return False
     if verbose:
         report( "\taction required : True" )
     if returnLogs:
@@ -1957,19 +2542,17 @@ def unblindinjections_search( gdb, gdb_id, verbose=False, returnLogs=False ):
     if verbose:
         report( "%s : unblindinjections_search"%(gdb_id) )
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    for log in logs:
-        comment = log['comment']
-        if ("No unblind injections in window" in comment):
-            if verbose:
-                report( "\taction required : False" )
-            if returnLogs:
-                return False, [log]
-            else:
-                return False
+    for log in index.get( "No unblind injections in window" ):
+        if verbose:
+            report( "\taction required : False" )
+        if returnLogs:
+            return False, [log]
+        else:
+            return False
 
     report( "\tWARNING: we do not currently know how to parse out statements when there is an unblind injection...proceeding assuming everything is kosher" )
 
@@ -2100,6 +2683,7 @@ def segment_summary( gdb, gdb_id, flags=[], verbose=False, returnLogs=False ):
     if verbose:
         report( "\tretrieving log messages" )
     logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id, logs=logs )
 
     ### iterate through flags and look for corresponding files and log messages
     Logs = []
@@ -2116,12 +2700,10 @@ def segment_summary( gdb, gdb_id, flags=[], verbose=False, returnLogs=False ):
         else:
             result[ind] += 1
             continue
-        for log in logs:
-            comment = log['comment']
-            if "%s defined"%flag in comment:
-                if returnLogs:
-                    Logs.append( log )
-                break
+        for log in index.get( "%s defined"%flag ):
+            if returnLogs:
+                Logs.append( log )
+            break
         else:
             result[ind] += 2
             
@@ -2215,19 +2797,21 @@ def approval_processor_far( gdb, gdb_id, verbose=False, returnLogs=False ):
     if verbose:
         report( "%s : approval_proccesor_far"%(gdb_id) )
         report( "\tretrieving log messages" )
-    logs = gdb.logs( gdb_id ).json()['log']
+    index = log_index( gdb, gdb_id )
 
     if verbose:
         report( "\tparsing log" )
-    for log in logs:
-        comment = log['comment']
-        if ("Candidate event has low enough FAR" in comment) or ("Candidate event rejected due to large FAR" in comment) or ("Ignoring new event because we found a hardware injection" in comment):
-            if verbose:
-                report( "\taction required : False" )
-            if returnLogs:
-                return False, [log]
-            else:
-                return False
+    Logs = []
+    for pattern in log_patterns['approval_processor_far']:
+        Logs += index.get( pattern )
+    if Logs:
+        if verbose:
+            report( "\taction required : False" )
+        log = min( Logs, key=lambda log: log['N'] ) ### the first response
+        if returnLogs:
+            return False, [log]
+        else:
+            return False
     if verbose:
         report( "\taction required : True" )
     if returnLogs:
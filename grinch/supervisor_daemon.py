@@ -0,0 +1,442 @@
+description = """ a module that supervises many GraceDB events from a single long-running process. Every event's schedule of checks is kept in one timer heap keyed by the absolute time each tick (the checks sharing a dt) is due, and due ticks are performed on a bounded pool of worker threads """
+
+#=================================================
+
+import time
+import heapq
+import itertools
+import threading
+import traceback
+
+from multiprocessing.pool import ThreadPool
+
+from grinch import supervisor_checks as checks
+from grinch import supervisor_utils as utils
+from grinch import supervisor_store
+report = checks.report
+errReport = checks.errReport
+
+#=================================================
+
+class SupervisedEvent( object ):
+    """
+    everything the daemon knows about a single event it is supervising
+    """
+
+    def __init__( self, gdb_id, event_type, event_url, schedule, snapshot ):
+        self.gdb_id = gdb_id
+        self.event_type = event_type
+        self.event_url = event_url
+        self.schedule = schedule
+        self.snapshot = snapshot
+
+        self.ticks = list(schedule.ticks) ### (dt, [indices into schedule]) for the checks that still need to be performed
+        self.pending = len(schedule) ### number of checks that have not been performed yet
+        self.started = set() ### indices of checks that have been handed to a worker
+        self.cancelled = False
+
+        self.to = None ### creation time
+        self.earliest = None ### we do not perform any checks before this time
+
+class SupervisorDaemon( object ):
+    """
+    supervises every event it is told about from a single process.
+    Call handle_alert() (or add_event()) for new events and run() to start performing checks.
+
+    Update alerts for events we are supervising are applied to the event's snapshot directly.
+    Checks affected by the new log message are evaluated straight away and, if they pass, their next scheduled evaluation is resolved early.
+    Checks that fail (or whose result may regress) are left for their scheduled time, so polling at each dt remains the fallback.
+
+    If a ScheduleStore is supplied, the progress of every event is recorded there and resume() picks up
+    wherever a previous daemon left off without repeating checks or annotations.
+
+    If SupervisorMetrics are supplied, every call to GraceDB and every check is timed and the latency of each check is recorded.
+    """
+
+    def __init__( self, gracedb, config, workers=4, annotate_gracedb=False, no_email=False, ignore_INJ=False, tagname=['event_supervisor'], store=None, metrics=None, verbose=False ):
+        self.metrics = metrics
+        if metrics is not None:
+            gracedb = metrics.timed( gracedb )
+            metrics.gauge( "event_supervisor_events", "number of events being supervised", lambda: len(self.events) )
+            metrics.gauge( "event_supervisor_scheduled_ticks", "number of groups of checks waiting to come due", lambda: len(self.heap) )
+        self.gracedb = gracedb
+        self.config = config
+        self.store = store
+
+        self.annotate_gracedb = annotate_gracedb
+        self.no_email = no_email
+        self.ignore_INJ = ignore_INJ
+        self.tagname = tagname
+        self.verbose = verbose
+
+        if ignore_INJ:
+            self.ignoreINJ_delay = config.getfloat('general', 'ignoreINJ_delay')
+        else:
+            self.ignoreINJ_delay = 0.0
+
+        self.may_regress = utils.may_regress( config ) ### None unless satisfied checks are final
+
+        self.event_index = utils.event_index( config ) ### recent events, so local_rates does not need to query GraceDB
+
+        self.heap = [] ### (due, sequence, gdb_id, index into event.ticks)
+        self.sequence = itertools.count() ### breaks ties so the heap never compares gdb_ids or indices
+        self.events = {}
+        self.condition = threading.Condition()
+
+        self.pool = ThreadPool( workers )
+        self.running = False
+
+    #---------------------------------------------
+    # adding events
+    #---------------------------------------------
+
+    def handle_alert( self, alert ):
+        """
+        processes a single lvalert message
+        """
+        if alert['alert_type'] == 'new':
+            self.add_event( alert['uid'] )
+        elif self.events.get( alert['uid'] ) is not None: ### an event we are supervising (and have finished setting up)
+            self.handle_update( alert )
+        elif self.verbose:
+            report( "%s : alert_type=\"%s\", skipping"%(alert['uid'], alert['alert_type']) )
+
+    def handle_update( self, alert ):
+        """
+        applies an alert for an event we are supervising to its snapshot and evaluates any affected checks immediately
+        """
+        gdb_id = alert['uid']
+        event = self.events.get( gdb_id )
+        if (event is None) or event.cancelled:
+            return
+
+        log = alert.get( 'object' )
+        if (alert['alert_type'] != 'update') or (not isinstance(log, dict)) or (not log.has_key( 'comment' )):
+            if self.verbose:
+                report( "%s : alert_type=\"%s\", refreshing snapshot"%(gdb_id, alert['alert_type']) )
+            event.snapshot.refresh() ### labels, signoffs, etc. We do not know exactly what changed
+            return
+
+        event.snapshot.add_log( log )
+        names = checks.affected_checks( log, event.snapshot.index )
+        if self.may_regress is None:
+            may_regress = checks.may_regress
+        else:
+            may_regress = self.may_regress
+
+        if time.time() < event.earliest: ### still giving the first injection label a chance to be applied
+            return
+
+        ### claim the next evaluation of each affected check that has not been handed to a worker yet
+        self.condition.acquire()
+        try:
+            claimed = []
+            for name in names:
+                ### ticks are not kept in dt order (a failed early evaluation is appended at the end, as the heap refers to ticks by position), so look at all of them
+                candidates = [(dt, i) for dt, inds in event.ticks for i in inds if (event.schedule[i][1].__name__ == name) and (i not in event.started) and (event.schedule[i][-1] not in may_regress)]
+                if candidates:
+                    claimed.append( min(candidates)[1] )
+            self._remove( event, claimed )
+            event.started.update( claimed )
+        finally:
+            self.condition.release()
+
+        for ind in claimed:
+            if self.verbose:
+                report( "%s : evaluating %s early in response to log message N=%s"%(gdb_id, event.schedule[ind][-1], log.get('N')) )
+            self.pool.apply_async( self._perform_early, (event, ind) )
+
+    def resume( self ):
+        """
+        picks up every event the store says has not been finished
+        """
+        if self.store is None:
+            return
+        for gdb_id in self.store.unfinished_events():
+            if self.verbose:
+                report( "%s : resuming supervision"%(gdb_id) )
+            self.add_event( gdb_id )
+
+    def add_event( self, gdb_id ):
+        """
+        sets up the schedule of checks for a new event and adds them to the timer heap.
+        If the store already knows about this event, checks that were performed previously are skipped
+        """
+        if self.store is not None:
+            stored = self.store.event( gdb_id )
+            if stored and stored['finished']:
+                if self.verbose:
+                    report( "%s : already finished supervising this event"%(gdb_id) )
+                return
+        else:
+            stored = None
+
+        self.condition.acquire()
+        try:
+            if self.events.has_key( gdb_id ):
+                if self.verbose:
+                    report( "%s : already supervising this event"%(gdb_id) )
+                return
+            self.events[gdb_id] = None ### reserve this gdb_id while we set things up
+        finally:
+            self.condition.release()
+
+        try:
+            if self.verbose:
+                report( "New event detectected : %s"%gdb_id )
+            gdb_entry = self.gracedb.event( gdb_id ).json()
+            self.event_index.add( gdb_entry )
+
+            event_type = utils.event_type( gdb_entry )
+            if self.verbose:
+                report( "\tevent_type : %s"%(event_type) )
+            schedule = checks.config_to_schedule( self.config, event_type, **utils.schedule_kwargs( gdb_entry, verbose=self.verbose ) )
+
+            if self.store is not None:
+                self.store.add_event( gdb_id, schedule )
+
+            if self.annotate_gracedb and not (stored and stored['annotated']):
+                log = "event_supervisor scheduled to check: %s"%(", ".join([description for dt, foo, kwargs, email, description in schedule]))
+                self.gracedb.writeLog( gdb_id, log, tagname=self.tagname )
+                if self.store is not None:
+                    self.store.mark_annotated( gdb_id )
+
+            event = SupervisedEvent( gdb_id, event_type, utils.event_url( self.gracedb, gdb_id ), schedule, utils.event_snapshot( self.gracedb, gdb_id, self.config, event_index=self.event_index, verbose=self.verbose ) )
+            if self.store is not None:
+                if stored: ### pick up the log messages we downloaded before we were restarted
+                    event.snapshot.load_logs( self.store.logs( gdb_id ) )
+                todo = set( utils.remaining_checks( self.store, event.snapshot, gdb_id, schedule, annotate_gracedb=self.annotate_gracedb, verbose=self.verbose ) )
+                event.ticks = [(dt, [ind for ind in inds if ind in todo]) for dt, inds in schedule.ticks]
+                event.ticks = [(dt, inds) for dt, inds in event.ticks if inds]
+            event.pending = sum([len(inds) for dt, inds in event.ticks])
+        except:
+            errReport( "could not set up schedule for %s\n%s"%(gdb_id, traceback.format_exc()) )
+            self.condition.acquire()
+            try:
+                self.events.pop( gdb_id )
+            finally:
+                self.condition.release()
+            return
+
+        event.to = utils.creation_time( gdb_entry )
+        event.earliest = time.time() + self.ignoreINJ_delay ### give the first injection label a chance to be applied
+        self.condition.acquire()
+        try:
+            self.events[gdb_id] = event
+            for tick, (dt, inds) in enumerate(event.ticks):
+                heapq.heappush( self.heap, (max(event.to+dt, event.earliest), next(self.sequence), gdb_id, tick) )
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+        if not event.pending:
+            self._finish( event )
+
+    #---------------------------------------------
+    # performing checks
+    #---------------------------------------------
+
+    def run( self, poll=60.0 ):
+        """
+        hands ticks to the worker pool as they come due. Blocks until stop() is called.
+        we wake up at least every poll seconds, which keeps the process responsive to signals
+        """
+        self.running = True
+        while self.running:
+            self.condition.acquire()
+            try:
+                now = time.time()
+                due = []
+                while self.heap and (self.heap[0][0] <= now):
+                    _, _, gdb_id, tick = heapq.heappop( self.heap )
+                    event = self.events[gdb_id]
+                    event.started.update( event.ticks[tick][1] )
+                    due.append( (gdb_id, tick) )
+                if not due:
+                    if self.heap:
+                        self.condition.wait( min(poll, self.heap[0][0]-now) )
+                    else:
+                        self.condition.wait( poll )
+            finally:
+                self.condition.release()
+
+            for gdb_id, tick in due:
+                self.pool.apply_async( self._perform, (gdb_id, tick) )
+
+    def stop( self ):
+        """
+        stop handing out checks and wait for the workers to finish whatever they are doing
+        """
+        self.condition.acquire()
+        try:
+            self.running = False
+            self.condition.notify()
+        finally:
+            self.condition.release()
+        self.pool.close()
+        self.pool.join()
+
+    def _perform( self, gdb_id, tick ):
+        """
+        performs every check in a single tick one after another, so they share the event's snapshot. Runs within a worker thread
+        """
+        event = self.events[gdb_id]
+        dt, inds = event.ticks[tick]
+        try:
+            if event.cancelled:
+                return
+
+            if self.ignore_INJ:
+                self.condition.acquire()
+                try:
+                    cancelled_checks = [event.schedule[i][-1] for _, tick_inds in event.ticks for i in tick_inds if (i in inds) or (i not in event.started)]
+                finally:
+                    self.condition.release()
+                if utils.check_INJ( event.snapshot, gdb_id, cancelled_checks, annotate_gracedb=self.annotate_gracedb, tagname=self.tagname, verbose=self.verbose ):
+                    self._cancel( event )
+                    return
+
+            for ind in inds:
+                self._perform_check( event, ind )
+
+        finally:
+            self._done( event, len(inds) )
+
+    def _perform_check( self, event, ind ):
+        """
+        performs a single check and records the result
+        """
+        gdb_id = event.gdb_id
+        dt, foo, kwargs, email, description = event.schedule[ind]
+        try:
+            if self.store is not None:
+                self.store.set_state( gdb_id, dt, description, supervisor_store.STARTED )
+
+            action_required = utils.perform_check( event.snapshot, gdb_id, foo, kwargs, email, description, event.event_type, event.event_url, annotate_gracedb=self.annotate_gracedb, no_email=self.no_email, tagname=self.tagname, metrics=self.metrics, verbose=self.verbose )
+
+            if self.store is not None:
+                utils.record_result( self.store, gdb_id, dt, description, action_required )
+                self.store.save_logs( gdb_id, event.snapshot.log_list )
+
+            self._drop_satisfied( event, ind, action_required )
+
+        except:
+            errReport( "unexpected error while performing %s for %s\n%s"%(description, gdb_id, traceback.format_exc()) )
+
+    def _perform_early( self, event, ind ):
+        """
+        evaluates a check ahead of schedule. We only report the result if the check passed.
+        Otherwise it is put back on the heap at its scheduled time. Runs within a worker thread
+        """
+        gdb_id = event.gdb_id
+        dt, foo, kwargs, email, description = event.schedule[ind]
+        try:
+            action_required = utils.evaluate_check( event.snapshot, gdb_id, foo, kwargs, description, event.event_type, metrics=self.metrics )
+        except:
+            action_required = None
+            if self.verbose:
+                errReport( "early evaluation of %s for %s failed\n%s"%(description, gdb_id, traceback.format_exc()) )
+
+        if (action_required is None) or action_required:
+            self.condition.acquire()
+            try:
+                if not event.cancelled:
+                    event.started.discard( ind )
+                    event.ticks.append( (dt, [ind]) )
+                    heapq.heappush( self.heap, (max(event.to+dt, event.earliest), next(self.sequence), gdb_id, len(event.ticks)-1) )
+                    self.condition.notify()
+                    return
+            finally:
+                self.condition.release()
+            self._done( event ) ### cancelled while we were evaluating
+            return
+
+        try:
+            utils.report_result( event.snapshot, gdb_id, action_required, email, description, event.event_type, event.event_url, annotate_gracedb=self.annotate_gracedb, no_email=self.no_email, tagname=self.tagname, verbose=self.verbose )
+            if self.store is not None:
+                utils.record_result( self.store, gdb_id, dt, description, action_required )
+                self.store.save_logs( gdb_id, event.snapshot.log_list )
+            self._drop_satisfied( event, ind, action_required )
+        except:
+            errReport( "unexpected error while reporting %s for %s\n%s"%(description, gdb_id, traceback.format_exc()) )
+        finally:
+            self._done( event )
+
+    def _remove( self, event, inds ):
+        """
+        removes these checks from the event's ticks and drops ticks with nothing left to do from the heap.
+        Must be called while holding self.condition
+        """
+        inds = set(inds)
+        for tick, (dt, tick_inds) in enumerate(event.ticks):
+            if inds.intersection( tick_inds ):
+                event.ticks[tick] = (dt, [i for i in tick_inds if i not in inds])
+        heap = [item for item in self.heap if (item[2] != event.gdb_id) or event.ticks[item[3]][1]]
+        if len(heap) < len(self.heap):
+            heapq.heapify( heap )
+            self.heap = heap
+
+    def _drop_satisfied( self, event, ind, action_required ):
+        """
+        removes later evaluations of a check that passed from the timer heap (only if satisfied checks are final)
+        """
+        later = set( utils.satisfied( event.schedule, ind, action_required, self.may_regress ) )
+        if not later:
+            return
+
+        self.condition.acquire()
+        try:
+            dropped = [i for dt, inds in event.ticks for i in inds if (i in later) and (i not in event.started)]
+            self._remove( event, dropped )
+            event.pending -= len(dropped)
+        finally:
+            self.condition.release()
+
+        for i in dropped:
+            dt, foo, kwargs, email, description = event.schedule[i]
+            if self.verbose:
+                report( "%s : %s satisfied, dropping evaluation at dt=%.1f"%(event.gdb_id, description, dt) )
+            if self.store is not None:
+                self.store.set_state( event.gdb_id, dt, description, supervisor_store.SATISFIED )
+
+    def _cancel( self, event ):
+        """
+        drop every check for this event that has not been started yet
+        """
+        self.condition.acquire()
+        try:
+            event.cancelled = True
+            heap = [item for item in self.heap if item[2] != event.gdb_id]
+            event.pending -= sum([len(event.ticks[item[3]][1]) for item in self.heap if item[2] == event.gdb_id])
+            heapq.heapify( heap )
+            self.heap = heap
+        finally:
+            self.condition.release()
+        if self.store is not None:
+            self.store.cancel( event.gdb_id )
+
+    def _done( self, event, n=1 ):
+        self.condition.acquire()
+        try:
+            event.pending -= n
+            finished = event.pending == 0
+        finally:
+            self.condition.release()
+        if finished:
+            self._finish( event )
+
+    def _finish( self, event ):
+        if self.annotate_gracedb:
+            log = "event_supervisor completed all scheduled checks"
+            self.gracedb.writeLog( event.gdb_id, log, tagname=self.tagname )
+        if self.store is not None:
+            self.store.finish_event( event.gdb_id )
+        if self.metrics is not None:
+            self.metrics.forget( event.gdb_id )
+        if self.verbose:
+            report( "%s : Done"%(event.gdb_id) )
+        self.condition.acquire()
+        try:
+            self.events.pop( event.gdb_id )
+        finally:
+            self.condition.release()
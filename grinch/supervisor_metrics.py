@@ -0,0 +1,332 @@
+description = """ a module that records how quickly events are followed up while event_supervisor_daemon is running and exposes the numbers over HTTP in the Prometheus text format. Nothing here talks to GraceDB, so the endpoint can be scraped as often as we like """
+
+#=================================================
+
+import time
+import inspect
+import threading
+import traceback
+import collections
+
+import SocketServer
+import BaseHTTPServer
+
+import numpy as np
+
+from grinch import supervisor_checks as checks
+from grinch import quantiles
+report = checks.report
+errReport = checks.errReport
+
+#=================================================
+
+### upper bounds of histogram buckets (seconds)
+latency_buckets = [1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200]
+duration_buckets = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+def _escape( value ):
+    return str(value).replace( "\\", "\\\\" ).replace( "\"", "\\\"" ).replace( "\n", "\\n" )
+
+def _format_labels( names, values, extra=() ):
+    pairs = ["%s=\"%s\""%(name, _escape(value)) for name, value in zip(names, values)] + ["%s=\"%s\""%(name, _escape(value)) for name, value in extra]
+    if pairs:
+        return "{%s}"%(",".join(pairs))
+    return ""
+
+def _format_value( value ):
+    if value == np.infty:
+        return "+Inf"
+    return "%r"%(float(value))
+
+#=================================================
+# metrics
+#=================================================
+
+class Counter( object ):
+    """
+    a monotonically increasing count for each combination of label values
+    """
+    kind = "counter"
+
+    def __init__( self, name, help, labels=() ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc( self, amount=1, **labels ):
+        key = tuple( labels[name] for name in self.labels )
+        self.lock.acquire()
+        try:
+            self.values[key] = self.values.get( key, 0 ) + amount
+        finally:
+            self.lock.release()
+
+    def expose( self ):
+        lines = ["# HELP %s %s"%(self.name, self.help), "# TYPE %s %s"%(self.name, self.kind)]
+        self.lock.acquire()
+        try:
+            for key in sorted(self.values.keys()):
+                lines.append( "%s%s %s"%(self.name, _format_labels( self.labels, key ), _format_value( self.values[key] )) )
+        finally:
+            self.lock.release()
+        return lines
+
+class Gauge( object ):
+    """
+    a value read from callback() whenever we are scraped
+    """
+    kind = "gauge"
+
+    def __init__( self, name, help, callback ):
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def expose( self ):
+        return ["# HELP %s %s"%(self.name, self.help), "# TYPE %s %s"%(self.name, self.kind), "%s %s"%(self.name, _format_value( self.callback() ))]
+
+class Histogram( object ):
+    """
+    observations for each combination of label values, exposed twice:
+        name : a cumulative histogram (Prometheus computes rates and rolling quantiles from this)
+        name_recent : a summary with quantiles of the observations made within the last window seconds
+    At most max_samples recent observations are kept for each combination of labels
+    """
+    kind = "histogram"
+
+    def __init__( self, name, help, labels=(), buckets=latency_buckets, window=3600.0, max_samples=10000, quantiles=[0.5, 0.9, 0.99] ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = np.array( sorted(buckets)+[np.infty], dtype=float )
+        self.window = window
+        self.max_samples = max_samples
+        self.quantiles = quantiles
+
+        self.counts = {} ### label values -> cumulative counts in each bucket
+        self.sums = {}
+        self.recent = {} ### label values -> deque of (time, value)
+        self.lock = threading.Lock()
+
+    def observe( self, value, **labels ):
+        key = tuple( labels[name] for name in self.labels )
+        now = time.time()
+        self.lock.acquire()
+        try:
+            if not self.counts.has_key( key ):
+                self.counts[key] = np.zeros( len(self.buckets), dtype=int )
+                self.sums[key] = 0.0
+                self.recent[key] = collections.deque( maxlen=self.max_samples )
+            self.counts[key][np.searchsorted( self.buckets, value ):] += 1 ### buckets are "less than or equal to"
+            self.sums[key] += value
+            self.recent[key].append( (now, value) )
+        finally:
+            self.lock.release()
+
+    def _prune( self, key, now ):
+        recent = self.recent[key]
+        cutoff = now - self.window
+        while recent and (recent[0][0] < cutoff):
+            recent.popleft()
+
+    def expose( self ):
+        lines = ["# HELP %s %s"%(self.name, self.help), "# TYPE %s histogram"%(self.name)]
+        recent_lines = ["# HELP %s_recent %s (within the last %d seconds)"%(self.name, self.help, self.window), "# TYPE %s_recent summary"%(self.name)]
+        now = time.time()
+        self.lock.acquire()
+        try:
+            for key in sorted(self.counts.keys()):
+                counts = self.counts[key]
+                for le, count in zip(self.buckets, counts):
+                    lines.append( "%s_bucket%s %d"%(self.name, _format_labels( self.labels, key, [("le", _format_value( le ))] ), count) )
+                lines.append( "%s_sum%s %s"%(self.name, _format_labels( self.labels, key ), _format_value( self.sums[key] )) )
+                lines.append( "%s_count%s %d"%(self.name, _format_labels( self.labels, key ), counts[-1]) )
+
+                self._prune( key, now )
+                values = np.array( [value for t, value in self.recent[key]], dtype=float )
+                if len(values):
+                    for q, Q in zip(self.quantiles, quantiles.quantile( values, self.quantiles )):
+                        recent_lines.append( "%s_recent%s %s"%(self.name, _format_labels( self.labels, key, [("quantile", q)] ), _format_value( Q )) )
+                recent_lines.append( "%s_recent_sum%s %s"%(self.name, _format_labels( self.labels, key ), _format_value( values.sum() )) )
+                recent_lines.append( "%s_recent_count%s %d"%(self.name, _format_labels( self.labels, key ), len(values)) )
+        finally:
+            self.lock.release()
+        return lines + recent_lines
+
+class MetricsRegistry( object ):
+    """
+    a collection of metrics exposed together
+    """
+
+    def __init__( self ):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register( self, metric ):
+        self.lock.acquire()
+        try:
+            self.metrics.append( metric )
+        finally:
+            self.lock.release()
+        return metric
+
+    def expose( self ):
+        """
+        every metric in the Prometheus text format
+        """
+        self.lock.acquire()
+        try:
+            metrics = list(self.metrics)
+        finally:
+            self.lock.release()
+        lines = []
+        for metric in metrics:
+            try:
+                lines += metric.expose()
+            except Exception:
+                errReport( "could not expose %s\n%s"%(metric.name, traceback.format_exc()) )
+        return "\n".join( lines )+"\n"
+
+#=================================================
+# instrumenting event_supervisor
+#=================================================
+
+class TimedGraceDb( object ):
+    """
+    wraps a connection to GraceDB and records how long every call takes
+    everything else is passed through to the underlying connection
+    """
+
+    def __init__( self, gdb, histogram, failures ):
+        self.gdb = gdb
+        self.histogram = histogram
+        self.failures = failures
+
+    def __getattr__( self, name ):
+        attr = getattr( self.gdb, name )
+        if not callable( attr ):
+            return attr
+        def timed( *args, **kwargs ):
+            start = time.time()
+            try:
+                return attr( *args, **kwargs )
+            except Exception:
+                self.failures.inc( method=name )
+                raise
+            finally:
+                self.histogram.observe( time.time()-start, method=name )
+        return timed
+
+class SupervisorMetrics( object ):
+    """
+    the metrics recorded by event_supervisor_daemon :
+        event_supervisor_check_latency_seconds : time from event creation until the log message that satisfied each check (recorded once per event and check)
+        event_supervisor_check_duration_seconds : time spent evaluating each check
+        event_supervisor_checks_total : number of evaluations by result (action_required="True", "False" or "failed")
+        event_supervisor_gracedb_request_seconds : latency of every call to GraceDB by method
+        event_supervisor_gracedb_errors_total : calls to GraceDB that raised
+    """
+
+    def __init__( self, window=3600.0 ):
+        self.registry = MetricsRegistry()
+        self.check_latency = self.registry.register( Histogram( "event_supervisor_check_latency_seconds", "time from event creation until the log message that satisfied the check", labels=("event_type", "check"), buckets=latency_buckets, window=window ) )
+        self.check_duration = self.registry.register( Histogram( "event_supervisor_check_duration_seconds", "time spent evaluating a check", labels=("event_type", "check"), buckets=duration_buckets, window=window ) )
+        self.checks = self.registry.register( Counter( "event_supervisor_checks_total", "number of checks evaluated", labels=("event_type", "check", "action_required") ) )
+        self.gracedb_latency = self.registry.register( Histogram( "event_supervisor_gracedb_request_seconds", "latency of calls to GraceDB", labels=("method",), buckets=duration_buckets, window=window ) )
+        self.gracedb_errors = self.registry.register( Counter( "event_supervisor_gracedb_errors_total", "calls to GraceDB that raised", labels=("method",) ) )
+
+        self.measured = set() ### (gdb_id, check) for which we have recorded check_latency
+        self.lock = threading.Lock()
+
+    def gauge( self, name, help, callback ):
+        return self.registry.register( Gauge( name, help, callback ) )
+
+    def timed( self, gdb ):
+        """
+        wraps a connection to GraceDB so every call is timed
+        """
+        return TimedGraceDb( gdb, self.gracedb_latency, self.gracedb_errors )
+
+    def wants_logs( self, foo ):
+        """
+        whether we should ask this check for the logs that satisfied it
+        """
+        return 'returnLogs' in inspect.getargspec( foo ).args
+
+    def observe_check( self, gdb, gdb_id, event_type, description, duration, action_required, logs=None ):
+        """
+        records a single evaluation of a check. action_required=None means the check failed
+        """
+        self.check_duration.observe( duration, event_type=event_type, check=description )
+        if action_required is None:
+            self.checks.inc( event_type=event_type, check=description, action_required="failed" )
+            return
+        self.checks.inc( event_type=event_type, check=description, action_required=str(bool(action_required)) )
+
+        if action_required or (not logs):
+            return
+        key = (gdb_id, description)
+        self.lock.acquire()
+        try:
+            if key in self.measured:
+                return
+            self.measured.add( key )
+        finally:
+            self.lock.release()
+        to = checks.created_to_unix( gdb.event( gdb_id ).json()['created'] )
+        self.check_latency.observe( checks.latency_from_logs( logs, to ), event_type=event_type, check=description )
+
+    def forget( self, gdb_id ):
+        """
+        we are done with this event
+        """
+        self.lock.acquire()
+        try:
+            self.measured = set( key for key in self.measured if key[0] != gdb_id )
+        finally:
+            self.lock.release()
+
+#=================================================
+# serving metrics
+#=================================================
+
+class MetricsHandler( BaseHTTPServer.BaseHTTPRequestHandler ):
+    """
+    serves the registry at /metrics
+    """
+
+    def do_GET( self ):
+        if self.path.split("?")[0] not in ["/metrics", "/"]:
+            self.send_error( 404 )
+            return
+        body = self.server.registry.expose()
+        self.send_response( 200 )
+        self.send_header( "Content-Type", "text/plain; version=0.0.4" )
+        self.send_header( "Content-Length", str(len(body)) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, format, *args ):
+        pass ### scrapes are frequent and uninteresting
+
+class MetricsServer( SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer ):
+    """
+    an HTTP server exposing registry in the Prometheus text format
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__( self, address, registry ):
+        BaseHTTPServer.HTTPServer.__init__( self, address, MetricsHandler )
+        self.registry = registry
+
+    def start( self ):
+        """
+        serve in a background thread
+        """
+        thread = threading.Thread( target=self.serve_forever )
+        thread.daemon = True
+        thread.start()
+        return thread
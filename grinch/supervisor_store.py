@@ -0,0 +1,179 @@
+description = """ a module that records the progress of event_supervisor on disk (SQLite) so a process that dies can be restarted without losing or repeating checks. We record every supervised event, the state of each scheduled check, which annotations have already been written to GraceDB and the log messages we have downloaded """
+
+#=================================================
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+#=================================================
+
+### states of a scheduled check
+PENDING = "pending"
+STARTED = "started" ### handed to a worker but no result recorded yet
+DONE = "done"
+FAILED = "failed" ### the check itself raised
+CANCELLED = "cancelled"
+SATISFIED = "satisfied" ### dropped because an earlier evaluation of the same check passed
+
+finished_states = [DONE, FAILED, CANCELLED, SATISFIED]
+
+def store_path( logdir, name="event_supervisor.sqlite" ):
+    """
+    the standard location of the store within logdir
+    """
+    return os.path.join( logdir, name )
+
+class ScheduleStore( object ):
+    """
+    a durable record of scheduled checks, keyed by gdb_id and (dt, description).
+    Check functions cannot be stored, so the schedule itself is rebuilt from the config file when we resume.
+    The store only tells us which of those checks have already been performed.
+    All methods are thread safe.
+    """
+
+    def __init__( self, path ):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect( path, check_same_thread=False )
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript( """
+            CREATE TABLE IF NOT EXISTS events (
+                gdb_id TEXT PRIMARY KEY,
+                created REAL,
+                annotated INTEGER DEFAULT 0,
+                finished INTEGER DEFAULT 0,
+                last_N INTEGER DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS checks (
+                gdb_id TEXT,
+                dt REAL,
+                description TEXT,
+                state TEXT,
+                action_required INTEGER,
+                completed REAL,
+                PRIMARY KEY (gdb_id, dt, description)
+            );
+            CREATE TABLE IF NOT EXISTS logs (
+                gdb_id TEXT,
+                N INTEGER,
+                log TEXT,
+                PRIMARY KEY (gdb_id, N)
+            );
+            """ )
+        self.conn.commit()
+
+    def _execute( self, query, args=() ):
+        self.lock.acquire()
+        try:
+            cursor = self.conn.execute( query, args )
+            self.conn.commit()
+            return cursor.fetchall()
+        finally:
+            self.lock.release()
+
+    def close( self ):
+        self.lock.acquire()
+        try:
+            self.conn.close()
+        finally:
+            self.lock.release()
+
+    #---------------------------------------------
+    # events
+    #---------------------------------------------
+
+    def add_event( self, gdb_id, schedule ):
+        """
+        records a new event and every check in its schedule as pending.
+        Anything we already know about this event is left untouched
+        """
+        self.lock.acquire()
+        try:
+            self.conn.execute( "INSERT OR IGNORE INTO events (gdb_id, created) VALUES (?, ?)", (gdb_id, time.time()) )
+            self.conn.executemany( "INSERT OR IGNORE INTO checks (gdb_id, dt, description, state) VALUES (?, ?, ?, ?)", [(gdb_id, dt, description, PENDING) for dt, foo, kwargs, email, description in schedule] )
+            self.conn.commit()
+        finally:
+            self.lock.release()
+
+    def event( self, gdb_id ):
+        """
+        returns a dictionary describing this event, or None if we have never seen it
+        """
+        rows = self._execute( "SELECT * FROM events WHERE gdb_id=?", (gdb_id,) )
+        if rows:
+            return dict( rows[0] )
+        return None
+
+    def unfinished_events( self ):
+        """
+        the gdb_ids of all events that still have checks to perform
+        """
+        return [row['gdb_id'] for row in self._execute( "SELECT gdb_id FROM events WHERE finished=0 ORDER BY created" )]
+
+    def mark_annotated( self, gdb_id ):
+        """
+        record that the list of scheduled checks was written to GraceDB
+        """
+        self._execute( "UPDATE events SET annotated=1 WHERE gdb_id=?", (gdb_id,) )
+
+    def save_logs( self, gdb_id, logs ):
+        """
+        record the log messages (sorted by N) we have downloaded for this event, so a restarted supervisor does not download them again.
+        Only messages after the largest sequence number already recorded (last_N) are written
+        """
+        self.lock.acquire()
+        try:
+            row = self.conn.execute( "SELECT last_N FROM events WHERE gdb_id=?", (gdb_id,) ).fetchone()
+            if row is None:
+                return
+            new_logs = [log for log in logs if log['N'] > row['last_N']]
+            if not new_logs:
+                return
+            self.conn.executemany( "INSERT OR REPLACE INTO logs (gdb_id, N, log) VALUES (?, ?, ?)", [(gdb_id, log['N'], json.dumps( log )) for log in new_logs] )
+            self.conn.execute( "UPDATE events SET last_N=? WHERE gdb_id=?", (new_logs[-1]['N'], gdb_id) )
+            self.conn.commit()
+        finally:
+            self.lock.release()
+
+    def logs( self, gdb_id ):
+        """
+        the log messages recorded by save_logs, sorted by N
+        """
+        return [json.loads( row['log'] ) for row in self._execute( "SELECT log FROM logs WHERE gdb_id=? ORDER BY N", (gdb_id,) )]
+
+    def finish_event( self, gdb_id ):
+        """
+        record that all checks were performed and the final annotation was written
+        """
+        self._execute( "UPDATE events SET finished=1 WHERE gdb_id=?", (gdb_id,) )
+
+    #---------------------------------------------
+    # checks
+    #---------------------------------------------
+
+    def checks( self, gdb_id ):
+        """
+        returns a dictionary mapping (dt, description) -> (state, action_required) for this event
+        """
+        return dict( ((row['dt'], row['description']), (row['state'], row['action_required'])) for row in self._execute( "SELECT * FROM checks WHERE gdb_id=?", (gdb_id,) ) )
+
+    def set_state( self, gdb_id, dt, description, state, action_required=None ):
+        """
+        update the state of a single check
+        """
+        if state in finished_states:
+            completed = time.time()
+        else:
+            completed = None
+        if action_required is not None:
+            action_required = int(action_required)
+        self._execute( "UPDATE checks SET state=?, action_required=?, completed=? WHERE gdb_id=? AND dt=? AND description=?", (state, action_required, completed, gdb_id, dt, description) )
+
+    def cancel( self, gdb_id ):
+        """
+        mark every check for this event that has not been performed as cancelled
+        """
+        self._execute( "UPDATE checks SET state=?, completed=? WHERE gdb_id=? AND state IN (?, ?)", (CANCELLED, time.time(), gdb_id, PENDING, STARTED) )
@@ -0,0 +1,399 @@
+description = """ a module of utilities shared by the event_supervisor executables. These perform the scheduled checks defined in supervisor_checks and notify humans about the results """
+
+#=================================================
+
+import os
+import time
+import urlparse
+import threading
+import traceback
+
+from multiprocessing.pool import ThreadPool
+
+from grinch import supervisor_checks as checks
+from grinch import supervisor_store as store
+from grinch import gpstime
+report = checks.report
+errReport = checks.errReport
+
+#=================================================
+# properties of events
+#=================================================
+
+def event_type( gdb_entry ):
+    """
+    determines the event type (used to name sections of the config file) from a GraceDB event dictionary
+    """
+    if gdb_entry.has_key('search'):
+        event_type = "%s_%s_%s"%(gdb_entry['group'], gdb_entry['pipeline'], gdb_entry['search'])
+    else:
+        event_type = "%s_%s"%(gdb_entry['group'], gdb_entry['pipeline'])
+    return event_type.lower() ### cast to all lower case to match config file sections
+
+def creation_time( gdb_entry ):
+    """
+    parses the creation time from a GraceDB event dictionary into seconds since the epoch
+    """
+    return gpstime.to_unix( gdb_entry['created'] )
+
+def event_url( gracedb, gdb_id ):
+    """
+    the url a human should visit to see this event
+    """
+    return "%s/events/view/%s"%(gracedb.service_url[:-4], gdb_id)
+
+def schedule_kwargs( gdb_entry, verbose=False ):
+    """
+    extra kwargs for config_to_schedule based on the event itself
+    """
+    kwargs = {'verbose':verbose}
+    if gdb_entry['extra_attributes'].has_key('MultiBurst'): ### HARD CODED FOR CWB EVENTS!
+        kwargs.update( {'freq': gdb_entry['extra_attributes']['MultiBurst']['central_freq']} )
+    return kwargs
+
+def event_snapshot( gracedb, gdb_id, config, event_index=None, verbose=False ):
+    """
+    sets up the EventSnapshot shared by all checks for this event, reading the ttls from config
+    """
+    if config.has_option('general', 'snapshot_ttl'):
+        ttl = config.getfloat('general', 'snapshot_ttl')
+    else:
+        ttl = 10.0
+    if config.has_option('general', 'snapshot_full_ttl'):
+        full_ttl = config.getfloat('general', 'snapshot_full_ttl')
+    else:
+        full_ttl = 60.0
+    return checks.EventSnapshot( gracedb, gdb_id, ttl=ttl, full_ttl=full_ttl, event_index=event_index, verbose=verbose )
+
+def event_index( config ):
+    """
+    sets up the EventTimeIndex shared by all events, reading how long we remember events and whether we are fed every event type from config
+    """
+    kwargs = {}
+    if config.has_option('general', 'event_index_span'):
+        kwargs['span'] = config.getfloat('general', 'event_index_span')
+    if config.has_option('general', 'event_index_all_types'):
+        kwargs['all_types'] = config.getboolean('general', 'event_index_all_types')
+    return checks.EventTimeIndex( **kwargs )
+
+def may_regress( config ):
+    """
+    returns None unless [general] satisfied_is_final is set, in which case we return the set of check descriptions that are evaluated at every scheduled dt regardless.
+    All other checks are dropped from the schedule once they report that no action is required
+    """
+    if not (config.has_option('general', 'satisfied_is_final') and config.getboolean('general', 'satisfied_is_final')):
+        return None
+    if config.has_option('general', 'may_regress'):
+        return set( config.get('general', 'may_regress').split() )
+    return checks.may_regress
+
+def satisfied( schedule, ind, action_required, may_regress ):
+    """
+    the indices of later evaluations of the check at ind that we no longer need because it passed
+    """
+    if (may_regress is None) or (action_required is None) or action_required or (schedule[ind][-1] in may_regress):
+        return []
+    return schedule.later( ind )
+
+#=================================================
+# performing checks
+#=================================================
+
+def remaining_checks( schedule_store, gracedb, gdb_id, schedule, annotate_gracedb=False, verbose=False ):
+    """
+    the indices of checks in schedule that still need to be performed according to schedule_store.
+    A check that was started but never recorded is only repeated if we cannot find its annotation in GraceDB
+    """
+    states = schedule_store.checks( gdb_id )
+    todo = []
+    recorded = {} ### description -> number of finished checks with that description
+    started = []
+    for ind, (dt, foo, kwargs, email, description) in enumerate(schedule):
+        state = states.get( (dt, description), (store.PENDING, None) )[0]
+        if state in store.finished_states:
+            recorded[description] = recorded.get(description, 0) + 1
+        elif state == store.STARTED:
+            started.append( ind )
+        else:
+            todo.append( ind )
+
+    if started and annotate_gracedb: ### look for annotations written just before we died
+        logs = gracedb.logs( gdb_id ).json()['log']
+        for ind in started:
+            dt, foo, kwargs, email, description = schedule[ind]
+            annotated = len([log for log in logs if ("event_supervisor checked : %s."%(description) in log['comment']) or ("event_supervisor attempted to check : %s,"%(description) in log['comment'])])
+            if annotated > recorded.get(description, 0):
+                if verbose:
+                    report( "%s : found annotation for interrupted check : %s"%(gdb_id, description) )
+                schedule_store.set_state( gdb_id, dt, description, store.DONE )
+                recorded[description] = recorded.get(description, 0) + 1
+            else:
+                todo.append( ind )
+    else:
+        todo += started
+
+    if verbose and (len(todo) < len(schedule)):
+        report( "%s : %d of %d checks were already performed"%(gdb_id, len(schedule)-len(todo), len(schedule)) )
+    return sorted(todo)
+
+def record_result( schedule_store, gdb_id, dt, description, action_required ):
+    """
+    records the outcome of perform_check (None means the check failed)
+    """
+    if action_required is None:
+        schedule_store.set_state( gdb_id, dt, description, store.FAILED )
+    else:
+        schedule_store.set_state( gdb_id, dt, description, store.DONE, action_required=action_required )
+
+def email( recipients, subject, body ):
+    """
+    sends an email to the recipients
+    """
+    os.system( "echo \"%s\" | mail -s \"%s\" %s"%(body, subject, " ".join(recipients)) )
+
+def check_INJ( gracedb, gdb_id, cancelled, annotate_gracedb=False, tagname=['event_supervisor'], verbose=False ):
+    """
+    checks whether this event is labeled "INJ". If so, we annotate GraceDB with the list of cancelled checks and return True
+    """
+    try:
+        if not checks.isINJ( gracedb, gdb_id, verbose=verbose ):
+            return False
+    except Exception as e:
+        report( "INJ check failed" )
+        errReport( "INJ check failed\n%s"%(traceback.format_exc()) )
+        return False
+
+    log = "event_supervisor ignoring this event because it is labeled \"INJ\" and cancelling checks : %s"%(", ".join(cancelled))
+    if annotate_gracedb:
+        gracedb.writeLog( gdb_id, log, tagname=tagname )
+    if verbose:
+        report( log )
+        report( "ignoring %s"%(gdb_id) )
+    return True
+
+def evaluate_check( gracedb, gdb_id, foo, kwargs, description, event_type, metrics=None ):
+    """
+    evaluates a single check, returning action_required. (foo -> True) means the check failed!
+    If metrics (a SupervisorMetrics) is supplied, we time the check and ask it for the logs that satisfied it so we can record its latency
+    """
+    if metrics is None:
+        return foo( gracedb, gdb_id, **kwargs )
+
+    returnLogs = metrics.wants_logs( foo )
+    start = time.time()
+    try:
+        if returnLogs:
+            action_required, logs = foo( gracedb, gdb_id, **dict(kwargs, returnLogs=True) )
+        else:
+            action_required = foo( gracedb, gdb_id, **kwargs )
+            logs = None
+    except:
+        metrics.observe_check( gracedb, gdb_id, event_type, description, time.time()-start, None )
+        raise
+
+    try:
+        metrics.observe_check( gracedb, gdb_id, event_type, description, time.time()-start, action_required, logs=logs )
+    except Exception:
+        errReport( "could not record metrics for %s\n%s"%(description, traceback.format_exc()) )
+    return action_required
+
+def perform_check( gracedb, gdb_id, foo, kwargs, recipients, description, event_type, event_url, annotate_gracedb=False, no_email=False, tagname=['event_supervisor'], metrics=None, verbose=False ):
+    """
+    performs a single scheduled check and notifies humans about the result.
+    returns action_required (True/False), or None if the check itself failed
+    """
+    try:
+        action_required = evaluate_check( gracedb, gdb_id, foo, kwargs, description, event_type, metrics=metrics ) ### perform this check
+    except Exception as e:
+        report( "check FAILED : %s -> %s"%(description, type(e)) )
+        errReport( "check Failed : %s\n%s"%(description, traceback.format_exc()) )
+        report_failure( gracedb, gdb_id, recipients, description, event_type, event_url, annotate_gracedb=annotate_gracedb, no_email=no_email, tagname=tagname, verbose=verbose )
+        return None
+
+    report_result( gracedb, gdb_id, action_required, recipients, description, event_type, event_url, annotate_gracedb=annotate_gracedb, no_email=no_email, tagname=tagname, verbose=verbose )
+    return action_required
+
+def report_result( gracedb, gdb_id, action_required, recipients, description, event_type, event_url, annotate_gracedb=False, no_email=False, tagname=['event_supervisor'], verbose=False ):
+    """
+    notifies humans about the result of a check
+    """
+    if action_required:
+        if no_email:
+            if verbose:
+                report( "\tevent_supervisor checked : %s. Action required! no email sent"%(description) )
+        elif recipients:
+            email( recipients, "action required for GraceDB event : %s (%s)"%(gdb_id, event_type), "action required for GraceDB event : %s (%s)\n%s"%(event_url, event_type, description) )
+            if annotate_gracedb:
+                log = "event_supervisor checked : %s. Action required! email sent to %s"%(description, ", ".join(recipients))
+                gracedb.writeLog( gdb_id, log, tagname=tagname )
+            if verbose:
+                report( "\tevent_supervisor checked : %s. Action required! email sent to %s"%(description, ", ".join(recipients)) )
+        else:
+            report( "WARNING: check requires action but no email recipients specified! No warning messages will be sent!" )
+            if annotate_gracedb:
+                log = "event_supervisor checked : %s. Action required! but no email specified"%(description)
+                gracedb.writeLog( gdb_id, log, tagname=tagname )
+            if verbose:
+                report( "\tevent_supervisor checked : %s. Action required! but no email specified"%(description) )
+
+    elif annotate_gracedb or verbose:
+        if annotate_gracedb:
+            log = "event_supervisor checked : %s. No action required."%(description)
+            gracedb.writeLog( gdb_id, log, tagname=tagname )
+        if verbose:
+            report( "\tevent_supervisor checked : %s. No action required."%(description) )
+
+def report_failure( gracedb, gdb_id, recipients, description, event_type, event_url, annotate_gracedb=False, no_email=False, tagname=['event_supervisor'], verbose=False ):
+    """
+    notifies humans that a check could not be performed
+    """
+    if no_email:
+        if verbose:
+            report( "\tcheck failed : %s. no email sent"%(description) )
+    elif recipients:
+        email( recipients, "check failed for GraceDB event : %s (%s)"%(gdb_id, event_type), "check failed for GraceDB event : %s (%s)\n%s"%(event_url, event_type, description) )
+        if annotate_gracedb:
+            log = "event_supervisor attempted to check : %s, but FAILED! email sent to %s"%(description, " ".join(recipients))
+            gracedb.writeLog( gdb_id, log, tagname=tagname )
+        if verbose:
+            report( "\tcheck failed : %s. email sent to %s"%(description, " ".join(recipients)) )
+    else:
+        report( "WARNING: check failed but no email recipients specified! No warning message will be sent!" )
+        if annotate_gracedb:
+            log = "event_supervisor attempted to check : %s, but FAILED! no email specified"%(description)
+            gracedb.writeLog( gdb_id, log, tagname=tagname )
+        if verbose:
+            report( "\tcheck failed : %s. but no email specified"%(description) )
+
+#=================================================
+# performing checks concurrently
+#=================================================
+
+def executor_from_config( config ):
+    """
+    sets up a CheckExecutor based on the [general] section of config
+    """
+    kwargs = {}
+    if config.has_option('general', 'workers'):
+        kwargs['workers'] = config.getint('general', 'workers')
+    if config.has_option('general', 'host_concurrency'):
+        kwargs['host_limit'] = config.getint('general', 'host_concurrency')
+    if config.has_option('general', 'check_timeout'):
+        kwargs['timeout'] = config.getfloat('general', 'check_timeout')
+    return CheckExecutor( **kwargs )
+
+class CheckTask( object ):
+    """
+    a single check handed to CheckExecutor and what became of it
+    """
+
+    def __init__( self, foo, kwargs ):
+        self.foo = foo
+        self.kwargs = kwargs
+        self.start = None ### when a worker began performing the check
+        self.done = False
+        self.abandoned = False ### we gave up waiting, but the check may still be running
+        self.result = None
+        self.error = None
+
+class CheckExecutor( object ):
+    """
+    performs checks that are due at the same time concurrently, so a slow GraceDB response for one check does not delay the others.
+    At most host_limit checks talk to any single GraceDB host at once. Checks beyond that wait in run() and are only handed to the pool once a slot is free,
+    so they never hold a worker while they wait. Each check is given timeout seconds, measured from when a worker starts performing it, before we give up on it.
+    Results are returned in the order in which the checks were supplied and keep whatever form the check functions return (including the (action_required, Logs) tuples produced with returnLogs=True).
+
+    A thread cannot be interrupted, so a check we give up on keeps its worker until it returns. Its host slot is freed straight away,
+    and we report how many abandoned checks are still holding workers.
+    """
+
+    def __init__( self, workers=8, host_limit=4, timeout=None ):
+        self.pool = ThreadPool( workers )
+        self.workers = workers
+        self.host_limit = host_limit
+        self.timeout = timeout
+
+        self.active = {} ### host -> number of checks handed to the pool and not yet finished or abandoned
+        self.abandoned = 0 ### checks we gave up on that are still running
+        self.condition = threading.Condition()
+
+    def host( self, gracedb ):
+        return urlparse.urlparse( getattr(gracedb, 'service_url', '') ).netloc
+
+    def _call( self, host, task, gracedb, gdb_id ):
+        self.condition.acquire()
+        try:
+            task.start = time.time()
+            self.condition.notifyAll() ### run() starts timing this check
+        finally:
+            self.condition.release()
+
+        try:
+            result = task.foo( gracedb, gdb_id, **task.kwargs )
+            error = None
+        except Exception:
+            result = None
+            error = traceback.format_exc()
+
+        self.condition.acquire()
+        try:
+            task.done = True
+            if task.abandoned:
+                self.abandoned -= 1
+                errReport( "%s : abandoned check %s finished after %.3f seconds. %d abandoned checks still hold workers"%(gdb_id, getattr(task.foo, '__name__', task.foo), time.time()-task.start, self.abandoned) )
+            else:
+                task.result = result
+                task.error = error
+                self.active[host] -= 1
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def run( self, gracedb, gdb_id, checks ):
+        """
+        performs each (foo, kwargs) in checks against this event.
+        returns a list of (result, error) pairs. error is None if the check completed; otherwise it describes why it did not (exception or timeout) and result is None
+        """
+        host = self.host( gracedb )
+        tasks = [CheckTask( foo, kwargs ) for foo, kwargs in checks]
+        queue = list(tasks)
+
+        self.condition.acquire()
+        try:
+            while True:
+                ### hand checks to the pool while this host has free slots
+                while queue and (self.active.get( host, 0 ) < self.host_limit):
+                    task = queue.pop(0)
+                    self.active[host] = self.active.get( host, 0 ) + 1
+                    self.pool.apply_async( self._call, (host, task, gracedb, gdb_id) )
+
+                ### give up on checks that have run for too long
+                now = time.time()
+                wait = None
+                freed = False
+                for task in tasks:
+                    if (task.start is None) or task.done or task.abandoned or (self.timeout is None):
+                        continue
+                    remaining = task.start + self.timeout - now
+                    if remaining <= 0:
+                        task.abandoned = True
+                        task.error = "timed out after %.3f seconds"%(self.timeout)
+                        self.active[host] -= 1
+                        self.abandoned += 1
+                        freed = True
+                        errReport( "%s : gave up on %s after %.3f seconds but it is still running. %d of %d workers are held by abandoned checks"%(gdb_id, getattr(task.foo, '__name__', task.foo), self.timeout, self.abandoned, self.workers) )
+                    elif (wait is None) or (remaining < wait):
+                        wait = remaining
+
+                if (not queue) and all([task.done or task.abandoned for task in tasks]):
+                    break
+                if not freed: ### otherwise go straight back to hand out the free slots
+                    self.condition.wait( wait )
+        finally:
+            self.condition.release()
+
+        return [(task.result, task.error) for task in tasks]
+
+    def close( self ):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,225 @@
+import time
+import Queue
+import socket
+import select
+import struct
+import datetime
+import threading
+import xml.etree.ElementTree as ElementTree
+
+#--------------------------------------------------------------------------------------
+# The VOEvent Transport Protocol (VTP)
+#--------------------------------------------------------------------------------------
+# Every VTP message is a 4 byte (network byte order) length followed by that many bytes of XML.
+# An author submits a VOEvent to a broker (Comet listens for us on port 5340) and the broker replies with
+# a Transport message with role "ack" or "nak". Brokers may also send "iamalive" messages, which we echo back.
+
+# How we identify ourselves in Transport messages
+local_ivorn = 'ivo://ligo.org/grinch/approval_processor'
+
+transport_template = """<?xml version='1.0' encoding='UTF-8'?>
+<trn:Transport role="{0}" version="1.0" xmlns:trn="http://telescope-networks.org/schema/Transport/v1.1" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://telescope-networks.org/schema/Transport/v1.1 http://telescope-networks.org/schema/Transport-v1.1.xsd">
+<Origin>{1}</Origin>
+<Response>{2}</Response>
+<TimeStamp>{3}</TimeStamp>
+</trn:Transport>"""
+
+def frame(payload):
+	if isinstance(payload, unicode):
+		payload = payload.encode('utf-8')
+	return struct.pack('!I', len(payload)) + payload
+
+def transportMessage(role, origin):
+	return transport_template.format(role, origin, local_ivorn, datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'))
+
+# Returns (role, origin) of a Transport message, or (None, None) for anything else
+def parseTransport(payload):
+	try:
+		root = ElementTree.fromstring(payload)
+	except Exception:
+		return None, None
+	if not root.tag.endswith('Transport'):
+		return None, None
+	origin = root.find('Origin')
+	if origin is not None:
+		origin = origin.text
+	return root.get('role'), origin
+
+#--------------------------------------------------------------------------------------
+# Sending VOEvents
+#--------------------------------------------------------------------------------------
+
+class TransportError(Exception):
+	pass
+
+class Delivery(object):
+	"""
+	the outcome of sending a single VOEvent. wait() returns True once the broker has acknowledged it
+	"""
+
+	def __init__(self, voevent):
+		self.voevent = voevent
+		self.acknowledged = False
+		self.error = None
+		self.done = threading.Event()
+
+	def finish(self, acknowledged, error=None):
+		self.acknowledged = acknowledged
+		self.error = error
+		self.done.set()
+
+	def wait(self, timeout=None):
+		self.done.wait(timeout)
+		if not self.done.isSet():
+			self.error = 'timed out after {0} s waiting for the broker'.format(timeout)
+		return self.acknowledged
+
+class VOEventSender(object):
+	"""
+	a long-lived VTP client that submits VOEvents to a broker straight from memory.
+	We keep the connection to the broker open between VOEvents and reconnect (with exponential backoff) whenever it is lost.
+	VOEvents wait in a queue holding at most max_queue of them, and a single thread sends them one at a time in order.
+	A VOEvent is given up after max_attempts failed attempts, and is never resent once the broker has replied with "nak".
+	"""
+
+	def __init__(self, host='localhost', port=5340, timeout=10.0, max_queue=100, max_attempts=5, min_backoff=0.5, max_backoff=30.0, logger=None):
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.max_attempts = max_attempts
+		self.min_backoff = min_backoff
+		self.max_backoff = max_backoff
+		self.logger = logger
+
+		self.queue = Queue.Queue(max_queue)
+		self.sock = None
+		self.backoff = 0
+		self.thread = None
+		self.lock = threading.Lock()
+
+	def log(self, msg):
+		if self.logger is not None:
+			self.logger.info('{0} -- VTP -- {1}'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), msg))
+
+	#--------------------------------------------------------------------------------------
+	# The public interface
+	#--------------------------------------------------------------------------------------
+	def start(self):
+		self.lock.acquire()
+		try:
+			if self.thread is None:
+				self.thread = threading.Thread(target=self._work)
+				self.thread.daemon = True
+				self.thread.start()
+		finally:
+			self.lock.release()
+
+	def send(self, voevent):
+		"""
+		queues voevent (the XML text) to be sent and returns a Delivery.
+		If the queue is full the Delivery fails immediately rather than delaying the caller
+		"""
+		self.start()
+		delivery = Delivery(voevent)
+		try:
+			self.queue.put_nowait(delivery)
+		except Queue.Full:
+			delivery.finish(False, 'outbound queue is full')
+		return delivery
+
+	def sendAndWait(self, voevent, timeout=60.0):
+		"""
+		sends voevent and waits for the broker's reply. Returns the Delivery
+		"""
+		delivery = self.send(voevent)
+		delivery.wait(timeout)
+		return delivery
+
+	def stop(self):
+		"""
+		sends everything already queued and closes the connection
+		"""
+		if self.thread is not None:
+			self.queue.put(None)
+			self.thread.join()
+			self.thread = None
+		self._disconnect()
+
+	#--------------------------------------------------------------------------------------
+	# Talking to the broker
+	#--------------------------------------------------------------------------------------
+	def _work(self):
+		while True:
+			delivery = self.queue.get()
+			if delivery is None:
+				return
+			self._deliver(delivery)
+
+	def _deliver(self, delivery):
+		error = None
+		self.backoff = 0 # each VOEvent gets the full set of attempts
+		for attempt in xrange(self.max_attempts):
+			try:
+				self._connect()
+				role = self._submit(delivery.voevent)
+				if role == 'ack':
+					delivery.finish(True)
+				else:
+					delivery.finish(False, 'broker replied with {0}'.format(role))
+				return
+			except (socket.error, TransportError), e:
+				error = str(e)
+				self.log('lost connection to {0}:{1} ({2})'.format(self.host, self.port, error))
+				self._disconnect()
+				if attempt < self.max_attempts-1:
+					self._wait()
+		delivery.finish(False, 'gave up after {0} attempts: {1}'.format(self.max_attempts, error))
+
+	def _wait(self):
+		if self.backoff:
+			self.backoff = min(2*self.backoff, self.max_backoff)
+		else:
+			self.backoff = self.min_backoff
+		time.sleep(self.backoff)
+
+	def _connect(self):
+		if self.sock is not None:
+			# The broker may have closed the connection since we last used it
+			readable, _, _ = select.select([self.sock], [], [], 0)
+			if readable and not self.sock.recv(1, socket.MSG_PEEK):
+				self._disconnect()
+		if self.sock is None:
+			self.sock = socket.create_connection((self.host, self.port), self.timeout)
+			self.log('connected to {0}:{1}'.format(self.host, self.port))
+
+	def _disconnect(self):
+		if self.sock is not None:
+			try:
+				self.sock.close()
+			except socket.error:
+				pass
+			self.sock = None
+
+	def _recv(self, n):
+		data = []
+		while n:
+			chunk = self.sock.recv(n)
+			if not chunk:
+				raise TransportError('connection closed by broker')
+			data.append(chunk)
+			n -= len(chunk)
+		return ''.join(data)
+
+	def _submit(self, voevent):
+		"""
+		sends a VOEvent and returns the role of the broker's reply ('ack' or 'nak')
+		"""
+		self.sock.sendall(frame(voevent))
+		while True:
+			length, = struct.unpack('!I', self._recv(4))
+			role, origin = parseTransport(self._recv(length))
+			if role in ['ack', 'nak']:
+				return role
+			elif role == 'iamalive':
+				self.sock.sendall(frame(transportMessage('iamalive', origin)))
+			# anything else is not meant for us
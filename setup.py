@@ -47,11 +47,15 @@ setup(
         'bin/find_data',
         'bin/start_comet',
         'bin/approval_processor',
+        'bin/approval_processor_daemon',
+        'bin/approval_processor_replay',
+        'bin/lvalert-run_approval_processor',
         'bin/gdb_processor_approval_processor',
 	'bin/gdb_processor_start_comet',
         'bin/lvalert-init_approval_processor',
         'bin/event_supervisor',
         'bin/event_supervisor_wrapper',
+        'bin/event_supervisor_daemon',
         'bin/event_supervisor_latency',
         'bin/event_supervisor_quantiles',
         'bin/gdb_processor_event_supervisor',
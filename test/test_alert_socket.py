@@ -0,0 +1,67 @@
+description = """ tests for grinch.alert_socket. Run with python -m unittest discover -s test """
+
+#=================================================
+
+import os
+import json
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+
+from grinch import alert_socket
+
+#=================================================
+
+alert = {'uid':"G1", 'alert_type':"new", 'object':{}, 'file':"", 'description':""}
+
+class AlertSocketTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join( self.tmpdir, "alerts.sock" )
+        self.received = []
+        self.server = None
+
+    def tearDown( self ):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree( self.tmpdir )
+
+    def serve( self, delay=0.0 ):
+        def callback( alert ):
+            self.received.append( alert )
+            time.sleep( delay )
+        self.server = alert_socket.AlertServer( self.path, callback )
+        self.server.start()
+
+    def test_accepted( self ):
+        self.serve()
+        self.assertEqual( alert_socket.send_alert( self.path, json.dumps( alert ) ), "OK" )
+        self.assertEqual( self.received, [alert] )
+
+    def test_not_json( self ):
+        self.serve()
+        self.assertTrue( alert_socket.send_alert( self.path, "not json" ).startswith( "ERROR" ) )
+        self.assertEqual( self.received, [] )
+
+    def test_no_server( self ):
+        self.assertRaises( alert_socket.ConnectError, alert_socket.send_alert, self.path, json.dumps( alert ) )
+
+    def test_lost_after_sending( self ):
+        ### the server has the alert but does not reply in time. This must not look like a failure to connect
+        self.serve( delay=1.0 )
+        try:
+            alert_socket.send_alert( self.path, json.dumps( alert ), timeout=0.2 )
+        except alert_socket.ConnectError:
+            self.fail( "timed out waiting for the reply, but reported a failure to connect" )
+        except socket.error:
+            pass
+        else:
+            self.fail( "expected a timeout" )
+        self.assertEqual( self.received, [alert] )
+
+if __name__ == "__main__":
+    unittest.main()
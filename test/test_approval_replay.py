@@ -0,0 +1,138 @@
+description = """ end-to-end tests of approval_processor, replaying a small alert stream through grinch.approval_replay. Run with python -m unittest discover -s test """
+
+#=================================================
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import ConfigParser
+import StringIO
+
+from grinch import approval_replay
+
+#=================================================
+
+config_text = """
+[default]
+default_farthresh = 3.17e-08
+hardware_inj = no
+force_all_internal = yes
+preliminary_internal = LIB, MBTAOnline, gstlal, CWB
+ignore_idq = CBC
+default_idqthresh = 0.01
+idq_pipelines = ovl
+humanscimons = yes
+advocates = yes
+advocate_text = replay
+skymap_ignore_list = BWB Online at CIT
+
+[general]
+flags = H1:A:1 L1:A:1
+
+[H1:A:1]
+wait = 1
+look_right = 1
+look_left = 1
+tags = data_quality
+
+[L1:A:1]
+wait = 1
+look_right = 1
+look_left = 1
+tags = data_quality
+"""
+
+def alert( graceid, alert_type, obj, filename="", description="" ):
+    return {'uid':graceid, 'alert_type':alert_type, 'object':obj, 'file':filename, 'description':description}
+
+def new( graceid, far ):
+    return alert( graceid, "new", {'graceid':graceid, 'gpstime':1126259462.0, 'pipeline':"CWB", 'group':"Burst", 'search':"AllSky", 'far':far, 'instruments':"H1,L1", 'labels':{}} )
+
+def stream( graceid ):
+    """
+    everything that arrives for an event that should be released : iDQ results, every signoff and a skymap
+    """
+    return [
+        new( graceid, 1e-9 ),
+        alert( graceid, "update", {'comment':"minimum glitch-FAP for ovl at H1 with x is 0.5"} ),
+        alert( graceid, "update", {'comment':"minimum glitch-FAP for ovl at L1 with x is 0.5"} ),
+        alert( graceid, "signoff", {'instrument':"H1", 'status':"OK", 'signoff_type':"OP"} ),
+        alert( graceid, "signoff", {'instrument':"L1", 'status':"OK", 'signoff_type':"OP"} ),
+        alert( graceid, "signoff", {'instrument':"", 'status':"OK", 'signoff_type':"ADV"} ),
+        alert( graceid, "update", {'tag_names':["lvem", "sky_loc"], 'issuer':{'display_name':"BAYESTAR"}}, filename="skymap.fits.gz" ),
+    ]
+
+#=================================================
+
+class ReplayTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.config = ConfigParser.SafeConfigParser()
+        self.config.readfp( StringIO.StringIO( config_text ) )
+
+    def actions( self, report, graceid ):
+        return [(action, detail) for t, gid, action, detail in report['actions'] if gid == graceid]
+
+    def test_release( self ):
+        alerts = stream( "G1" ) + [new( "G2", 1e-3 )]
+        report = approval_replay.replay( alerts, self.config, workers=2 )
+        self.assertTrue( report['alerts'] > len(alerts) ) ### our own actions were echoed back
+
+        actions = self.actions( report, "G1" )
+        voevents = [detail for action, detail in actions if action == "VOEvent"]
+        labels = [detail for action, detail in actions if action == "label"]
+        logs = [detail for action, detail in actions if action == "log"]
+        self.assertEqual( voevents, ["PR", "IN"] )
+        self.assertEqual( sorted( labels ), ["ADVREQ", "EM_READY", "H1OPS", "L1OPS"] )
+        for msg in ["AP: Candidate event passed SegDB overflow check.",
+                    "AP: Successfully sent VOEvent of type preliminary.",
+                    "AP: Finished running iDQ checks. Candidate event passed iDQ checks. 0.25 > 0.01",
+                    "AP: Last skymap submitted with lvem tag was skymap.fits.gz type BurstAllSky by BAYESTAR.",
+                    "AP: Successfully sent VOEvent of type initial."]:
+            self.assertEqual( logs.count( msg ), 1, msg )
+
+        ### the preliminary VOEvent goes out before the scimons and advocates are asked to sign off,
+        ### and the initial VOEvent only once the event is labeled EM_READY
+        order = [detail for action, detail in actions if action in ["VOEvent", "label"]]
+        for label in ["H1OPS", "L1OPS", "ADVREQ", "EM_READY"]:
+            self.assertTrue( order.index( "PR" ) < order.index( label ), order )
+        self.assertTrue( order.index( "EM_READY" ) < order.index( "IN" ), order )
+        self.assertTrue( logs.index( "AP: Candidate event passed SegDB overflow check." ) < logs.index( "AP: Successfully sent VOEvent of type preliminary." ) )
+
+        ### a loud background event is rejected before we query SegDB and nothing is sent
+        self.assertEqual( self.actions( report, "G2" ), [("log", "AP: No hardware injection found near event gpstime +/- 2 seconds."),
+                                                         ("log", "AP: Candidate event rejected due to large FAR. 0.001 >= 3.17e-08")] )
+        self.assertEqual( sorted( report['preliminary'].keys() ), ["G1"] )
+        self.assertTrue( report['stages']['VOEvent']['count'] >= 2 )
+
+    def test_no_echo( self ):
+        ### without the EM_READY label coming back to us, we never send the initial VOEvent
+        report = approval_replay.replay( stream( "G1" ), self.config, workers=2, echo=False )
+        self.assertEqual( report['alerts'], len(stream( "G1" )) )
+        actions = self.actions( report, "G1" )
+        self.assertEqual( [detail for action, detail in actions if action == "VOEvent"], ["PR"] )
+        self.assertEqual( [detail for action, detail in actions if action == "label"].count( "EM_READY" ), 1 )
+
+    def test_load_alerts( self ):
+        alerts = stream( "G1" )
+        tmpdir = tempfile.mkdtemp()
+        try:
+            lines = os.path.join( tmpdir, "alerts.txt" )
+            file_obj = open( lines, "w" )
+            file_obj.write( "\n".join( json.dumps( a ) for a in alerts ) + "\n" )
+            file_obj.close()
+            self.assertEqual( approval_replay.loadAlerts( lines ), alerts )
+
+            ### lvalert_listen passes along each message as a string
+            listed = os.path.join( tmpdir, "alerts.json" )
+            file_obj = open( listed, "w" )
+            json.dump( [json.dumps( a ) for a in alerts], file_obj )
+            file_obj.close()
+            self.assertEqual( approval_replay.loadAlerts( listed ), alerts )
+        finally:
+            shutil.rmtree( tmpdir )
+
+if __name__ == "__main__":
+    unittest.main()
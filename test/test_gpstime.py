@@ -0,0 +1,93 @@
+description = """ tests for grinch.gpstime. Run with python -m unittest discover -s test """
+
+#=================================================
+
+import calendar
+import unittest
+
+import numpy as np
+
+from grinch import gpstime
+
+#=================================================
+
+class DateStringTest( unittest.TestCase ):
+
+    def test_offsets( self ):
+        ### 2015-09-14 14:50:45 UTC
+        unix = 1442242245.0
+        for datestring in ["2015-09-14 14:50:45", "2015-09-14 14:50:45 UTC", "2015-09-14T14:50:45Z", "2015-09-14 14:50:45+00:00",
+                           "2015-09-14 09:50:45 -05:00", "2015-09-14 09:50:45-0500", "2015-09-14 16:50:45 +02:00", "2015-09-14 09:50:45 CDT"]:
+            self.assertEqual( gpstime.to_unix( datestring ), unix, datestring )
+
+    def test_fractional_seconds( self ):
+        self.assertAlmostEqual( gpstime.to_unix( "2015-09-14 09:50:45.25 -05:00" ), 1442242245.25 )
+
+class LeapSecondTest( unittest.TestCase ):
+
+    def test_epoch( self ):
+        self.assertEqual( gpstime.utc_to_gps( gpstime.GPS_EPOCH ), 0.0 )
+        self.assertEqual( gpstime.from_gps( 0 ), "1980-01-06 00:00:00" )
+        self.assertEqual( gpstime.to_gps( "1980-01-06 00:00:00" ), 0.0 )
+
+    def test_known_times( self ):
+        ### GW150914
+        self.assertEqual( gpstime.to_gps( "2015-09-14 09:50:45" ), 1126259462.0 )
+        self.assertEqual( gpstime.from_gps( 1126259462 ), "2015-09-14 09:50:45" )
+        self.assertEqual( gpstime.to_gps( "2017-01-01 00:00:00" ), 1167264018.0 )
+
+    def test_boundary( self ):
+        ### a leap second was inserted at the end of 2016-12-31
+        midnight = calendar.timegm( (2017, 1, 1, 0, 0, 0) )
+        self.assertEqual( gpstime.leap_seconds( midnight-1 ), 17 )
+        self.assertEqual( gpstime.leap_seconds( midnight ), 18 )
+        self.assertEqual( gpstime.utc_to_gps( midnight-1 ), 1167264016.0 )
+        self.assertEqual( gpstime.utc_to_gps( midnight ), 1167264018.0 )
+        self.assertEqual( gpstime.gps_to_utc( 1167264016 ), midnight-1 )
+        self.assertEqual( gpstime.gps_to_utc( 1167264018 ), midnight )
+        self.assertEqual( gpstime.from_gps( 1167264016 ), "2016-12-31 23:59:59" )
+
+    def test_round_trip( self ):
+        ### one second either side of every leap second, as an array
+        unix = np.concatenate( (gpstime.leap_unix-1, gpstime.leap_unix, gpstime.leap_unix+0.5) )
+        gps = gpstime.utc_to_gps( unix )
+        self.assertEqual( gps.shape, unix.shape )
+        self.assertTrue( np.all( gpstime.gps_to_utc( gps ) == unix ) )
+        self.assertTrue( np.all( gps - (unix - gpstime.GPS_EPOCH) == gpstime.leap_seconds( unix ) ) )
+
+class CentralTimeTest( unittest.TestCase ):
+
+    def test_offsets( self ):
+        self.assertEqual( gpstime.to_unix( "2015-07-01 12:00:00", tz=gpstime.CENTRAL ), calendar.timegm( (2015, 7, 1, 17, 0, 0) ) )
+        self.assertEqual( gpstime.to_unix( "2015-01-01 12:00:00", tz=gpstime.CENTRAL ), calendar.timegm( (2015, 1, 1, 18, 0, 0) ) )
+        self.assertEqual( gpstime.to_unix( "2015-07-01 12:00:00", tz="America/Chicago" ), calendar.timegm( (2015, 7, 1, 17, 0, 0) ) )
+        self.assertEqual( gpstime.from_unix( calendar.timegm( (2015, 7, 1, 17, 0, 0) ), tz=gpstime.CENTRAL, fmt="%Y-%m-%d %H:%M:%S %Z" ), "2015-07-01 12:00:00 CDT" )
+        self.assertEqual( gpstime.from_unix( calendar.timegm( (2015, 1, 1, 18, 0, 0) ), tz=gpstime.CENTRAL, fmt="%Y-%m-%d %H:%M:%S %Z" ), "2015-01-01 12:00:00 CST" )
+
+    def test_spring_forward( self ):
+        ### 2am CST on the second Sunday in March becomes 3am CDT
+        start = calendar.timegm( (2015, 3, 8, 8, 0, 0) )
+        self.assertEqual( gpstime.from_unix( start-1, tz=gpstime.CENTRAL ), "2015-03-08 01:59:59" )
+        self.assertEqual( gpstime.from_unix( start, tz=gpstime.CENTRAL ), "2015-03-08 03:00:00" )
+        self.assertEqual( gpstime.to_unix( "2015-03-08 01:59:59", tz=gpstime.CENTRAL ), start-1 )
+        self.assertEqual( gpstime.to_unix( "2015-03-08 03:00:00", tz=gpstime.CENTRAL ), start )
+
+    def test_fall_back( self ):
+        ### 2am CDT on the first Sunday in November becomes 1am CST, so 1am-2am happens twice
+        end = calendar.timegm( (2015, 11, 1, 7, 0, 0) )
+        self.assertEqual( gpstime.from_unix( end-1, tz=gpstime.CENTRAL ), "2015-11-01 01:59:59" )
+        self.assertEqual( gpstime.from_unix( end, tz=gpstime.CENTRAL ), "2015-11-01 01:00:00" )
+        self.assertEqual( gpstime.from_unix( end+3600, tz=gpstime.CENTRAL ), "2015-11-01 02:00:00" )
+        self.assertEqual( gpstime.to_unix( "2015-11-01 01:30:00", tz=gpstime.CENTRAL ), end+1800 ) ### the repeated hour is read as standard time
+
+    def test_before_2007( self ):
+        ### DST ran from the first Sunday in April until the last Sunday in October
+        self.assertEqual( gpstime.from_unix( calendar.timegm( (2006, 4, 2, 8, 0, 0) ), tz=gpstime.CENTRAL ), "2006-04-02 03:00:00" )
+        self.assertEqual( gpstime.from_unix( calendar.timegm( (2006, 3, 12, 18, 0, 0) ), tz=gpstime.CENTRAL ), "2006-03-12 12:00:00" )
+        self.assertEqual( gpstime.from_unix( calendar.timegm( (2006, 10, 29, 7, 0, 0) ), tz=gpstime.CENTRAL ), "2006-10-29 01:00:00" )
+
+    def test_gracedb_query_time( self ):
+        self.assertEqual( gpstime.gracedb_query_time( calendar.timegm( (2015, 9, 14, 9, 50, 45) ) ), "2015-09-14 04:50:45" )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+description = """ tests for grinch.quantiles. Run with python -m unittest discover -s test """
+
+#=================================================
+
+import json
+import unittest
+
+import numpy as np
+
+from grinch import quantiles
+
+#=================================================
+
+qs = np.array([0.0, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 1.0])
+
+def rank_error( sample, estimates, q ):
+    """
+    how far (as a fraction of the sample) the estimated quantiles lie from the ranks they should have
+    """
+    sample = np.sort( sample )
+    below = np.searchsorted( sample, estimates, side="left" )
+    above = np.searchsorted( sample, estimates, side="right" )
+    target = q*len(sample)
+    return np.max( np.maximum( 0, np.maximum( below-target, target-above ) ) ) / len(sample)
+
+class QuantileTest( unittest.TestCase ):
+
+    def test_percentile( self ):
+        a = np.random.RandomState( 0 ).lognormal( 0, 1, 1001 )
+        self.assertTrue( np.allclose( quantiles.quantile( a, qs ), np.percentile( a, 100*qs ) ) )
+        self.assertTrue( np.allclose( quantiles.quantile( np.sort( a ), qs, presorted=True ), np.percentile( a, 100*qs ) ) )
+        self.assertAlmostEqual( quantiles.quantile( [3, 1, 2, 4], 0.5 ), np.percentile( [3, 1, 2, 4], 50 ) )
+
+    def test_empty( self ):
+        self.assertRaises( ValueError, quantiles.quantile, [], 0.5 )
+
+class LatencySketchTest( unittest.TestCase ):
+
+    def setUp( self ):
+        rng = np.random.RandomState( 0 )
+        self.a = rng.lognormal( 0, 1, 20000 )
+        self.b = rng.lognormal( 1, 0.5, 10000 )
+
+    def test_exact_while_buffered( self ):
+        sketch = quantiles.LatencySketch( delta=100 )
+        sketch.add( self.a[:300] )
+        sketch.add( self.a[300:400] )
+        self.assertEqual( sketch.count(), 400 )
+        self.assertTrue( np.allclose( sketch.quantile( qs ), np.percentile( self.a[:400], 100*qs ) ) )
+
+    def test_compressed( self ):
+        sketch = quantiles.LatencySketch( delta=100 )
+        for chunk in np.array_split( self.a, 37 ):
+            sketch.add( chunk )
+        self.assertEqual( sketch.count(), len(self.a) )
+        self.assertTrue( len(sketch.means) < 200 )
+        estimates = sketch.quantile( qs )
+        self.assertEqual( estimates[0], self.a.min() )
+        self.assertEqual( estimates[-1], self.a.max() )
+        self.assertTrue( rank_error( self.a, estimates, qs ) < 0.005 )
+        self.assertTrue( np.all( np.abs( estimates[1:-1]/np.percentile( self.a, 100*qs[1:-1] ) - 1 ) < 0.05 ) )
+
+    def test_merge( self ):
+        sketch = quantiles.LatencySketch( delta=100 )
+        sketch.add( self.a )
+        other = quantiles.LatencySketch( delta=100 )
+        other.add( self.b )
+        sketch.merge( other )
+        both = np.concatenate( (self.a, self.b) )
+        self.assertEqual( sketch.count(), len(both) )
+        self.assertTrue( rank_error( both, sketch.quantile( qs ), qs ) < 0.005 )
+
+    def test_round_trip( self ):
+        sketch = quantiles.LatencySketch( delta=100 )
+        sketch.add( self.a )
+        sketch.add( [np.inf, np.nan] )
+        copy = quantiles.LatencySketch.from_dict( json.loads( json.dumps( sketch.to_dict() ) ) )
+        self.assertEqual( copy.count(), sketch.count() )
+        self.assertEqual( copy.n_infinite, 1 )
+        self.assertTrue( np.allclose( copy.quantile( qs ), sketch.quantile( qs ) ) )
+
+    def test_empty( self ):
+        sketch = quantiles.LatencySketch()
+        sketch.add( [np.inf, np.nan] )
+        self.assertEqual( sketch.count(), 0 )
+        self.assertEqual( sketch.n_infinite, 1 )
+        self.assertRaises( ValueError, sketch.quantile, 0.5 )
+
+if __name__ == "__main__":
+    unittest.main()
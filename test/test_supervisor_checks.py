@@ -0,0 +1,110 @@
+description = """ tests for the EventTimeIndex behind local_rates in grinch.supervisor_checks. Run with python -m unittest discover -s test """
+
+#=================================================
+
+import time
+import unittest
+
+from grinch import gpstime
+from grinch import supervisor_checks as checks
+
+#=================================================
+
+start = float(int(time.time()) - 600) ### unix time at which we start listening. The index forgets anything older than an hour
+t0 = gpstime.utc_to_gps( start ) + 100
+
+def entry( graceid, dt, group="CBC", pipeline="gstlal", search="LowMass" ):
+    """
+    a GraceDB event dictionary for an event dt seconds after t0, created 10 seconds later
+    """
+    return {'graceid':graceid, 'group':group, 'pipeline':pipeline, 'search':search, 'gpstime':t0+dt,
+            'created':gpstime.from_gps( t0+dt+10, fmt="%Y-%m-%d %H:%M:%S UTC" )}
+
+class Response( object ):
+
+    def __init__( self, data ):
+        self.data = data
+
+    def json( self ):
+        return self.data
+
+class GraceDb( object ):
+    """
+    holds a list of events and an EventTimeIndex, as an EventSnapshot would. Records every query
+    """
+    def __init__( self, entries, event_index ):
+        self.entries = dict( (e['graceid'], e) for e in entries )
+        self.event_index = event_index
+        self.queries = []
+
+    def event( self, gdb_id ):
+        return Response( self.entries[gdb_id] )
+
+    def events( self, query ):
+        self.queries.append( query )
+        first, last = [float(t) for t in query.split( ".." )]
+        return [e for e in self.entries.values() if first <= e['gpstime'] <= last]
+
+#=================================================
+
+class EventTimeIndexTest( unittest.TestCase ):
+
+    def test_covers( self ):
+        index = checks.EventTimeIndex( start=start )
+        self.assertFalse( index.covers( "event_time", t0, event_type="CBC_gstlal_LowMass" ) ) ### never fed this type
+        index.add( entry( "G1", 0 ) )
+        self.assertTrue( index.covers( "event_time", t0, event_type="CBC_gstlal_LowMass" ) )
+        self.assertTrue( index.covers( "creation_time", start, event_type="CBC_gstlal_LowMass" ) )
+        self.assertFalse( index.covers( "event_time", t0 - 200, event_type="CBC_gstlal_LowMass" ) ) ### before we started listening
+        self.assertFalse( index.covers( "event_time", t0, event_type="Test_gstlal_LowMass" ) )
+        self.assertFalse( index.covers( "event_time", t0 ) ) ### we may not be fed every node
+
+        index = checks.EventTimeIndex( start=start, all_types=True )
+        self.assertTrue( index.covers( "event_time", t0 ) )
+        self.assertFalse( index.covers( "event_time", t0, event_type="Test_gstlal_LowMass" ) ) ### but not for a type we have not seen
+
+    def test_neighbors( self ):
+        index = checks.EventTimeIndex( start=start )
+        for e in [entry( "G3", 3 ), entry( "G1", 0 ), entry( "T2", 1, group="Test" )]:
+            index.add( e )
+        index.add( entry( "G1", 0 ) ) ### repeated alerts are ignored
+        self.assertEqual( index.neighbors( "event_time", t0, t0+2 ), [("G1", "CBC_gstlal_LowMass"), ("T2", "Test_gstlal_LowMass")] )
+        self.assertEqual( [gdb_id for gdb_id, e_type in index.neighbors( "creation_time", start, start+1000 )], ["G1", "T2", "G3"] )
+
+class LocalRatesTest( unittest.TestCase ):
+
+    def setUp( self ):
+        ### 3 events of our type and 3 test events within a second of G0. Test events arrive on a node we do not subscribe to
+        self.ours = [entry( "G%d"%i, 0.5*i ) for i in xrange(3)]
+        self.others = [entry( "T%d"%i, 0.5*i, group="Test" ) for i in xrange(3)]
+
+    def gracedb( self, entries, all_types=False ):
+        index = checks.EventTimeIndex( start=start, all_types=all_types )
+        for e in entries:
+            if all_types or e['group'] == "CBC":
+                index.add( e )
+        return GraceDb( entries, index )
+
+    def test_total_from_gracedb( self ):
+        ### 6 events in a 2 second window : only the total exceeds the threshold of 5, and only GraceDB knows about the test events
+        gdb = self.gracedb( self.ours + self.others )
+        self.assertTrue( checks.local_rates( gdb, "G0", window=1.0, rate_thr=2.5 ) )
+        self.assertEqual( len(gdb.queries), 1 )
+
+        gdb = self.gracedb( self.ours )
+        self.assertFalse( checks.local_rates( gdb, "G0", window=1.0, rate_thr=2.5 ) )
+        self.assertEqual( len(gdb.queries), 1 )
+
+    def test_all_types_indexed( self ):
+        gdb = self.gracedb( self.ours + self.others, all_types=True )
+        self.assertTrue( checks.local_rates( gdb, "G0", window=1.0, rate_thr=2.5 ) )
+        self.assertEqual( gdb.queries, [] )
+
+    def test_type_rate_from_index( self ):
+        ### our own type already exceeds the threshold of 2, so the total does not matter
+        gdb = self.gracedb( self.ours + self.others )
+        self.assertTrue( checks.local_rates( gdb, "G0", window=1.0, rate_thr=1.0 ) )
+        self.assertEqual( gdb.queries, [] )
+
+if __name__ == "__main__":
+    unittest.main()
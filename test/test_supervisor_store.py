@@ -0,0 +1,130 @@
+description = """ tests for grinch.supervisor_store and resuming event_supervisor from it. Run with python -m unittest discover -s test """
+
+#=================================================
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from grinch import supervisor_store as store
+from grinch import supervisor_utils
+
+#=================================================
+
+def check( **kwargs ):
+    return False
+
+### (dt, foo, kwargs, email, description) as built by supervisor_utils.config_to_schedule
+schedule = [
+    (10.0, check, {}, [], "far check"),
+    (10.0, check, {}, [], "local rates check"),
+    (30.0, check, {}, [], "far check"),
+    (60.0, check, {}, [], "idq start check"),
+    (120.0, check, {}, [], "idq finish check"),
+]
+
+class Response( object ):
+
+    def __init__( self, data ):
+        self.data = data
+
+    def json( self ):
+        return self.data
+
+class GraceDb( object ):
+    """
+    just enough of the GraceDB client for remaining_checks
+    """
+    def __init__( self, comments ):
+        self.comments = comments
+
+    def logs( self, gdb_id ):
+        return Response( {'log':[{'comment':comment} for comment in self.comments]} )
+
+#=================================================
+
+class ScheduleStoreTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = store.store_path( self.tmpdir )
+        self.store = store.ScheduleStore( self.path )
+
+    def tearDown( self ):
+        self.store.close()
+        shutil.rmtree( self.tmpdir )
+
+    def reopen( self ):
+        """
+        what a restarted event_supervisor sees
+        """
+        self.store.close()
+        self.store = store.ScheduleStore( self.path )
+
+    def test_resume( self ):
+        self.store.add_event( "G1", schedule )
+        self.store.add_event( "G2", schedule[:2] )
+        self.store.set_state( "G1", 10.0, "far check", store.DONE, action_required=False )
+        self.store.set_state( "G1", 10.0, "local rates check", store.FAILED )
+        self.store.set_state( "G1", 30.0, "far check", store.STARTED )
+        self.store.mark_annotated( "G1" )
+        self.store.finish_event( "G2" )
+        self.reopen()
+
+        self.assertTrue( os.path.exists( self.path ) )
+        self.assertEqual( self.store.unfinished_events(), ["G1"] )
+        self.assertEqual( self.store.event( "G1" )['annotated'], 1 )
+        self.assertEqual( self.store.event( "G3" ), None )
+        checks = self.store.checks( "G1" )
+        self.assertEqual( checks[(10.0, "far check")], (store.DONE, 0) )
+        self.assertEqual( checks[(10.0, "local rates check")], (store.FAILED, None) )
+        self.assertEqual( checks[(30.0, "far check")], (store.STARTED, None) )
+        self.assertEqual( checks[(120.0, "idq finish check")], (store.PENDING, None) )
+
+        ### adding the event again (as we do when we resume) leaves what we know untouched
+        self.store.add_event( "G1", schedule )
+        self.assertEqual( self.store.checks( "G1" ), checks )
+
+        ### the interrupted check is repeated along with those we never started
+        self.assertEqual( supervisor_utils.remaining_checks( self.store, None, "G1", schedule ), [2, 3, 4] )
+
+    def test_resume_annotated( self ):
+        self.store.add_event( "G1", schedule )
+        self.store.set_state( "G1", 10.0, "far check", store.DONE )
+        self.store.set_state( "G1", 30.0, "far check", store.STARTED )
+        self.store.set_state( "G1", 60.0, "idq start check", store.STARTED )
+        self.reopen()
+
+        ### the second far check wrote its annotation before we died, so we only record it
+        gracedb = GraceDb( ["event_supervisor checked : far check.", "event_supervisor checked : far check."] )
+        self.assertEqual( supervisor_utils.remaining_checks( self.store, gracedb, "G1", schedule, annotate_gracedb=True ), [1, 3, 4] )
+        self.assertEqual( self.store.checks( "G1" )[(30.0, "far check")][0], store.DONE )
+
+    def test_cancel( self ):
+        self.store.add_event( "G1", schedule )
+        self.store.set_state( "G1", 10.0, "far check", store.DONE )
+        self.store.set_state( "G1", 30.0, "far check", store.STARTED )
+        self.store.cancel( "G1" )
+        states = dict( (key, state) for key, (state, action_required) in self.store.checks( "G1" ).items() )
+        self.assertEqual( states.pop( (10.0, "far check") ), store.DONE )
+        self.assertEqual( set( states.values() ), set( [store.CANCELLED] ) )
+        self.assertEqual( supervisor_utils.remaining_checks( self.store, None, "G1", schedule ), [] )
+
+    def test_logs( self ):
+        self.store.add_event( "G1", schedule )
+        logs = [{'N':N, 'comment':"message %d"%N, 'tag_names':[]} for N in xrange(1, 4)]
+        self.store.save_logs( "G1", logs[:2] )
+        self.store.save_logs( "G1", logs ) ### only N=3 is new
+        self.store.save_logs( "G2", logs ) ### we never added G2, so this is ignored
+        self.reopen()
+        self.assertEqual( self.store.logs( "G1" ), logs )
+        self.assertEqual( self.store.event( "G1" )['last_N'], 3 )
+        self.assertEqual( self.store.logs( "G2" ), [] )
+
+        ### messages we already hold are not rewritten
+        self.store.save_logs( "G1", [dict( logs[0], comment="changed" )] )
+        self.assertEqual( self.store.logs( "G1" ), logs )
+
+if __name__ == "__main__":
+    unittest.main()
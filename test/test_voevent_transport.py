@@ -0,0 +1,143 @@
+description = """ tests for grinch.voevent_transport. Run with python -m unittest discover -s test """
+
+#=================================================
+
+import socket
+import struct
+import threading
+import unittest
+
+from grinch import voevent_transport
+
+#=================================================
+
+voevent = "<?xml version='1.0' encoding='UTF-8'?>\n<voe:VOEvent xmlns:voe=\"http://www.ivoa.net/xml/VOEvent/v2.0\" ivorn=\"ivo://gwnet/LVC#G1-1-Preliminary\" role=\"test\" version=\"2.0\"/>"
+
+def recv( conn, n ):
+    """
+    read exactly n bytes, or None if the connection closes first
+    """
+    data = ""
+    while len(data) < n:
+        chunk = conn.recv( n-len(data) )
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def recv_message( conn ):
+    header = recv( conn, 4 )
+    if header is None:
+        return None
+    return recv( conn, struct.unpack( "!I", header )[0] )
+
+class Broker( object ):
+    """
+    a minimal VTP broker on an ephemeral port. Replies to every VOEvent with role, after an iamalive exchange if iamalive
+    """
+    def __init__( self, role="ack", iamalive=False ):
+        self.role = role
+        self.iamalive = iamalive
+        self.received = []
+        self.echoes = []
+        self.connections = 0
+        self.sock = socket.socket()
+        self.sock.bind( ("localhost", 0) )
+        self.sock.listen( 1 )
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread( target=self.run )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run( self ):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            while True:
+                payload = recv_message( conn )
+                if payload is None:
+                    break
+                self.received.append( payload )
+                if self.iamalive:
+                    conn.sendall( voevent_transport.frame( voevent_transport.transportMessage( "iamalive", "ivo://broker" ) ) )
+                    self.echoes.append( voevent_transport.parseTransport( recv_message( conn ) ) )
+                conn.sendall( voevent_transport.frame( voevent_transport.transportMessage( self.role, "ivo://broker" ) ) )
+            conn.close()
+
+    def close( self ):
+        self.sock.shutdown( socket.SHUT_RDWR ) ### close() alone does not wake up the thread waiting in accept()
+        self.sock.close()
+        self.thread.join()
+
+#=================================================
+
+class FrameTest( unittest.TestCase ):
+
+    def test_length_prefix( self ):
+        framed = voevent_transport.frame( voevent )
+        self.assertEqual( struct.unpack( "!I", framed[:4] )[0], len(voevent) )
+        self.assertEqual( framed[4:], voevent )
+
+    def test_unicode( self ):
+        payload = u"<Origin>\u00e9</Origin>"
+        framed = voevent_transport.frame( payload )
+        self.assertEqual( struct.unpack( "!I", framed[:4] )[0], len(payload.encode( "utf-8" )) )
+        self.assertEqual( framed[4:].decode( "utf-8" ), payload )
+
+    def test_round_trip( self ):
+        for role in ["ack", "nak", "iamalive"]:
+            framed = voevent_transport.frame( voevent_transport.transportMessage( role, "ivo://broker" ) )
+            length = struct.unpack( "!I", framed[:4] )[0]
+            self.assertEqual( voevent_transport.parseTransport( framed[4:4+length] ), (role, "ivo://broker") )
+
+    def test_not_transport( self ):
+        self.assertEqual( voevent_transport.parseTransport( voevent ), (None, None) )
+        self.assertEqual( voevent_transport.parseTransport( "not xml" ), (None, None) )
+
+class SenderTest( unittest.TestCase ):
+
+    def sender( self, port ):
+        return voevent_transport.VOEventSender( port=port, timeout=5.0, max_attempts=2, min_backoff=0.01 )
+
+    def test_ack( self ):
+        broker = Broker( iamalive=True )
+        sender = self.sender( broker.port )
+        try:
+            for i in xrange(3):
+                delivery = sender.sendAndWait( voevent, timeout=10.0 )
+                self.assertTrue( delivery.acknowledged, delivery.error )
+        finally:
+            sender.stop()
+            broker.close()
+        self.assertEqual( broker.received, [voevent]*3 )
+        self.assertEqual( broker.connections, 1 ) ### the connection is kept open between VOEvents
+        self.assertEqual( broker.echoes, [("iamalive", "ivo://broker")]*3 )
+
+    def test_nak( self ):
+        broker = Broker( role="nak" )
+        sender = self.sender( broker.port )
+        try:
+            delivery = sender.sendAndWait( voevent, timeout=10.0 )
+        finally:
+            sender.stop()
+            broker.close()
+        self.assertFalse( delivery.acknowledged )
+        self.assertEqual( broker.received, [voevent] ) ### never resent after a nak
+
+    def test_no_broker( self ):
+        sock = socket.socket() ### hold a port nobody listens on, so connections are refused
+        sock.bind( ("localhost", 0) )
+        sender = self.sender( sock.getsockname()[1] )
+        try:
+            delivery = sender.sendAndWait( voevent, timeout=10.0 )
+        finally:
+            sender.stop()
+            sock.close()
+        self.assertFalse( delivery.acknowledged )
+        self.assertTrue( delivery.error.startswith( "gave up after 2 attempts" ), delivery.error )
+
+if __name__ == "__main__":
+    unittest.main()